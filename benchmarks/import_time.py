@@ -0,0 +1,193 @@
+""" Startup time of malachite-cli commands.
+
+    Each command runs in a fresh interpreter, as it would from a shell, and
+    reports its wall time (interpreter startup included) along with the
+    heavy libraries it ended up importing. Commands below only read an
+    existing topology (export file or snapshot database) : none of them
+    should import napalm, and the benchmark fails if one does.
+
+    The topology they read is collected once, beforehand, from a synthetic
+    network served by the replay driver (see synthetic.py).
+
+    Usage :
+
+        $ python benchmarks/import_time.py -s 200 -r 5 -o startup.json
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from synthetic import TOPOLOGIES, generate
+
+
+# Libraries slow to import, and whether read only commands may load them
+HEAVY_MODULES = {
+    'napalm': False,
+    'igraph': True,
+    'plotly': True,
+    'numpy': True,
+}
+
+# Run in the child interpreter : import the CLI, run one command, and
+# write timings and loaded modules to the file given as first argument
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from malachite.scripts.cli_script import cli
+imported = time.perf_counter()
+try:
+    cli.main(args=sys.argv[2:], prog_name='malachite-cli',
+             standalone_mode=False)
+except SystemExit:
+    pass
+done = time.perf_counter()
+with open(sys.argv[1], 'w') as r_file:
+    json.dump({
+        'import_s': imported - start,
+        'command_s': done - imported,
+        'modules': sorted(name for name in %r if name in sys.modules),
+    }, r_file)
+''' % sorted(HEAVY_MODULES)
+
+
+def collect(topology, size, workdir):
+    """ Collect a synthetic network and save it as an export file, and as
+        a snapshot database.
+
+        :return: Export filename, database filename and two appliance
+                 names.
+        :rtype: tuple
+    """
+    from malachite.malachite import Malachite
+    from malachite.topology_db import TopologyDB
+    from malachite.utils.config import CONFIG
+
+    inventory, fixtures, _ = generate(topology, size, workdir)
+    CONFIG['default']['replay']['replay_dir'] = fixtures
+
+    malachite = Malachite(app_file=inventory, layout_cache=None)
+    malachite.load_appliances()
+    malachite.load_edges()
+    malachite.aggregate_edges()
+    malachite.build_coordinates()
+
+    export_file = os.path.join(workdir, 'topology.npz')
+    malachite.save_export(export_file)
+    db_file = os.path.join(workdir, 'topology.db')
+    db = TopologyDB(db_file)
+    malachite.save_snapshot(db)
+    db.close()
+
+    names = [appliance.name for appliance in malachite.loader.appliances]
+    return export_file, db_file, names[0], names[-1]
+
+
+def commands(export_file, db_file, source, destination, workdir):
+    """Benchmarked commands, by label"""
+    html = os.path.join(workdir, 'render.html')
+    return [
+        ('import only', []),
+        ('--help', ['--help']),
+        ('--version', ['--version']),
+        ('history', ['history', '--db', db_file]),
+        ('query path (export)', [
+            'query', '--from-file', export_file,
+            'path', source, destination,
+        ]),
+        ('query components (export)', [
+            'query', '--from-file', export_file, 'components',
+        ]),
+        ('query path (snapshot)', [
+            'query', '--db', db_file, 'path', source, destination,
+        ]),
+        ('render (export)', [
+            'render', '--from-file', export_file, '-o', html,
+        ]),
+    ]
+
+
+def run_command(args, workdir):
+    """ Run a CLI command in a new interpreter.
+
+        :return: Wall time, and what the child reported.
+        :rtype: tuple(float, dict)
+    """
+    result_file = os.path.join(workdir, 'child.json')
+    # Keep plotly from opening a browser
+    env = dict(os.environ, BROWSER='true')
+
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', CHILD, result_file] + args,
+        env=env, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wall = time.perf_counter() - start
+
+    with open(result_file) as r_file:
+        return wall, json.load(r_file)
+
+
+@click.command()
+@click.option('-t', '--topology', type=click.Choice(sorted(TOPOLOGIES)),
+              default='spine-leaf', help='Topology of the synthetic network')
+@click.option('-s', '--size', type=click.IntRange(min=2), default=100,
+              help='Number of appliances')
+@click.option('-r', '--repeat', type=click.IntRange(min=1), default=3,
+              help='Runs of each command (best one is kept)')
+@click.option('-o', '--output', type=click.File('w'), default='-')
+def main(topology, size, repeat, output):
+    """Time CLI startup and check which libraries each command loads"""
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'topology': topology,
+        'size': size,
+        'commands': [],
+    }
+    unexpected = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        export_file, db_file, source, destination = collect(
+            topology, size, workdir
+        )
+        for label, args in commands(export_file, db_file, source,
+                                    destination, workdir):
+            runs = [run_command(args, workdir) for _ in range(repeat)]
+            wall, child = min(runs, key=lambda run: run[0])
+            report['commands'].append({
+                'command': label,
+                'args': args,
+                'wall_s': round(wall, 4),
+                'import_s': round(child['import_s'], 4),
+                'command_s': round(child['command_s'], 4),
+                'modules': child['modules'],
+            })
+            click.echo('%-28s %7.3fs (cli import %.3fs) %s' % (
+                label, wall, child['import_s'],
+                ', '.join(child['modules']) or '-'
+            ), err=True)
+
+            unexpected.extend(
+                (label, module) for module in child['modules']
+                if not HEAVY_MODULES[module]
+            )
+
+    json.dump(report, output, indent=2)
+    output.write('\n')
+
+    if unexpected:
+        raise click.ClickException(', '.join(
+            '%s imported %s' % pair for pair in unexpected
+        ))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,155 @@
+""" Stage level benchmark of malachite on synthetic networks.
+
+    For every topology/size pair, a synthetic network is generated (see
+    synthetic.py) and served by the replay driver, then each stage of the
+    pipeline is timed separately : wall time, python heap peak (tracemalloc)
+    and process max RSS.
+
+    Usage :
+
+        $ python benchmarks/run_benchmarks.py -t spine-leaf -t mesh \\
+              -s 10 -s 1000 -o bench.json
+"""
+
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+from malachite.loader import Loader
+from malachite.plotly_helper import PlotlyHelper
+from malachite.utils.config import CONFIG
+
+from synthetic import TOPOLOGIES, generate
+
+
+STAGES = [
+    'load_nodes',
+    'build_edges',
+    'aggregate_edges',
+    'build_coordinates',
+    'build_edge_scatter',
+    'plot',
+]
+
+
+def _measure(func, trace_memory=True):
+    """ Run func() and measure it.
+
+        :return: func() result, and stage metrics.
+        :rtype: tuple(object, dict)
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result = func()
+    wall = time.perf_counter() - start
+
+    metrics = {'wall_s': round(wall, 6)}
+    if trace_memory:
+        metrics['peak_heap_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    metrics['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return result, metrics
+
+
+def run_one(topology, size, workers, skip, trace_memory, workdir):
+    """ Generate a network and time every stage on it.
+
+        :return: Run description and metrics of each stage.
+        :rtype: dict
+    """
+    inventory, fixtures, links = generate(topology, size, workdir)
+    CONFIG['default']['replay']['replay_dir'] = fixtures
+
+    run = {
+        'topology': topology,
+        'size': size,
+        'links': len(links),
+        'workers': workers,
+        'stages': {},
+    }
+
+    loader = Loader(workers=workers)
+    helper = None
+
+    def plotly_edges():
+        nonlocal helper
+        helper = PlotlyHelper(loader.nodes)
+        helper.build_edge_scatter(loader.links, 'L3 direct connections')
+
+    steps = {
+        'load_nodes': lambda: loader.load_nodes(inventory),
+        'build_edges': loader.build_edges,
+        'aggregate_edges': loader.aggregate_edges,
+        'build_coordinates': loader.build_coordinates,
+        'build_edge_scatter': plotly_edges,
+        'plot': lambda: helper.plot(
+            os.path.join(workdir, 'graph.html'), auto_open=False
+        ),
+    }
+
+    for stage in STAGES:
+        if stage in skip:
+            # Later stages depend on this one
+            break
+        result, metrics = _measure(steps[stage], trace_memory)
+        if stage == 'load_nodes':
+            metrics['failed'] = len(result[1])
+        elif stage == 'build_edges':
+            metrics['edges'] = len(loader.edges)
+        elif stage == 'aggregate_edges':
+            metrics['links'] = len(loader.links)
+        run['stages'][stage] = metrics
+
+    return run
+
+
+@click.command()
+@click.option('-t', '--topology', 'topologies', multiple=True,
+              type=click.Choice(sorted(TOPOLOGIES)),
+              help='Topologies to benchmark (default: all)')
+@click.option('-s', '--size', 'sizes', multiple=True, type=int,
+              help='Number of appliances (default: 10, 100, 1000)')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=16)
+@click.option('--skip', multiple=True, type=click.Choice(STAGES),
+              help='Stop before this stage (e.g. layout on huge graphs)')
+@click.option('--no-tracemalloc', is_flag=True,
+              help='Skip heap tracing (faster, no peak_heap_bytes)')
+@click.option('-o', '--output', type=click.File('w'), default='-')
+def main(topologies, sizes, workers, skip, no_tracemalloc, output):
+    """Run the stage benchmark and write results as JSON"""
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'runs': [],
+    }
+
+    for topology in topologies or sorted(TOPOLOGIES):
+        for size in sizes or (10, 100, 1000):
+            with tempfile.TemporaryDirectory() as workdir:
+                run = run_one(topology, size, workers, skip,
+                              not no_tracemalloc, workdir)
+            click.echo('%s %s: %s' % (
+                topology, size,
+                ', '.join('%s %.3fs' % (stage, metrics['wall_s'])
+                          for stage, metrics in run['stages'].items())
+            ), err=True)
+            report['runs'].append(run)
+
+    json.dump(report, output, indent=2)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,163 @@
+""" Synthetic network generator.
+
+    Builds appliance inventories of arbitrary size, along with matching
+    replay fixtures (see malachite/replay_driver.py), so that the whole
+    malachite pipeline can run without any real appliance.
+
+    Every link is a /31 taken from 10.0.0.0/8 : the first end of the link
+    gets the even address, the other one the odd address, and each end has
+    an ARP entry for its neighbour.
+"""
+
+import json
+import os
+import random
+from ipaddress import IPv4Address
+
+from malachite.replay_driver import fixture_path
+
+
+BASE_ADDRESS = int(IPv4Address('10.0.0.0'))
+
+
+def spine_leaf(size, seed=0):
+    """ Two tier fabric, every leaf being connected to every spine.
+
+        :params int size: Number of appliances.
+        :return: List of (node index, node index) links.
+        :rtype: list
+    """
+    spines = max(2, min(8, size // 10))
+    return [
+        (leaf, spine)
+        for leaf in range(spines, size)
+        for spine in range(spines)
+    ]
+
+
+def clos(size, seed=0, pod_spines=4, pod_leaves=16):
+    """ Multi-pod three tier Clos : leaves connect to every spine of their
+        pod, and the n-th spine of each pod connects to every super spine
+        of plane n.
+
+        :params int size: Number of appliances.
+        :return: List of (node index, node index) links.
+        :rtype: list
+    """
+    per_plane = max(1, min(4, size // 200))
+    super_spines = min(size, pod_spines * per_plane)
+
+    links = []
+    first = super_spines
+    while first < size:
+        spines = range(first, min(size, first + pod_spines))
+        leaves = range(
+            first + pod_spines, min(size, first + pod_spines + pod_leaves)
+        )
+        links += [(leaf, spine) for leaf in leaves for spine in spines]
+        for plane, spine in enumerate(spines):
+            links += [
+                (spine, super_spine)
+                for super_spine in range(super_spines)
+                if super_spine % pod_spines == plane
+            ]
+        first += pod_spines + pod_leaves
+
+    return links
+
+
+def random_mesh(size, seed=0, degree=3):
+    """ Random mesh : a ring (so that the graph is connected) plus
+        'degree' - 2 random links per appliance.
+
+        :params int size: Number of appliances.
+        :return: List of (node index, node index) links.
+        :rtype: list
+    """
+    rand = random.Random(seed)
+    links = {(node, (node + 1) % size) for node in range(size) if size > 1}
+    for node in range(size):
+        for _ in range(max(0, degree - 2)):
+            peer = rand.randrange(size)
+            if peer != node and (peer, node) not in links:
+                links.add((node, peer))
+    return sorted(links)
+
+
+TOPOLOGIES = {
+    'spine-leaf': spine_leaf,
+    'clos': clos,
+    'mesh': random_mesh,
+}
+
+
+def hostname(index):
+    """Name of the n-th synthetic appliance"""
+    return 'sw%05d' % index
+
+
+def build_napalm_data(size, links):
+    """ Build napalm getters output of every appliance.
+
+        :params int size: Number of appliances.
+        :params list links: List of (node index, node index) links.
+        :return: One {'get_arp_table': .., 'get_interfaces_ip': ..} dict
+                 per appliance.
+        :rtype: list
+    """
+    data = [
+        {'get_arp_table': [], 'get_interfaces_ip': {}}
+        for _ in range(size)
+    ]
+
+    for link_idx, link in enumerate(links):
+        addresses = (
+            str(IPv4Address(BASE_ADDRESS + 2 * link_idx)),
+            str(IPv4Address(BASE_ADDRESS + 2 * link_idx + 1)),
+        )
+        for end in (0, 1):
+            local = data[link[end]]
+            interface = 'Ethernet%d' % (len(local['get_interfaces_ip']) + 1)
+            local['get_interfaces_ip'][interface] = {
+                'ipv4': {addresses[end]: {'prefix_length': 31}}
+            }
+            local['get_arp_table'].append({
+                'interface': interface,
+                'mac': '52:54:00:%02x:%02x:%02x' % (
+                    (link_idx >> 16) & 0xff, (link_idx >> 8) & 0xff, end
+                ),
+                'ip': addresses[1 - end],
+                'age': 0.0,
+            })
+
+    return data
+
+
+def generate(topology, size, directory, seed=0):
+    """ Write an inventory and replay fixtures for a synthetic network.
+
+        :params str topology: One of TOPOLOGIES keys.
+        :params int size: Number of appliances.
+        :params str directory: Output folder. The inventory is written as
+                               'appliances.yaml' and fixtures in 'fixtures/'.
+        :return: Inventory filename, fixtures folder and list of links.
+        :rtype: tuple
+    """
+    links = TOPOLOGIES[topology](size, seed=seed)
+    data = build_napalm_data(size, links)
+
+    fixtures_dir = os.path.join(directory, 'fixtures')
+    os.makedirs(fixtures_dir, exist_ok=True)
+
+    # Written by hand: dumping 50k entries with PyYAML takes far longer
+    # than the benchmark itself.
+    inventory = os.path.join(directory, 'appliances.yaml')
+    with open(inventory, 'w') as i_file:
+        i_file.write('---\n')
+        for index, getters in enumerate(data):
+            i_file.write('- fqdn: %s\n  name: %s\n  driver: replay\n'
+                         % (hostname(index), hostname(index)))
+            with open(fixture_path(fixtures_dir, hostname(index)), 'w') as f:
+                json.dump(getters, f)
+
+    return inventory, fixtures_dir, links
@@ -0,0 +1,536 @@
+""" Local HTTP API.
+
+    Serves a topology (a snapshot or an export file, see Malachite) as
+    JSON, so that a browser front-end fetches what changed instead of
+    reloading a multi-megabyte plotly file :
+
+    GET /api/topology                   Version, source and counts.
+    GET /api/nodes?offset=0&limit=1000  Appliances, by node id.
+    GET /api/edges?offset=0&limit=1000  Links, as pairs of node ids.
+    GET /api/coordinates?offset=0...    [x, y, z] of each node, by node id.
+
+    Node ids are node rows (see GraphStore). Lists are paged : a page
+    holds 'limit' items from 'offset', and 'next' is the offset of the
+    next page (null on the last one).
+
+    Every response carries an ETag made of the topology version : a client
+    sending it back as If-None-Match gets an empty 304 answer until the
+    topology changes. The source is checked every few seconds (latest
+    snapshot of the database, or export file modification), and reloaded
+    in a worker thread when it changed. Responses are compressed with gzip
+    when the client accepts it.
+
+    The server is built on asyncio streams (HTTP/1.1, keep-alive, GET and
+    HEAD only) rather than on a web framework, and listens on localhost
+    by default : it is meant to sit next to a front-end, not to face a
+    network.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlsplit
+
+from malachite.malachite import Malachite
+from malachite.topology_db import TopologyDB
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import ErrBadRequest
+
+
+STATUS_REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    431: 'Request Header Fields Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class ExportSource:
+    """ Topology read from an export file (see export.py), reloaded
+        when the file is modified.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # (modification time, size) of the last loaded file
+        self.stamp = None
+
+    def _stamp(self):
+        """Modification time and size of the file"""
+        stat = os.stat(self.filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self):
+        """Whether the file changed since last load"""
+        return self._stamp() != self.stamp
+
+    def load(self):
+        """ Read the export file. An invalid file is not read again
+            until it changes.
+
+            :return: Loaded topology, and its description.
+            :rtype: tuple(Malachite, str)
+        """
+        self.stamp = self._stamp()
+        malachite = Malachite()
+        malachite.load_export(self.filename)
+        return malachite, self.filename
+
+
+class SnapshotSource:
+    """ Topology read from a snapshots database (see topology_db.py) :
+        a given snapshot, or the latest one, reloaded whenever a newer
+        snapshot is saved.
+    """
+
+    def __init__(self, db_file=None, snapshot_id=None):
+        self.db_file = db_file
+        self.snapshot_id = snapshot_id
+        # Id of the loaded snapshot
+        self.loaded = None
+
+    def changed(self):
+        """Whether another snapshot should be loaded"""
+        if self.snapshot_id is not None:
+            return self.loaded is None
+
+        db = TopologyDB(self.db_file)
+        try:
+            return db.latest_snapshot() != self.loaded
+        finally:
+            db.close()
+
+    def load(self):
+        """ Read the snapshot.
+
+            :return: Loaded topology, and its description.
+            :rtype: tuple(Malachite, str)
+        """
+        malachite = Malachite()
+        db = TopologyDB(self.db_file)
+        try:
+            self.loaded = malachite.load_snapshot(db, self.snapshot_id)
+        finally:
+            db.close()
+        return malachite, 'snapshot %s' % self.loaded
+
+
+class TopologyView:
+    """ JSON pages of a loaded topology. The topology must not change
+        once viewed : reloading a source builds a new view.
+    """
+
+    def __init__(self, malachite, label, version, decimals=None):
+        """ :params Malachite malachite: Loaded topology.
+            :params str label: Description of the topology source.
+            :params str version: Topology version, unique to this view.
+            :params int decimals: Decimals of coordinates.
+        """
+        loader = malachite.loader
+        self.label = label
+        self.version = version
+        # Weak : gzip and identity bodies of a page share their tag
+        self.etag = 'W/"%s"' % version
+        self.store_version = loader.store.version
+        self.nodes = list(loader.nodes)
+        self.edges = loader.links if loader.links else loader.edges
+        self.coordinates = loader.store.coordinates.round(
+            CONFIG['default']['api']['decimals']
+            if decimals is None else decimals
+        )
+
+        # (list, offset, limit, gzip) -> response body and its encoding,
+        # most recently used last
+        self.pages = OrderedDict()
+
+    @staticmethod
+    def _node(node):
+        """JSON object of a node"""
+        appliance = node.appliance
+        failure = appliance.failure
+        return {
+            'id': node.row,
+            'name': appliance.name,
+            'fqdn': appliance.fqdn,
+            'driver': appliance.driver,
+            'tags': appliance.tags,
+            'ghost': appliance.ghost,
+            'failure': {
+                'stage': failure.stage, 'error': str(failure.error),
+            } if failure else None,
+            'ip_local': [[str(ip), interface] for ip, interface
+                         in appliance.ip_local.items()],
+        }
+
+    def _items(self, kind, offset, limit):
+        """Items of a page, as JSON-serializable objects"""
+        if kind == 'nodes':
+            return [self._node(node)
+                    for node in self.nodes[offset:offset + limit]]
+        if kind == 'edges':
+            return [{
+                'id': index,
+                'source': edge.source.row,
+                'destination': edge.destination.row,
+                'interfaces': edge.interfaces,
+            } for index, edge in enumerate(
+                self.edges[offset:offset + limit], offset
+            )]
+        return self.coordinates[offset:offset + limit].tolist()
+
+    def total(self, kind):
+        """Number of items of a list"""
+        return len(self.edges) if kind == 'edges' else len(self.nodes)
+
+    def summary(self):
+        """Content of the topology resource"""
+        return {
+            'version': self.version,
+            'source': self.label,
+            'store_version': self.store_version,
+            'nodes': len(self.nodes),
+            'edges': len(self.edges),
+            'unreachable': sum(
+                1 for node in self.nodes if node.appliance.failure
+            ),
+        }
+
+    def page(self, kind, offset, limit):
+        """Content of one page of a list"""
+        total = self.total(kind)
+        return {
+            'version': self.version,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'next': offset + limit if offset + limit < total else None,
+            'items': self._items(kind, offset, limit),
+        }
+
+    @staticmethod
+    def encode(document):
+        """Compact JSON body of a document"""
+        return json.dumps(document, separators=(',', ':')).encode()
+
+
+def _accepts_gzip(header):
+    """Whether an Accept-Encoding header allows gzip"""
+    for coding in header.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.strip().replace(' ', '')
+        if not params.startswith('q='):
+            return True
+        try:
+            return float(params[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def _matches(header, etag):
+    """Whether an If-None-Match header holds an entity tag (weak match)"""
+    if header.strip() == '*':
+        return True
+    bare = etag[2:] if etag.startswith('W/') else etag
+    for tag in header.split(','):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith('W/') else tag) == bare:
+            return True
+    return False
+
+
+class TopologyServer:
+    """ Asyncio HTTP server of a topology source (ExportSource or
+        SnapshotSource, or any object with 'changed' and 'load').
+    """
+
+    LISTS = ('nodes', 'edges', 'coordinates')
+
+    def __init__(self, source, host=None, port=None, refresh=None,
+                 page_size=None, max_page_size=None):
+        """ :params source: Topology to serve.
+            :params str host: Address to listen on.
+            :params int port: Port to listen on (0 picks a free one).
+            :params float refresh: Seconds between two checks of the
+                                   source, 0 never reloads it.
+            :params int page_size: Default number of items per page.
+            :params int max_page_size: Largest number of items per page.
+        """
+        settings = CONFIG['default']['api']
+        self.source = source
+        self.host = host if host else settings['host']
+        self.port = settings['port'] if port is None else port
+        self.refresh = settings['refresh'] if refresh is None else refresh
+        self.page_size = page_size if page_size else settings['page_size']
+        self.max_page_size = (
+            max_page_size if max_page_size else settings['max_page_size']
+        )
+
+        # Served topology, replaced as a whole on reload
+        self.view = None
+        # Number of loaded topologies, and server start : with the store
+        # version, they make entity tags unique across reloads and runs
+        self.generation = 0
+        self.started = int(time.time())
+        self.server = None
+
+    def _load(self):
+        """ Load the source and build its view. Meant to be run from a
+            worker thread.
+
+            :rtype: TopologyView
+        """
+        malachite, label = self.source.load()
+        self.generation += 1
+        version = '%x-%d-%d' % (
+            self.started, self.generation, malachite.loader.store.version
+        )
+        return TopologyView(malachite, label, version)
+
+    async def reload(self, force=False):
+        """ Load the source again if it changed (or if 'force').
+
+            :return: True if a new topology is served.
+            :rtype: bool
+        """
+        loop = asyncio.get_running_loop()
+        if not force and not await loop.run_in_executor(
+                None, self.source.changed):
+            return False
+        self.view = await loop.run_in_executor(None, self._load)
+        return True
+
+    async def _watch(self, on_load=None, on_error=None):
+        """Check the source every 'refresh' seconds"""
+        while True:
+            await asyncio.sleep(self.refresh)
+            start = time.monotonic()
+            try:
+                reloaded = await self.reload()
+            except Exception as err:  # pylint: disable=broad-except
+                # Keep serving the former topology
+                if on_error:
+                    on_error(err)
+                continue
+            if reloaded and on_load:
+                on_load(self.view, time.monotonic() - start)
+
+    def _params(self, query):
+        """Offset and limit of a page"""
+        params = parse_qs(query)
+        try:
+            offset = int(params.get('offset', [0])[-1])
+            limit = int(params.get('limit', [self.page_size])[-1])
+        except ValueError:
+            raise ErrBadRequest('offset and limit must be integers')
+        if offset < 0 or not 0 < limit <= self.max_page_size:
+            raise ErrBadRequest(
+                'offset must not be negative, and limit must be between 1 '
+                'and %s' % self.max_page_size
+            )
+        return offset, limit
+
+    async def respond(self, method, target, headers):
+        """ Answer a request.
+
+            :params str method: HTTP method.
+            :params str target: Request target (path and query).
+            :params dict headers: Request headers, by lowercase name.
+            :return: Status, response headers and body.
+            :rtype: tuple(int, list, bytes)
+        """
+        if method not in ('GET', 'HEAD'):
+            return self._error(405, 'Only GET and HEAD are supported',
+                               [('Allow', 'GET, HEAD')])
+        view = self.view
+        if view is None:
+            return self._error(503, 'No topology loaded yet')
+
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        kind = path[len('/api/'):] if path.startswith('/api/') else None
+        if kind == 'topology':
+            key = ('topology',)
+        elif kind in self.LISTS:
+            try:
+                key = (kind,) + self._params(url.query)
+            except ErrBadRequest as err:
+                return self._error(400, err.args[-1])
+        else:
+            return self._error(404, 'No such resource : %s' % url.path)
+
+        response_headers = [
+            ('ETag', view.etag),
+            ('Cache-Control', 'no-cache'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if _matches(headers.get('if-none-match', ''), view.etag):
+            return 304, response_headers, b''
+
+        compress = _accepts_gzip(headers.get('accept-encoding', ''))
+        body, encoding = await self._body(view, key, compress)
+        if encoding:
+            response_headers.append(('Content-Encoding', encoding))
+        response_headers.append(('Content-Type', 'application/json'))
+        return 200, response_headers, body
+
+    async def _body(self, view, key, compress):
+        """ Encoded page of a view, from its cache. Pages are built in a
+            worker thread, so that big ones don't stall other clients.
+
+            :return: Body, and its content encoding (None if identity).
+            :rtype: tuple(bytes, str)
+        """
+        settings = CONFIG['default']['api']
+        cache_key = key + (compress,)
+        if cache_key in view.pages:
+            view.pages.move_to_end(cache_key)
+            return view.pages[cache_key]
+
+        def build():
+            body = view.encode(
+                view.summary() if key[0] == 'topology' else view.page(*key)
+            )
+            if compress and len(body) >= settings['gzip_min_size']:
+                return gzip.compress(body, settings['gzip_level']), 'gzip'
+            return body, None
+
+        page = await asyncio.get_running_loop().run_in_executor(None, build)
+        view.pages[cache_key] = page
+        while len(view.pages) > settings['cached_pages']:
+            view.pages.popitem(last=False)
+        return page
+
+    @staticmethod
+    def _error(status, message, headers=None):
+        """JSON error response"""
+        return status, (headers or []) + [
+            ('Content-Type', 'application/json'),
+        ], TopologyView.encode({'error': message})
+
+    async def _read_request(self, reader):
+        """ Read a request head.
+
+            :return: Method, target, HTTP version and headers, or None if
+                     the client closed the connection.
+            :rtype: tuple
+        """
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b'\r\n\r\n'),
+                CONFIG['default']['api']['idle_timeout']
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ConnectionError):
+            return None
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise ErrBadRequest('Malformed request line')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def _handle(self, reader, writer):
+        """Serve the requests of a connection"""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except asyncio.LimitOverrunError:
+                    request = None
+                    status, headers, body = self._error(
+                        431, 'Request head too large'
+                    )
+                    keep_alive = False
+                except ErrBadRequest as err:
+                    request = None
+                    status, headers, body = self._error(400, err.args[-1])
+                    keep_alive = False
+                else:
+                    if request is None:
+                        break
+                    method, target, version, request_headers = request
+                    status, headers, body = await self.respond(
+                        method, target, request_headers
+                    )
+                    connection = request_headers.get('connection', '')
+                    keep_alive = (
+                        version == 'HTTP/1.1'
+                        and connection.lower() != 'close'
+                        and 'content-length' not in request_headers
+                        and 'transfer-encoding' not in request_headers
+                    )
+
+                headers = headers + [
+                    ('Date', formatdate(usegmt=True)),
+                    ('Connection', 'keep-alive' if keep_alive else 'close'),
+                ]
+                if status != 304:
+                    headers.append(('Content-Length', str(len(body))))
+                head = ['HTTP/1.1 %d %s' % (status, STATUS_REASONS[status])]
+                head.extend('%s: %s' % header for header in headers)
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode())
+                if request is None or request[0] != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """ Load the source and start listening.
+
+            :return: Listening address and port.
+            :rtype: tuple(str, int)
+        """
+        await self.reload(force=True)
+        self.server = await asyncio.start_server(
+            self._handle, self.host, self.port
+        )
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve(self, on_start=None, on_load=None, on_error=None):
+        """ Serve until cancelled.
+
+            :params callable on_start: Called with the listening address
+                                       and port, and the first view.
+            :params callable on_load: Called with each reloaded view and
+                                      the time its load took.
+            :params callable on_error: Called with errors of failed
+                                       reloads.
+        """
+        address = await self.start()
+        if on_start:
+            on_start(address, self.view)
+
+        watch = None
+        if self.refresh:
+            watch = asyncio.ensure_future(self._watch(on_load, on_error))
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if watch:
+                watch.cancel()
+
+    def run(self, **callbacks):
+        """Serve until interrupted (see 'serve')"""
+        asyncio.run(self.serve(**callbacks))
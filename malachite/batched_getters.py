@@ -0,0 +1,134 @@
+""" Batched getters.
+
+    Napalm getters each cost at least one round trip to the appliance.
+    Some drivers can run several commands in a single request : for those,
+    every data needed by the Loader is fetched at once, and parsed into the
+    same structures napalm getters return :
+    - get_arp_table : list of {'interface', 'mac', 'ip', 'age'} dicts
+    - get_interfaces_ip : {interface: {'ipv4': {ip: {'prefix_length'}}}}
+
+    BATCHED_GETTERS maps a driver name to a function taking an open device
+    and returning (arp_table, interfaces_ip). Drivers missing from it are
+    collected with one call per getter (see NapalmMiddleware.get_napalm_data).
+
+    ROUTE_GETTERS maps a driver name to a function returning the whole
+    routing table of the default VRF, in get_route_to format ({prefix:
+    [route dicts]}) : napalm
+    get_route_to only answers for a given destination on some drivers (EOS
+    parses it as a network, and rejects an empty one). Drivers missing from
+    it use get_route_to(destination='').
+"""
+
+from napalm.base.helpers import ip as napalm_ip
+from napalm.base.helpers import mac as napalm_mac
+
+
+def _parse_eos_arp(output):
+    """Build get_arp_table output from 'show arp vrf all' JSON output"""
+    arp_table = []
+    for vrf in output.get('vrfs', {}).values():
+        for neighbor in vrf.get('ipV4Neighbors', []):
+            arp_table.append({
+                'interface': str(neighbor.get('interface')),
+                'mac': napalm_mac(neighbor.get('hwAddress')),
+                'ip': napalm_ip(str(neighbor.get('address'))),
+                'age': float(neighbor.get('age', -1.0)),
+            })
+    return arp_table
+
+
+def _parse_eos_interfaces_ip(output):
+    """ Build get_interfaces_ip output (IPv4 only) from 'show ip interface'
+        JSON output.
+    """
+    interfaces_ip = {}
+    for name, details in output.get('interfaces', {}).items():
+        addresses = details.get('interfaceAddress', {})
+        ipv4 = {}
+
+        primary = addresses.get('primaryIp', {})
+        candidates = [primary] if primary.get('address') != '0.0.0.0' else []
+        candidates += addresses.get('secondaryIpsOrderedList', [])
+
+        for address in candidates:
+            if address.get('address'):
+                ipv4.setdefault(napalm_ip(address['address']), {
+                    'prefix_length': address.get('maskLen')
+                })
+
+        interfaces_ip[name] = {'ipv4': ipv4}
+    return interfaces_ip
+
+
+def eos_batch(device):
+    """ Arista EOS : both commands in a single eAPI request.
+
+        :params device: Open napalm EOSDriver.
+        :return: (arp_table, interfaces_ip) tuple.
+    """
+    # pylint: disable=protected-access
+    # _run_commands also handles the ssh transport (one command at a time)
+    arp_output, ip_output = device._run_commands(
+        ['show arp vrf all', 'show ip interface']
+    )
+    return _parse_eos_arp(arp_output), _parse_eos_interfaces_ip(ip_output)
+
+
+def _parse_eos_routes(output, vrf_name='default'):
+    """ Build get_route_to output (whole table) from 'show ip route detail'
+        JSON output : one route per next hop ('via'), as napalm does. Only
+        routes of a single VRF are kept : routed edges follow the data
+        plane, which a management VRF (and its own default route) is not
+        part of.
+    """
+    route_table = {}
+    vrf = output.get('vrfs', {}).get(vrf_name, {})
+    for prefix, details in vrf.get('routes', {}).items():
+        for via in details.get('vias') or [{}]:
+            route_table.setdefault(prefix, []).append({
+                'current_active': True,
+                'last_active': True,
+                'age': 0,
+                'next_hop': via.get('nexthopAddr', ''),
+                'protocol': details.get('routeType', ''),
+                'outgoing_interface': via.get('interface', ''),
+                'preference': details.get('preference', 0),
+                'inactive_reason': '',
+                'routing_table': vrf_name,
+                'selected_next_hop': True,
+                'protocol_attributes': {},
+            })
+    return route_table
+
+
+def eos_routes(device):
+    """ Arista EOS : routing table of the default VRF in a single command.
+
+        :params device: Open napalm EOSDriver.
+        :return: get_route_to output, for every prefix.
+    """
+    # pylint: disable=protected-access
+    output, = device._run_commands(['show ip route detail'])
+    return _parse_eos_routes(output)
+
+
+def replay_batch(device):
+    """ Replay driver : both recorded outputs for the latency of a single
+        call.
+
+        :params device: Open ReplayDriver.
+        :return: (arp_table, interfaces_ip) tuple.
+    """
+    return tuple(device.replay_batch(['get_arp_table', 'get_interfaces_ip']))
+
+
+# Driver name -> function(device) returning (arp_table, interfaces_ip)
+BATCHED_GETTERS = {
+    'eos': eos_batch,
+    'replay': replay_batch,
+}
+
+# Driver name -> function(device) returning the whole routing table
+ROUTE_GETTERS = {
+    'eos': eos_routes,
+}
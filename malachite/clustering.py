@@ -0,0 +1,230 @@
+""" Clustering of large graphs.
+
+    With thousands of appliances, a single scatter is unreadable (and heavy
+    for the browser). Nodes can instead be grouped in clusters :
+    - by an inventory field ('site', 'pod'... any extra key of an appliance
+      record, see Appliance.tags),
+    - by a regular expression on appliance names ('name:<regex>', the
+      cluster being the first group of the match, or the whole match),
+    - by community detection on the graph itself ('community', igraph
+      multilevel algorithm).
+
+    The layout is then computed on the collapsed graph (one node per
+    cluster) to place clusters, and each cluster is laid out on its own
+    around its position. The plot shows clusters only, and lets the user
+    expand one of them at a time (see PlotlyHelper.build_cluster_scatters).
+"""
+
+import hashlib
+import math
+import re
+
+import numpy as np
+
+from malachite.layout import compute_layout
+from malachite.utils.exceptions import ErrInvalidLayout
+
+
+# Cluster of appliances matching no group
+OTHERS = 'others'
+
+
+class Clustering:
+    """ Assignment of every node (by row) to a cluster.
+    """
+
+    def __init__(self, names, membership):
+        """ :params list names: Name of each cluster, by cluster index.
+            :params list membership: Cluster index of each node, by row.
+        """
+        self.names = list(names)
+        self.membership = np.asarray(membership, dtype=np.int64)
+
+    @property
+    def count(self):
+        """Number of clusters"""
+        return len(self.names)
+
+    def signature(self, names):
+        """ Hash of the assignment, which doesn't depend on node order.
+
+            :params list names: Identifier of every node, by row (see
+                                LayoutCache.node_id).
+            :rtype: str
+        """
+        digest = hashlib.sha256()
+        for name, cluster in sorted(
+                (str(name), self.names[cluster])
+                for name, cluster in zip(names, self.membership)):
+            digest.update(('\0%s\0%s' % (name, cluster)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def members(self):
+        """ Node rows of each cluster.
+
+            :return: One array of rows per cluster, by cluster index.
+            :rtype: list
+        """
+        order = np.argsort(self.membership, kind='stable')
+        bounds = np.searchsorted(
+            self.membership[order], np.arange(self.count + 1)
+        )
+        return [order[bounds[i]:bounds[i + 1]] for i in range(self.count)]
+
+    def collapse(self, edge_rows):
+        """ Edges between clusters.
+
+            :params edge_rows: (E, 2) array-like of node rows.
+            :return: (cluster, cluster) pairs (lowest index first) and
+                     number of edges between them.
+            :rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        edge_rows = np.asarray(edge_rows, dtype=np.int64).reshape(-1, 2)
+        pairs = np.sort(self.membership[edge_rows], axis=1)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        if not len(pairs):
+            return np.zeros((0, 2), dtype=np.int64), np.zeros(0, np.int64)
+        return np.unique(pairs, axis=0, return_counts=True)
+
+    def internal(self, edge_rows):
+        """ Edges of each cluster, between its own members.
+
+            :params edge_rows: (E, 2) array-like of node rows.
+            :return: One array of edge indexes per cluster.
+            :rtype: list
+        """
+        edge_rows = np.asarray(edge_rows, dtype=np.int64).reshape(-1, 2)
+        clusters = self.membership[edge_rows]
+        inside = np.flatnonzero(clusters[:, 0] == clusters[:, 1])
+        owner = clusters[inside, 0]
+        order = np.argsort(owner, kind='stable')
+        bounds = np.searchsorted(owner[order], np.arange(self.count + 1))
+        return [inside[order[bounds[i]:bounds[i + 1]]]
+                for i in range(self.count)]
+
+
+def _from_labels(labels):
+    """Build a Clustering from one label per node (in label order)"""
+    names = []
+    index = {}
+    membership = []
+    for label in labels:
+        if label not in index:
+            index[label] = len(names)
+            names.append(label)
+        membership.append(index[label])
+    return Clustering(names, membership)
+
+
+def by_tag(nodes, tag):
+    """Cluster nodes by an inventory field of their appliance"""
+    return _from_labels(
+        str(node.appliance.tags.get(tag, OTHERS)) for node in nodes
+    )
+
+
+def by_name(nodes, pattern):
+    """Cluster nodes by a regular expression on their appliance name"""
+    regex = re.compile(pattern)
+
+    def label(name):
+        match = regex.search(name)
+        if not match:
+            return OTHERS
+        return match.group(1) if regex.groups else match.group(0)
+
+    return _from_labels(label(node.appliance.name) for node in nodes)
+
+
+def by_community(node_count, edges):
+    """Cluster nodes by community detection (multilevel modularity)"""
+    import igraph as ig
+
+    graph = ig.Graph(n=node_count, edges=edges, directed=False)
+    graph.simplify()
+    membership = graph.community_multilevel().membership
+    return _from_labels('community %s' % cluster for cluster in membership)
+
+
+def build_clustering(method, nodes, edges):
+    """ Cluster nodes.
+
+        :params str method: 'community', 'name:<regex>', or the name of an
+                            inventory field.
+        :params list nodes: Graph nodes, by row.
+        :params list edges: (row, row) pairs.
+        :rtype: Clustering
+    """
+    if method == 'community':
+        return by_community(len(nodes), edges)
+    if method.startswith('name:'):
+        try:
+            return by_name(nodes, method[len('name:'):])
+        except re.error as err:
+            raise ErrInvalidLayout('Invalid cluster pattern (%s)' % err)
+    return by_tag(nodes, method)
+
+
+def _normalize(coords):
+    """Center coordinates on origin, within a sphere of radius 1"""
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    coords = coords - coords.mean(axis=0)
+    radius = np.linalg.norm(coords, axis=1).max() if len(coords) else 0
+    return coords / radius if radius else coords
+
+
+def _spacing(points, samples=500):
+    """ Median distance from a point to its nearest neighbour, estimated
+        on a sample of points (all pairs would be quadratic in memory).
+    """
+    step = max(1, len(points) // samples)
+    nearest = []
+    for row in range(0, len(points), step):
+        gaps = np.linalg.norm(points - points[row], axis=1)
+        gaps[row] = np.inf
+        nearest.append(gaps.min())
+    return np.median(nearest)
+
+
+def clustered_layout(clustering, edges, algorithm='auto'):
+    """ Lay out clusters from the collapsed graph, then the members of
+        each cluster around the position of their cluster.
+
+        :params Clustering clustering: Node clusters.
+        :params list edges: (row, row) pairs.
+        :params str algorithm: Layout algorithm name (see layout.py), or
+                               'auto' to pick one from each graph size.
+        :return: (N, 3) array of node coordinates, by row.
+        :rtype: numpy.ndarray
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    members = clustering.members()
+
+    # Cluster radius grows like the square root of its size, so that
+    # nodes are about as dense in every cluster
+    radius = np.array([math.sqrt(len(rows)) / 2 for rows in members])
+
+    pairs, _ = clustering.collapse(edges)
+    centers = _normalize(
+        compute_layout(clustering.count, pairs.tolist(), algorithm)
+    )
+    if clustering.count > 1:
+        # Spread clusters until neighbours don't overlap
+        centers *= 2.5 * np.median(radius) / (_spacing(centers) or 1)
+
+    # Row -> position within its cluster
+    local = np.empty(len(clustering.membership), dtype=np.int64)
+    for rows in members:
+        local[rows] = np.arange(len(rows))
+
+    coords = np.zeros((len(clustering.membership), 3))
+    for cluster, (rows, internal) in enumerate(
+            zip(members, clustering.internal(edges))):
+        if len(rows) > 1:
+            layout = compute_layout(
+                len(rows), local[edges[internal]].tolist(), algorithm
+            )
+            coords[rows] = _normalize(layout) * radius[cluster]
+        coords[rows] += centers[cluster]
+
+    return coords
@@ -0,0 +1,276 @@
+""" Long running collector.
+
+    Opening a napalm session often costs more than the getters themselves.
+    The collector daemon keeps one session open per appliance (SessionPool),
+    checks it is still alive before each poll, reconnects unreachable
+    appliances with an exponential backoff, and polls every appliance on a
+    fixed schedule.
+
+    Collected data is written to the SnapshotCache : the graph command then
+    reads the latest state from there (see Loader 'poll' option) without
+    connecting to anything. Failed collections are written there too, so
+    that the graph reports them instead of drawing outdated data.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from malachite.loader import CollectionFailure, Loader
+from malachite.snapshot_cache import SnapshotCache
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import ErrConnectionFailed, error_text
+
+
+class SessionPool:
+    """ Open napalm sessions, indexed by appliance key (fqdn, port).
+        Sessions are held by one NapalmMiddleware per driver.
+    """
+
+    def __init__(self, connect_timeout=None, tracer=None,
+                 getter_timeout=None):
+        """ Init empty pool.
+
+            :params float connect_timeout: Deadline for connecting to (and
+                                           health checking) an appliance.
+            :params float getter_timeout: Deadline of getter calls, given to
+                                          the driver transport.
+            :params Tracer tracer: Records timing of every napalm call.
+        """
+        defaults = CONFIG['default']
+        self.connect_timeout = (
+            connect_timeout if connect_timeout
+            else defaults['connect_timeout']
+        )
+        self.getter_timeout = (
+            getter_timeout if getter_timeout
+            else defaults['getter_timeout']
+        )
+        self.backoff = defaults['daemon']['backoff']
+        self.max_backoff = defaults['daemon']['max_backoff']
+        self.tracer = tracer
+
+        # Driver name -> NapalmMiddleware
+        self.middlewares = {}
+
+        # Appliance key -> (consecutive failures, next attempt timestamp)
+        self.failures = {}
+
+    def middleware(self, driver):
+        """ Return the middleware of a driver, creating it if needed.
+            Not thread safe : call it before handing appliances to workers.
+
+            :raises ErrInvalidDriver: If driver is unknown.
+        """
+        if driver not in self.middlewares:
+            from malachite.napalm_collector import NapalmMiddleware
+
+            self.middlewares[driver] = NapalmMiddleware(
+                driver, tracer=self.tracer
+            )
+        return self.middlewares[driver]
+
+    def _failed(self, key):
+        """Remember a connection failure and schedule next attempt"""
+        count = self.failures.get(key, (0, 0))[0] + 1
+        delay = min(self.backoff * 2 ** (count - 1), self.max_backoff)
+        self.failures[key] = (count, time.time() + delay)
+
+    def session(self, appliance):
+        """ Make sure an appliance has a working session, reusing the
+            current one if it passes its health check.
+
+            :params Appliance appliance: Appliance to connect to.
+            :return: Middleware holding the session (device key is
+                     appliance.key).
+            :rtype: NapalmMiddleware
+            :raises ErrConnectionFailed: If the appliance is unreachable,
+                                         or still in backoff.
+        """
+        n_middleware = self.middleware(appliance.driver)
+
+        if appliance.key in n_middleware.devices:
+            if n_middleware.is_alive(appliance.key, self.connect_timeout):
+                return n_middleware
+            self.release(appliance)
+
+        _, retry_at = self.failures.get(appliance.key, (0, 0))
+        if time.time() < retry_at:
+            raise ErrConnectionFailed(
+                'Appliance %s, next attempt in %ds',
+                appliance.fqdn, retry_at - time.time()
+            )
+
+        broken = n_middleware.connect(
+            appliance=appliance,
+            username=CONFIG['default']['username'],
+            password=CONFIG['default']['password'],
+            timeout=self.connect_timeout,
+            read_timeout=self.getter_timeout)
+        if broken:
+            self._failed(appliance.key)
+            raise ErrConnectionFailed('Appliance %s', appliance.fqdn)
+
+        self.failures.pop(appliance.key, None)
+        return n_middleware
+
+    def release(self, appliance):
+        """Close the session of an appliance (dead sessions included)"""
+        n_middleware = self.middlewares.get(appliance.driver)
+        if not n_middleware:
+            return
+        try:
+            n_middleware.disconnect(device=appliance.key)
+        except Exception:  # pylint: disable=broad-except
+            # Dead sessions may fail to close : forget them anyway
+            n_middleware.devices.pop(appliance.key, None)
+
+    def close(self):
+        """Close every session"""
+        for n_middleware in self.middlewares.values():
+            for key in list(n_middleware.devices):
+                try:
+                    n_middleware.disconnect(device=key)
+                except Exception:  # pylint: disable=broad-except
+                    n_middleware.devices.pop(key, None)
+
+
+class CollectorDaemon:
+    """ Poll every appliance of an inventory on a schedule, keeping
+        sessions open between polls, and store results in the cache.
+    """
+
+    def __init__(self, appliances_file, cache=None, interval=None,
+                 workers=None, connect_timeout=None, getter_timeout=None,
+                 tracer=None, routes=False):
+        """ Read inventory and init the session pool.
+
+            :params str appliances_file: Filename of the appliance list.
+            :params SnapshotCache cache: Where collected data is written.
+            :params float interval: Seconds between the start of two polls.
+            :params int workers: Number of appliances polled in parallel.
+            :params float connect_timeout: Connection deadline, in seconds.
+            :params float getter_timeout: Getter call deadline, in seconds.
+            :params Tracer tracer: Records timing of every napalm call.
+            :params bool routes: Also collect routing tables (best effort,
+                                 as Loader does), for 'graph --from-daemon
+                                 --routes'.
+        """
+        # Only used for reading the inventory and collection settings
+        loader = Loader(workers=workers, connect_timeout=connect_timeout,
+                        getter_timeout=getter_timeout)
+        loader.read_appliances(appliances_file)
+
+        self.appliances = loader.appliances
+        self.workers = loader.workers
+        self.getter_timeout = loader.getter_timeout
+        self.cache = cache if cache else SnapshotCache()
+        self.interval = (
+            interval if interval else CONFIG['default']['daemon']['interval']
+        )
+
+        self.routes = routes
+        self.pool = SessionPool(loader.connect_timeout, tracer,
+                                loader.getter_timeout)
+        self._stop = threading.Event()
+
+    def _poll_appliance(self, appliance):
+        """ Collect and cache data of a single appliance.
+            Meant to be run from a worker thread.
+
+            :return: CollectionFailure (stage 'routes' if only its routing
+                     table is missing), or None on success.
+        """
+        stage = 'connect'
+        try:
+            n_middleware = self.pool.session(appliance)
+
+            stage = 'getters'
+            arp_table, ip_addresses = n_middleware.get_napalm_data(
+                appliance.key, self.getter_timeout
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            if stage != 'connect':
+                # Session is probably broken : open a new one next time
+                self.pool.release(appliance)
+            self.cache.put_failure(appliance, stage, error_text(err))
+            return CollectionFailure(appliance, stage, err)
+
+        # Best effort : ARP and IP data are cached anyway
+        route_table = failure = None
+        if self.routes:
+            try:
+                route_table = n_middleware.get_route_table(
+                    appliance.key, self.getter_timeout
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                failure = CollectionFailure(appliance, 'routes', err)
+
+        self.cache.put(appliance, arp_table, ip_addresses, route_table)
+        return failure
+
+    def poll(self, executor=None):
+        """ Poll every appliance once.
+
+            :params ThreadPoolExecutor executor: Workers to use (a
+                                                 temporary pool if None).
+            :return: Appliances polled successfully, and CollectionFailure
+                     list for the others.
+            :rtype: tuple(list, list)
+        """
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return self.poll(executor)
+
+        jobs = []
+        failed = []
+        for appliance in self.appliances:
+            # Middlewares are created here, workers only read them.
+            try:
+                self.pool.middleware(appliance.driver)
+            except Exception as err:  # pylint: disable=broad-except
+                self.cache.put_failure(appliance, 'driver', error_text(err))
+                failed.append(CollectionFailure(appliance, 'driver', err))
+                continue
+            jobs.append(
+                (appliance, executor.submit(self._poll_appliance, appliance))
+            )
+
+        succeeded = []
+        for appliance, job in jobs:
+            failure = job.result()
+            if failure:
+                failed.append(failure)
+            else:
+                succeeded.append(appliance)
+
+        return succeeded, failed
+
+    def run(self, cycles=None, on_poll=None):
+        """ Poll appliances every 'interval' seconds until 'stop' is called
+            (or 'cycles' polls are done). Sessions are closed on exit.
+
+            :params int cycles: Number of polls, None for no limit.
+            :params callable on_poll: Called after each poll with the
+                                      'poll' result and its duration.
+        """
+        done = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while not self._stop.is_set():
+                    start = time.monotonic()
+                    result = self.poll(executor)
+                    duration = time.monotonic() - start
+                    if on_poll:
+                        on_poll(result, duration)
+
+                    done += 1
+                    if cycles and done >= cycles:
+                        break
+                    self._stop.wait(max(0, self.interval - duration))
+        finally:
+            self.pool.close()
+
+    def stop(self):
+        """Ask 'run' to return once current poll is over"""
+        self._stop.set()
@@ -0,0 +1,370 @@
+""" Topology diff.
+
+    Two topologies (two snapshots, two exports, or a snapshot and a new
+    run) are compared as hashed adjacency sets, keyed by appliance name :
+    node uids and rows differ from one run to another, names don't.
+
+    - appliances, by name,
+    - IP ownership : IP -> (appliance, interface),
+    - links (aggregated edges, see Loader.aggregate_edges) : pair of
+      appliances -> hash of their interface pairs.
+
+    Each state is flattened once into numpy arrays (see TopologyState).
+    Appliance names of both states are then numbered together, in name
+    order, so that every link and IPv4 address becomes a single int64 key,
+    and both states are matched by sorting keys : the diff costs
+    O(n log n), with no Python loop over unchanged elements. IPv6
+    addresses (too wide for int64 keys) are matched with a dict.
+
+    Besides added and removed elements, a diff holds moved ones :
+    - an IP owned by another appliance (or interface) than before,
+    - a recabled link : either the same appliances linked through other
+      interfaces, or an interface now linked to another appliance (a
+      removed link and an added link sharing an end are reported as a
+      single moved link).
+"""
+
+import gc
+from collections import namedtuple
+from ipaddress import IPv4Address
+
+import numpy as np
+
+
+# One link of a topology : appliance names (in name order) and interface
+# pairs, from the first appliance side
+StateLink = namedtuple('StateLink', ['source', 'destination', 'interfaces'])
+
+# Link seen in both topologies, but through other interfaces or towards
+# another appliance : 'old' and 'new' are StateLinks
+MovedLink = namedtuple('MovedLink', ['old', 'new'])
+
+# IP owned by an appliance : 'name' and 'interface' of its owner
+IPOwner = namedtuple('IPOwner', ['ip', 'name', 'interface'])
+
+# IP found in both topologies, on another appliance or interface
+MovedIP = namedtuple('MovedIP', ['old', 'new'])
+
+
+class TopologyState:
+    """ What a diff compares, for one topology, as flat arrays.
+    """
+
+    def __init__(self, loader):
+        """ :params Loader loader: Loader, after 'aggregate_edges' (which
+                                   is called if needed). Ghost nodes are
+                                   left out.
+        """
+        if loader.edges and not loader.links:
+            loader.aggregate_edges()
+        store = loader.store
+        nodes = [node for node in loader.nodes if not node.appliance.ghost]
+        appliances = [node.appliance for node in nodes]
+
+        # Appliances : names, and coordinates, by state row
+        names = [appliance.name for appliance in appliances]
+        self.names = np.array(names, dtype=str)
+        self.rows = {name: row for row, name in enumerate(names)}
+        self.coordinates = store.coordinates[[node.row for node in nodes]] \
+            if nodes else np.zeros((0, 3))
+
+        # Links : state rows of both ends, in name order
+        by_row = np.full(len(store.nodes), -1, dtype=np.int64)
+        by_row[[node.row for node in nodes]] = np.arange(len(nodes))
+        links = loader.links
+        ends = by_row[store.rows_of(links)] if links \
+            else np.zeros((0, 2), dtype=np.int64)
+        keep = (ends >= 0).all(axis=1) & (ends[:, 0] != ends[:, 1])
+        self.links = [link for link, kept in zip(links, keep.tolist())
+                      if kept]
+        ends = ends[keep]
+
+        rank = np.empty(len(nodes), dtype=np.int64)
+        rank[np.argsort(self.names, kind='stable')] = np.arange(len(nodes))
+        self.swapped = rank[ends[:, 0]] > rank[ends[:, 1]]
+        self.ends = np.sort(ends, axis=1)
+        self.ends[self.swapped] = ends[self.swapped][:, ::-1]
+        # Hash of the interface pairs of each link, from the first end
+        self.signatures = np.array([
+            hash(frozenset(self._interfaces(link, swapped)))
+            for link, swapped in zip(self.links, self.swapped.tolist())
+        ], dtype=np.int64)
+
+        # IPs : owner row and interface, IPv4 ones first. Pairs are read
+        # from the underlying dict : OrderedDict views look every key up
+        # again, and hashing ipaddress objects is slow.
+        pairs = [pair for appliance in appliances
+                 for pair in dict.items(appliance.ip_local)]
+        ips = [ip for ip, _ in pairs]
+        is_v4 = np.array([isinstance(ip, IPv4Address) for ip in ips],
+                         dtype=bool)
+        owners = np.repeat(
+            np.arange(len(nodes)),
+            [len(appliance.ip_local) for appliance in appliances]
+        )
+        order = np.argsort(~is_v4, kind='stable')
+        self.ips = [ips[index] for index in order.tolist()]
+        self.ip_owners = owners[order]
+        self.ip_interfaces = np.array(
+            [interface for _, interface in pairs], dtype=str
+        )[order]
+
+        v4_count = int(is_v4.sum())
+        self.v4_keys = np.array([int(ip) for ip in self.ips[:v4_count]],
+                                dtype=np.int64)
+        # IPv6 address -> index in 'ips'
+        self.v6_index = {
+            ip: index
+            for index, ip in enumerate(self.ips[v4_count:], v4_count)
+        }
+
+    @staticmethod
+    def _interfaces(link, swapped):
+        """Interface pairs of a link, from its first end (in name order)"""
+        if swapped:
+            return [(dst, src) for src, dst in link.interfaces]
+        return link.interfaces
+
+    def link(self, index):
+        """StateLink of a link, by index"""
+        source, destination = self.ends[index].tolist()
+        return StateLink(
+            str(self.names[source]), str(self.names[destination]),
+            sorted(self._interfaces(
+                self.links[index], bool(self.swapped[index])
+            ))
+        )
+
+    def owner(self, index):
+        """IPOwner of an IP, by index"""
+        return IPOwner(
+            self.ips[index], str(self.names[self.ip_owners[index]]),
+            str(self.ip_interfaces[index])
+        )
+
+
+def _match(old_keys, new_keys):
+    """ Match two arrays of unique keys.
+
+        :return: Indexes of common keys in both arrays, then of keys only
+                 found in the old array, and in the new one.
+        :rtype: tuple
+    """
+    _, old_common, new_common = np.intersect1d(
+        old_keys, new_keys, assume_unique=True, return_indices=True
+    )
+    old_only = np.ones(len(old_keys), dtype=bool)
+    old_only[old_common] = False
+    new_only = np.ones(len(new_keys), dtype=bool)
+    new_only[new_common] = False
+    return (old_common, new_common,
+            np.flatnonzero(old_only), np.flatnonzero(new_only))
+
+
+def _unique(keys):
+    """Indexes of the first occurrence of each key (names may repeat)"""
+    _, first = np.unique(keys, return_index=True)
+    return np.sort(first)
+
+
+class TopologyDiff:
+    """ Changes from an old topology to a new one.
+    """
+
+    def __init__(self, old, new):
+        """ Compare two topologies.
+
+            :params TopologyState old: Former topology.
+            :params TopologyState new: Current topology.
+        """
+        self.old = old
+        self.new = new
+
+        # Number appliances of both states together, in name order
+        names = np.unique(np.concatenate((old.names, new.names)))
+        old_ids = np.searchsorted(names, old.names)
+        new_ids = np.searchsorted(names, new.names)
+
+        # Appliance names
+        old_unique, new_unique = np.unique(old_ids), np.unique(new_ids)
+        _, _, removed, added = _match(old_unique, new_unique)
+        self.nodes_added = names[new_unique[added]].tolist()
+        self.nodes_removed = names[old_unique[removed]].tolist()
+
+        # StateLinks, and MovedLinks
+        self.links_added = []
+        self.links_removed = []
+        self.links_moved = []
+        # Indexes of new links found unchanged in the old topology
+        self.links_unchanged = None
+        self._diff_links(old_ids, new_ids, len(names))
+
+        # IPOwners, and MovedIPs
+        self.ips_added = []
+        self.ips_removed = []
+        self.ips_moved = []
+        self._diff_ips(old_ids, new_ids)
+
+    def _diff_links(self, old_ids, new_ids, count):
+        """Match links by appliance pair, then by interface pairs"""
+        old, new = self.old, self.new
+        old_keys = old_ids[old.ends[:, 0]] * count + old_ids[old.ends[:, 1]]
+        new_keys = new_ids[new.ends[:, 0]] * count + new_ids[new.ends[:, 1]]
+        old_first, new_first = _unique(old_keys), _unique(new_keys)
+        old_common, new_common, removed, added = _match(
+            old_keys[old_first], new_keys[new_first]
+        )
+        old_common, new_common = old_first[old_common], new_first[new_common]
+
+        same = old.signatures[old_common] == new.signatures[new_common]
+        self.links_unchanged = new_common[same]
+        for old_index, new_index in zip(old_common[~same].tolist(),
+                                        new_common[~same].tolist()):
+            self.links_moved.append(
+                MovedLink(old.link(old_index), new.link(new_index))
+            )
+
+        # A removed and an added link sharing an end (appliance,
+        # interface) are the same cable, plugged elsewhere
+        removed = [old.link(index) for index in old_first[removed].tolist()]
+        ends = {}
+        for position, link in enumerate(removed):
+            for src_if, dst_if in link.interfaces:
+                ends.setdefault((link.source, src_if), position)
+                ends.setdefault((link.destination, dst_if), position)
+
+        matched = set()
+        for index in new_first[added].tolist():
+            link = new.link(index)
+            previous = None
+            for src_if, dst_if in link.interfaces:
+                for end in ((link.source, src_if),
+                            (link.destination, dst_if)):
+                    position = ends.get(end)
+                    if position is not None and position not in matched:
+                        previous = position
+                        break
+                if previous is not None:
+                    break
+
+            if previous is None:
+                self.links_added.append(link)
+            else:
+                matched.add(previous)
+                self.links_moved.append(MovedLink(removed[previous], link))
+
+        self.links_removed = [link for position, link in enumerate(removed)
+                              if position not in matched]
+
+    def _diff_ips(self, old_ids, new_ids):
+        """Match IPv4 addresses by key, IPv6 ones by address"""
+        old, new = self.old, self.new
+        old_common, new_common, removed, added = _match(
+            old.v4_keys, new.v4_keys
+        )
+
+        v6_common = [(index, new.v6_index[ip])
+                     for ip, index in old.v6_index.items()
+                     if ip in new.v6_index]
+        if v6_common:
+            old_v6, new_v6 = np.array(v6_common, dtype=np.int64).T
+            old_common = np.concatenate((old_common, old_v6))
+            new_common = np.concatenate((new_common, new_v6))
+        removed = removed.tolist() + [
+            index for ip, index in old.v6_index.items()
+            if ip not in new.v6_index
+        ]
+        added = added.tolist() + [
+            index for ip, index in new.v6_index.items()
+            if ip not in old.v6_index
+        ]
+
+        moved = (
+            (old_ids[old.ip_owners[old_common]]
+             != new_ids[new.ip_owners[new_common]])
+            | (old.ip_interfaces[old_common]
+               != new.ip_interfaces[new_common])
+        )
+        self.ips_moved = [
+            MovedIP(old.owner(old_index), new.owner(new_index))
+            for old_index, new_index in zip(old_common[moved].tolist(),
+                                            new_common[moved].tolist())
+        ]
+        self.ips_added = [new.owner(index) for index in added]
+        self.ips_removed = [old.owner(index) for index in removed]
+
+    def __bool__(self):
+        return any(self.counts().values())
+
+    def counts(self):
+        """ Number of changes of each kind.
+
+            :rtype: dict
+        """
+        return {
+            'nodes_added': len(self.nodes_added),
+            'nodes_removed': len(self.nodes_removed),
+            'links_added': len(self.links_added),
+            'links_removed': len(self.links_removed),
+            'links_moved': len(self.links_moved),
+            'ips_added': len(self.ips_added),
+            'ips_removed': len(self.ips_removed),
+            'ips_moved': len(self.ips_moved),
+        }
+
+    def positions(self, names):
+        """ Coordinates of appliances : current ones, or former ones for
+            removed appliances.
+
+            :params list names: Appliance names.
+            :return: (N, 3) array.
+            :rtype: numpy.ndarray
+        """
+        coords = np.zeros((len(names), 3))
+        for index, name in enumerate(names):
+            if name in self.new.rows:
+                coords[index] = self.new.coordinates[self.new.rows[name]]
+            else:
+                coords[index] = self.old.coordinates[self.old.rows[name]]
+        return coords
+
+    def segments(self, links):
+        """ Coordinates of StateLinks, for plots (see 'positions').
+
+            :return: (N, 2, 3) array.
+            :rtype: numpy.ndarray
+        """
+        ends = [name for link in links for name in link[:2]]
+        return self.positions(ends).reshape(-1, 2, 3)
+
+    def unchanged_segments(self):
+        """ Coordinates of unchanged links, for plots.
+
+            :return: (N, 2, 3) array.
+            :rtype: numpy.ndarray
+        """
+        return self.new.coordinates[self.new.ends[self.links_unchanged]]
+
+    def unchanged_labels(self):
+        """Hover labels of unchanged links"""
+        names = self.new.names[self.new.ends[self.links_unchanged]].tolist()
+        return ['%s <-> %s' % (source, destination)
+                for source, destination in names]
+
+
+def diff_loaders(old, new):
+    """ Compare the topologies of two loaders.
+
+        :params Loader old: Former topology.
+        :params Loader new: Current topology.
+        :rtype: TopologyDiff
+    """
+    # Diffs only allocate acyclic objects : pausing the garbage collector
+    # spares full collections over both (large) topologies
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return TopologyDiff(TopologyState(old), TopologyState(new))
+    finally:
+        if enabled:
+            gc.enable()
@@ -0,0 +1,448 @@
+""" Topology export and import.
+
+    The whole model of a Loader (appliances and their tags, local IPs, ARP
+    entries, routing tables, collection failures, edges and node
+    coordinates) can be written to a file, and read back into an empty
+    Loader without polling anything nor computing any layout. The format is
+    picked from the file extension :
+    - .npz (compact, default) : one compressed numpy array per column.
+      Strings are dictionary encoded (interface names repeat a lot), and
+      IPv4 addresses are stored as integers,
+    - .json : one object per node and per edge, for other tools,
+    - .graphml : nodes and edges with their attributes, for graph tools
+      (Gephi, yEd, networkx...). Export only.
+
+    Edges are exported as found in ARP tables (one per ARP entry, with its
+    interface and the interface of its destination), and restored as is
+    when importing : links are aggregated from them again. GraphML files
+    hold aggregated links instead.
+
+    Ghost nodes (see ghosts.py) and routed next hops are not exported :
+    they are built again from ARP entries (and routing tables) when
+    importing. Version 1 files (without routes nor failures) and version 2
+    files (without edge interfaces) can still be imported : their edges
+    are built again from ARP entries.
+"""
+
+import json
+import os
+from ipaddress import ip_address
+from xml.etree import ElementTree
+
+import numpy as np
+
+from malachite.routing import routes_to_list
+from malachite.utils.exceptions import ErrLoadingFailed, error_text
+
+
+# Bumped whenever the content of export files changes
+FORMAT_VERSION = 3
+
+# Dictionary encoded string columns (see '_pack_strings')
+STRING_COLUMNS = (
+    'name', 'fqdn', 'driver', 'tags', 'failure_stage', 'failure_error',
+    'local_interface', 'arp_interface', 'arp_mac', 'route_prefix',
+    'route_next_hop', 'route_interface',
+)
+
+# String columns of edges (version 3 and later)
+EDGE_STRING_COLUMNS = ('edge_interface', 'edge_peer_interface')
+
+
+def _model(loader):
+    """ Columns of the loader model (ghost nodes left out).
+
+        :return: Exported nodes, dict of columns (lists, by uid : the node
+                 index in the export), (N, 3) coordinates, exported ARP
+                 edges, and node row -> uid.
+        :rtype: tuple
+    """
+    nodes = [node for node in loader.nodes if not node.appliance.ghost]
+    uids = {node.row: uid for uid, node in enumerate(nodes)}
+
+    columns = {
+        'name': [], 'fqdn': [], 'driver': [], 'port': [], 'tags': [],
+        'failure_stage': [], 'failure_error': [], 'has_routes': [],
+        'local_uid': [], 'local_ip': [], 'local_interface': [],
+        'arp_uid': [], 'arp_interface': [], 'arp_ip': [], 'arp_mac': [],
+        'route_uid': [], 'route_prefix': [], 'route_next_hop': [],
+        'route_interface': [], 'edge_interface': [],
+        'edge_peer_interface': [],
+    }
+    for uid, node in enumerate(nodes):
+        app = node.appliance
+        columns['name'].append(app.name)
+        columns['fqdn'].append(app.fqdn)
+        columns['driver'].append(app.driver)
+        columns['port'].append(app.port or 0)
+        columns['tags'].append(json.dumps(app.tags, sort_keys=True))
+        # Empty stage : collected successfully
+        columns['failure_stage'].append(
+            app.failure.stage if app.failure else ''
+        )
+        columns['failure_error'].append(
+            error_text(app.failure.error) if app.failure else ''
+        )
+        columns['has_routes'].append(app.routes is not None)
+        for ip, interface in app.ip_local.items():
+            columns['local_uid'].append(uid)
+            columns['local_ip'].append(ip)
+            columns['local_interface'].append(interface)
+        for interface, ip in app.ip_arp_table.items():
+            columns['arp_uid'].append(uid)
+            columns['arp_interface'].append(interface)
+            columns['arp_ip'].append(ip)
+            columns['arp_mac'].append(app.arp_macs.get(interface) or '')
+        # One row per next hop, '' for directly connected networks
+        for prefix, next_hops in routes_to_list(app.routes) \
+                if app.routes is not None else ():
+            for next_hop, interface in next_hops:
+                columns['route_uid'].append(uid)
+                columns['route_prefix'].append(prefix)
+                columns['route_next_hop'].append(next_hop or '')
+                columns['route_interface'].append(interface or '')
+
+    coordinates = loader.store.coordinates_of(nodes) if nodes \
+        else np.zeros((0, 3))
+
+    edges = _exported(loader.edges, uids)
+    # ARP edges have a single (interface, destination interface) pair
+    for edge in edges:
+        interface, peer_interface = edge.interfaces[0]
+        columns['edge_interface'].append(interface)
+        columns['edge_peer_interface'].append(peer_interface)
+    return nodes, columns, coordinates, edges, uids
+
+
+def _exported(edges, uids):
+    """Edges between exported nodes (ghost nodes left out)"""
+    return [edge for edge in edges
+            if edge.source.row in uids and edge.destination.row in uids]
+
+
+def _pack_strings(values):
+    """ Dictionary encode strings : utf-8 blob of distinct values, their
+        offsets in the blob, and the code of each value.
+    """
+    if not values:
+        return (np.zeros(0, dtype=np.uint8), np.zeros(1, dtype=np.int64),
+                np.zeros(0, dtype=np.int32))
+
+    distinct, codes = np.unique(np.array(values, dtype=str),
+                                return_inverse=True)
+    encoded = [value.encode('utf-8') for value in distinct.tolist()]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets, codes.reshape(-1).astype(np.int32)
+
+
+def _unpack_strings(blob, offsets, codes):
+    """Strings encoded by '_pack_strings'"""
+    raw = blob.tobytes()
+    distinct = [raw[offsets[i]:offsets[i + 1]].decode('utf-8')
+                for i in range(len(offsets) - 1)]
+    return [distinct[code] for code in codes.tolist()]
+
+
+def _pack_ips(ips):
+    """IPv4 addresses as integers, any other address as a string"""
+    if all(ip.version == 4 for ip in ips):
+        return {'v4': np.array([int(ip) for ip in ips], dtype=np.uint32)}
+    return dict(zip(('blob', 'offsets', 'codes'),
+                    _pack_strings([str(ip) for ip in ips])))
+
+
+def _unpack_ips(arrays, prefix):
+    """Addresses encoded by '_pack_ips'"""
+    if prefix + '_v4' in arrays:
+        return [ip_address(ip) for ip in arrays[prefix + '_v4'].tolist()]
+    return [ip_address(ip) for ip in _unpack_strings(
+        arrays[prefix + '_blob'], arrays[prefix + '_offsets'],
+        arrays[prefix + '_codes']
+    )]
+
+
+def _write_npz(loader, filename):
+    """Columnar, compressed export"""
+    _, columns, coordinates, edges, uids = _model(loader)
+
+    arrays = {
+        'format_version': np.array(FORMAT_VERSION),
+        'port': np.array(columns['port'], dtype=np.int32),
+        'has_routes': np.array(columns['has_routes'], dtype=bool),
+        'local_uid': np.array(columns['local_uid'], dtype=np.int32),
+        'arp_uid': np.array(columns['arp_uid'], dtype=np.int32),
+        'route_uid': np.array(columns['route_uid'], dtype=np.int32),
+        'coordinates': coordinates.astype(np.float32),
+        'edges': np.array(
+            [(uids[edge.source.row], uids[edge.destination.row])
+             for edge in edges], dtype=np.int32
+        ).reshape(-1, 2),
+    }
+    for column in STRING_COLUMNS + EDGE_STRING_COLUMNS:
+        blob, offsets, codes = _pack_strings(columns[column])
+        arrays[column + '_blob'] = blob
+        arrays[column + '_offsets'] = offsets
+        arrays[column + '_codes'] = codes
+    for column in ('local_ip', 'arp_ip'):
+        for kind, array in _pack_ips(columns[column]).items():
+            arrays['%s_%s' % (column, kind)] = array
+
+    with open(filename, 'wb') as e_file:
+        np.savez_compressed(e_file, **arrays)
+
+
+def _read_npz(filename):
+    """Columns of a .npz export"""
+    with np.load(filename, allow_pickle=False) as arrays:
+        arrays = dict(arrays.items())
+
+    count = len(arrays['port'])
+    version = int(arrays['format_version'])
+    if version < 2:
+        # Neither failures nor routing tables
+        for column, values in (
+                ('failure_stage', [''] * count),
+                ('failure_error', [''] * count),
+                ('route_prefix', []), ('route_next_hop', []),
+                ('route_interface', [])):
+            for suffix, array in zip(('_blob', '_offsets', '_codes'),
+                                     _pack_strings(values)):
+                arrays[column + suffix] = array
+        arrays['has_routes'] = np.zeros(count, dtype=bool)
+        arrays['route_uid'] = np.zeros(0, dtype=np.int32)
+
+    columns = {}
+    for column in STRING_COLUMNS:
+        columns[column] = _unpack_strings(
+            arrays[column + '_blob'], arrays[column + '_offsets'],
+            arrays[column + '_codes']
+        )
+    columns['local_ip'] = _unpack_ips(arrays, 'local_ip')
+    columns['arp_ip'] = _unpack_ips(arrays, 'arp_ip')
+    for column in ('port', 'has_routes', 'local_uid', 'arp_uid',
+                   'route_uid'):
+        columns[column] = arrays[column].tolist()
+    if version >= 3:
+        # Older 'edges' may be aggregated links : built again instead
+        for column in EDGE_STRING_COLUMNS:
+            columns[column] = _unpack_strings(
+                arrays[column + '_blob'], arrays[column + '_offsets'],
+                arrays[column + '_codes']
+            )
+        edges = arrays['edges'].reshape(-1, 2)
+        columns['edge_source'] = edges[:, 0].tolist()
+        columns['edge_destination'] = edges[:, 1].tolist()
+    return columns, arrays['coordinates'].astype(float)
+
+
+def _write_json(loader, filename):
+    """One object per node and per edge"""
+    nodes, _, coordinates, edges, uids = _model(loader)
+
+    document = {
+        'format_version': FORMAT_VERSION,
+        'nodes': [{
+            'uid': uid,
+            'name': node.appliance.name,
+            'fqdn': node.appliance.fqdn,
+            'driver': node.appliance.driver,
+            'port': node.appliance.port or 0,
+            'tags': node.appliance.tags,
+            'coordinates': coordinates[uid].tolist(),
+            'ip_local': [[str(ip), interface] for ip, interface
+                         in node.appliance.ip_local.items()],
+            'ip_arp_table': [
+                [interface, str(ip),
+                 node.appliance.arp_macs.get(interface) or '']
+                for interface, ip in node.appliance.ip_arp_table.items()
+            ],
+            'routes': routes_to_list(node.appliance.routes)
+            if node.appliance.routes is not None else None,
+            'failure': {
+                'stage': node.appliance.failure.stage,
+                'error': error_text(node.appliance.failure.error),
+            } if node.appliance.failure else None,
+        } for uid, node in enumerate(nodes)],
+        'edges': [{
+            'source': uids[edge.source.row],
+            'destination': uids[edge.destination.row],
+            'interfaces': edge.interfaces,
+        } for edge in edges],
+    }
+    with open(filename, 'w') as e_file:
+        json.dump(document, e_file)
+
+
+def _read_json(filename):
+    """Columns of a .json export"""
+    with open(filename, 'r') as e_file:
+        document = json.load(e_file)
+
+    columns = {key: [] for key in (
+        'name', 'fqdn', 'driver', 'port', 'tags', 'failure_stage',
+        'failure_error', 'has_routes', 'local_uid', 'local_ip',
+        'local_interface', 'arp_uid', 'arp_interface', 'arp_ip', 'arp_mac',
+        'route_uid', 'route_prefix', 'route_next_hop', 'route_interface'
+    )}
+    coordinates = []
+    for uid, node in enumerate(document['nodes']):
+        for column in ('name', 'fqdn', 'driver', 'port'):
+            columns[column].append(node[column])
+        columns['tags'].append(json.dumps(node.get('tags', {})))
+        # Version 1 files have neither failures nor routing tables
+        failure = node.get('failure') or {'stage': '', 'error': ''}
+        columns['failure_stage'].append(failure['stage'])
+        columns['failure_error'].append(failure['error'])
+        routes = node.get('routes')
+        columns['has_routes'].append(routes is not None)
+        for prefix, next_hops in routes or ():
+            for next_hop, interface in next_hops:
+                columns['route_uid'].append(uid)
+                columns['route_prefix'].append(prefix)
+                columns['route_next_hop'].append(next_hop or '')
+                columns['route_interface'].append(interface or '')
+        coordinates.append(node['coordinates'])
+        for ip, interface in node['ip_local']:
+            columns['local_uid'].append(uid)
+            columns['local_ip'].append(ip_address(ip))
+            columns['local_interface'].append(interface)
+        for interface, ip, mac in node['ip_arp_table']:
+            columns['arp_uid'].append(uid)
+            columns['arp_interface'].append(interface)
+            columns['arp_ip'].append(ip_address(ip))
+            columns['arp_mac'].append(mac)
+
+    # Older 'edges' may be aggregated links : built again instead
+    if document.get('format_version', 1) >= 3:
+        for column in ('edge_source', 'edge_destination') \
+                + EDGE_STRING_COLUMNS:
+            columns[column] = []
+        for edge in document['edges']:
+            (interface, peer_interface), = edge['interfaces']
+            columns['edge_source'].append(edge['source'])
+            columns['edge_destination'].append(edge['destination'])
+            columns['edge_interface'].append(interface)
+            columns['edge_peer_interface'].append(peer_interface)
+    return columns, np.array(coordinates, dtype=float).reshape(-1, 3)
+
+
+def _write_graphml(loader, filename):
+    """Nodes and edges, with their attributes"""
+    nodes, _, coordinates, edges, uids = _model(loader)
+    if loader.links:
+        edges = _exported(loader.links, uids)
+
+    root = ElementTree.Element(
+        'graphml', xmlns='http://graphml.graphdrawing.org/xmlns'
+    )
+    for key, target, kind in (
+            ('name', 'node', 'string'), ('fqdn', 'node', 'string'),
+            ('driver', 'node', 'string'), ('port', 'node', 'int'),
+            ('x', 'node', 'double'), ('y', 'node', 'double'),
+            ('z', 'node', 'double'), ('ip_local', 'node', 'string'),
+            ('interfaces', 'edge', 'string'),
+            ('multiplicity', 'edge', 'int')):
+        ElementTree.SubElement(root, 'key', {
+            'id': key, 'for': target, 'attr.name': key, 'attr.type': kind
+        })
+
+    graph = ElementTree.SubElement(
+        root, 'graph', id='malachite',
+        edgedefault='undirected' if loader.links else 'directed'
+    )
+
+    def data(element, key, value):
+        ElementTree.SubElement(element, 'data', key=key).text = str(value)
+
+    for uid, node in enumerate(nodes):
+        element = ElementTree.SubElement(graph, 'node', id='n%s' % uid)
+        app = node.appliance
+        data(element, 'name', app.name)
+        data(element, 'fqdn', app.fqdn)
+        data(element, 'driver', app.driver)
+        data(element, 'port', app.port or 0)
+        for axis, value in zip('xyz', coordinates[uid].tolist()):
+            data(element, axis, value)
+        data(element, 'ip_local', ' '.join(
+            '%s@%s' % (ip, interface)
+            for ip, interface in app.ip_local.items()
+        ))
+
+    for edge in edges:
+        element = ElementTree.SubElement(graph, 'edge', {
+            'source': 'n%s' % uids[edge.source.row],
+            'target': 'n%s' % uids[edge.destination.row],
+        })
+        data(element, 'interfaces', ' '.join(
+            '%s-%s' % pair for pair in edge.interfaces
+        ))
+        data(element, 'multiplicity', edge.multiplicity)
+
+    ElementTree.ElementTree(root).write(
+        filename, encoding='utf-8', xml_declaration=True
+    )
+
+
+WRITERS = {
+    '.npz': _write_npz,
+    '.json': _write_json,
+    '.graphml': _write_graphml,
+}
+
+READERS = {
+    '.npz': _read_npz,
+    '.json': _read_json,
+}
+
+
+def write_export(loader, filename):
+    """ Write the loader model to a file (format from its extension).
+
+        :params Loader loader: Loader, after 'build_edges' (and
+                               'build_coordinates' to keep the layout).
+        :params str filename: Export file (.npz, .json or .graphml).
+        :raises ErrLoadingFailed: If the extension is unknown.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in WRITERS:
+        raise ErrLoadingFailed('Unknown export format %s (expected %s)'
+                               % (extension, ', '.join(sorted(WRITERS))))
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_filename = '%s.%s.tmp%s' % (filename, os.getpid(), extension)
+    WRITERS[extension](loader, tmp_filename)
+    os.replace(tmp_filename, filename)
+
+
+def read_export(filename):
+    """ Read raw content of an export (see Loader.load_export).
+
+        :params str filename: Export file (.npz or .json).
+        :return: Dict of columns, by name : 'name', 'fqdn', 'driver',
+                 'port', 'tags' (JSON), 'failure_stage' and
+                 'failure_error' (empty if collected) and 'has_routes' by
+                 node uid, 'local_uid', 'local_ip' and 'local_interface' by
+                 local IP, 'arp_uid', 'arp_interface', 'arp_ip' and
+                 'arp_mac' by ARP entry, and 'route_uid', 'route_prefix',
+                 'route_next_hop' and 'route_interface' (empty if none) by
+                 route next hop, and 'edge_source', 'edge_destination',
+                 'edge_interface' and 'edge_peer_interface' by ARP edge
+                 (missing before version 3). Then (N, 3) array of node
+                 coordinates.
+        :rtype: tuple(dict, numpy.ndarray)
+        :raises ErrLoadingFailed: If the file is missing or unreadable.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in READERS:
+        raise ErrLoadingFailed('Can\'t import %s files (expected %s)'
+                               % (extension, ', '.join(sorted(READERS))))
+    try:
+        return READERS[extension](filename)
+    except FileNotFoundError:
+        raise ErrLoadingFailed('File %s not found' % filename)
+    except (OSError, ValueError, KeyError) as err:
+        raise ErrLoadingFailed('%s : invalid export (%s)' % (filename, err))
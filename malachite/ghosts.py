@@ -0,0 +1,334 @@
+""" Ghost nodes.
+
+    ARP entries pointing to an IP owned by no known appliance (see
+    Loader.missing_neighbor) are servers, hosts, or appliances left out of
+    the inventory. They can be drawn as ghost nodes, either one per
+    neighbor IP ('host'), or one per group of neighbors to keep large
+    access networks readable :
+    - 'subnet' : neighbors in the same subnet (CONFIG['default']['ghosts']
+      prefix lengths),
+    - 'vendor' : neighbors whose MAC address has the same vendor (OUI),
+      named after an IEEE oui.txt file when one is configured.
+
+    Neighbors are named by reverse DNS. Each distinct IP is looked up once,
+    lookups run concurrently under a single deadline, and answers (failures
+    included) are kept in an on-disk cache (DNSCache) : later runs only
+    resolve new or expired addresses. Neighbors that can't be resolved in
+    time are still drawn, named after their IP.
+"""
+
+import json
+import os
+import queue
+import re
+import socket
+import threading
+import time
+from ipaddress import ip_network
+
+from malachite.models.appliance import Appliance
+from malachite.utils.config import CONFIG
+
+
+GROUPINGS = ('host', 'subnet', 'vendor')
+
+# Number of neighbors listed in the hover label of a ghost node
+MAX_LISTED = 20
+
+
+def reverse_dns(ip):
+    """ Name of an IP address, from the system resolver.
+
+        :return: Host name, None if the address has no PTR record.
+        :rtype: str
+    """
+    try:
+        return socket.gethostbyaddr(str(ip))[0]
+    except (OSError, UnicodeError):
+        return None
+
+
+class StubResolver:
+    """ Resolver answering from a fixed mapping instead of DNS (tests,
+        offline runs, or networks where DNS knows nothing useful).
+    """
+
+    def __init__(self, names=None, latency=0):
+        """ :params dict names: IP (string) -> name.
+            :params float latency: Seconds spent in each lookup.
+        """
+        self.names = dict(names) if names else {}
+        self.latency = latency
+
+    @classmethod
+    def from_hosts_file(cls, filename):
+        """ Read names from a hosts file ('ip name [aliases...]' lines,
+            '#' comments).
+
+            :rtype: StubResolver
+        """
+        names = {}
+        with open(filename, 'r') as h_file:
+            for line in h_file:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) > 1:
+                    names.setdefault(fields[0], fields[1])
+        return cls(names)
+
+    def __call__(self, ip):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.names.get(str(ip))
+
+
+class DNSCache:
+    """ Reverse DNS answers, kept in a single JSON file. Missing names are
+        cached as well, so that unresolvable neighbors aren't looked up on
+        every run.
+    """
+
+    def __init__(self, filename=None, ttl=None):
+        """ :params str filename: Cache file, created when first saved.
+            :params float ttl: Lifetime of an entry, in seconds.
+        """
+        settings = CONFIG['default']['ghosts']
+        self.filename = os.path.expanduser(
+            filename if filename else settings['dns_cache']
+        )
+        self.ttl = settings['dns_ttl'] if ttl is None else ttl
+
+        # IP -> (name or None, lookup timestamp)
+        self.entries = None
+        self.changed = False
+
+    def _load(self):
+        """Read the cache file once (an unreadable file is an empty cache)"""
+        if self.entries is not None:
+            return
+        try:
+            with open(self.filename, 'r') as c_file:
+                self.entries = {
+                    ip: tuple(entry) for ip, entry in json.load(c_file).items()
+                }
+        except (OSError, ValueError, AttributeError, TypeError):
+            self.entries = {}
+
+    def get(self, ip):
+        """ Cached name of an IP.
+
+            :return: (found, name) : found is False if the IP is missing or
+                     expired, name is None if it has no name.
+            :rtype: tuple
+        """
+        self._load()
+        entry = self.entries.get(str(ip))
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return False, None
+        return True, entry[0]
+
+    def put(self, ip, name):
+        """Remember the name of an IP (None if it has none)"""
+        self._load()
+        self.entries[str(ip)] = (name, time.time())
+        self.changed = True
+
+    def save(self):
+        """Write the cache file, if anything changed (expired entries are
+        dropped)"""
+        if not self.changed:
+            return
+
+        now = time.time()
+        entries = {
+            ip: entry for ip, entry in self.entries.items()
+            if now - entry[1] <= self.ttl
+        }
+
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmp_filename, 'w') as c_file:
+            json.dump(entries, c_file)
+        os.replace(tmp_filename, self.filename)
+        self.changed = False
+
+
+def _lookup_worker(resolver, todo, answers):
+    """ Resolve IPs from the 'todo' queue until it is empty, putting
+        (IP, name) pairs in the 'answers' queue.
+    """
+    while True:
+        try:
+            ip = todo.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            name = resolver(ip)
+        except Exception:  # pylint: disable=broad-except
+            name = None
+        answers.put((ip, name))
+
+
+def resolve_names(ips, resolver=None, cache=None, workers=None,
+                  timeout=None):
+    """ Name IP addresses, looking up each one at most once.
+
+        Addresses missing from the cache are resolved concurrently, and
+        those still pending after 'timeout' seconds are left unresolved
+        (and not cached, to be tried again next time).
+
+        System lookups can't be interrupted, so they run in daemon threads
+        which nothing waits for : a lookup still pending at the deadline
+        neither delays this call nor the interpreter exit. Lookups not
+        started by then are dropped.
+
+        :params ips: Iterable of IP addresses (strings or ipaddress).
+        :params callable resolver: IP -> name or None (reverse_dns if
+                                   None).
+        :params DNSCache cache: Cache of previous answers, if any.
+        :params int workers: Number of concurrent lookups.
+        :params float timeout: Deadline for all lookups, in seconds.
+        :return: IP (string) -> name, None if unresolved.
+        :rtype: dict
+    """
+    settings = CONFIG['default']['ghosts']
+    resolver = resolver if resolver else reverse_dns
+    workers = workers if workers else settings['dns_workers']
+    timeout = settings['dns_timeout'] if timeout is None else timeout
+
+    names = {}
+    pending = []
+    for ip in set(str(ip) for ip in ips):
+        found, name = cache.get(ip) if cache else (False, None)
+        if found:
+            names[ip] = name
+        else:
+            pending.append(ip)
+
+    if pending:
+        todo = queue.Queue()
+        answers = queue.Queue()
+        for ip in pending:
+            todo.put(ip)
+        for _ in range(min(workers, len(pending))):
+            threading.Thread(
+                target=_lookup_worker, args=(resolver, todo, answers),
+                daemon=True
+            ).start()
+
+        deadline = time.monotonic() + timeout
+        for _ in pending:
+            try:
+                ip, name = answers.get(
+                    timeout=max(0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                break
+            names[ip] = name
+            if cache:
+                cache.put(ip, name)
+
+        # Idle workers stop once the queue is empty
+        while True:
+            try:
+                todo.get_nowait()
+            except queue.Empty:
+                break
+        for ip in pending:
+            names.setdefault(ip, None)
+
+    if cache:
+        cache.save()
+    return names
+
+
+def read_oui_file(filename):
+    """ Read MAC vendors from an IEEE OUI file ('XX-XX-XX (hex) Vendor'
+        lines).
+
+        :return: OUI ('xx:xx:xx') -> vendor name.
+        :rtype: dict
+    """
+    vendors = {}
+    line_format = re.compile(r'^\s*([0-9A-Fa-f]{2}-[0-9A-Fa-f]{2}-'
+                             r'[0-9A-Fa-f]{2})\s+\(hex\)\s+(.*\S)')
+    with open(os.path.expanduser(filename), 'r', errors='replace') as o_file:
+        for line in o_file:
+            match = line_format.match(line)
+            if match:
+                vendors[match.group(1).replace('-', ':').lower()] = \
+                    match.group(2)
+    return vendors
+
+
+def mac_vendor(mac, vendors=None):
+    """ Vendor of a MAC address.
+
+        :params str mac: MAC address, in any usual notation.
+        :params dict vendors: OUI -> vendor name (see 'read_oui_file').
+        :return: Vendor name, OUI if vendor is unknown.
+        :rtype: str
+    """
+    digits = re.sub(r'[^0-9a-f]', '', str(mac or '').lower())
+    if len(digits) != 12:
+        return 'unknown vendor'
+    if int(digits[1], 16) & 2:
+        # Randomized or virtual addresses don't have a vendor
+        return 'locally administered'
+    oui = ':'.join((digits[0:2], digits[2:4], digits[4:6]))
+    return (vendors or {}).get(oui, 'OUI %s' % oui)
+
+
+def group_of(grouping, ip, mac=None, vendors=None):
+    """ Ghost node label of a neighbor.
+
+        :params str grouping: One of GROUPINGS.
+        :params ipaddress ip: Neighbor IP.
+        :params str mac: Neighbor MAC address, if known.
+        :params dict vendors: OUI -> vendor name.
+        :rtype: str
+    """
+    if grouping == 'subnet':
+        settings = CONFIG['default']['ghosts']
+        prefix = settings['prefix_v%s' % ip.version]
+        return str(ip_network('%s/%s' % (ip, prefix), strict=False))
+    if grouping == 'vendor':
+        return mac_vendor(mac, vendors)
+    return str(ip)
+
+
+class GhostAppliance(Appliance):
+    """ Stand-in for one or several neighbors missing from the inventory.
+        It is never collected.
+    """
+
+    ghost = True
+
+    def __init__(self, label, neighbors, grouped):
+        """ :params str label: Group label (neighbor IP if not grouped).
+            :params list neighbors: (IP string, name or None) pairs.
+            :params bool grouped: Whether the ghost stands for a group.
+        """
+        if grouped:
+            name = '%s (%s hosts)' % (label, len(neighbors))
+        else:
+            name = neighbors[0][1] or label
+        super().__init__(label, None, name)
+        self.neighbors = neighbors
+        self.grouped = grouped
+
+    def hover_text(self):
+        """Description of the neighbors, for plot hover labels"""
+        if not self.grouped:
+            ip, name = self.neighbors[0]
+            return '%s (%s)' % (name, ip) if name else ip
+
+        desc = self.name
+        for ip, name in self.neighbors[:MAX_LISTED]:
+            desc += '<br>%s (%s)' % (name, ip) if name else '<br>%s' % ip
+        if len(self.neighbors) > MAX_LISTED:
+            desc += '<br>... and %s more' % (
+                len(self.neighbors) - MAX_LISTED
+            )
+        return desc
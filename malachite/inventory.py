@@ -0,0 +1,105 @@
+""" Appliance inventory readers.
+
+    Inventories list appliances as fqdn/name/driver/port records, in one of
+    these formats (picked from the file extension) :
+    - YAML (.yaml, .yml, default) : a list of mappings, parsed at once with
+      the C accelerated loader when PyYAML was built with libyaml,
+    - JSON lines (.jsonl, .ndjson) : one JSON object per line,
+    - CSV (.csv) : a header line naming the columns, then one appliance per
+      line.
+
+    JSON lines and CSV inventories are read lazily, one record at a time,
+    so that collecting the first appliances can start while the rest of a
+    huge inventory is still being read.
+"""
+
+import csv
+import json
+import os
+import zlib
+
+import yaml
+
+from malachite.utils.exceptions import ErrLoadingFailed
+
+
+# PyYAML pure Python loader is an order of magnitude slower
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+REQUIRED_FIELDS = ('fqdn', 'driver')
+
+
+def _check(record, position, filename):
+    """Make sure an inventory record can describe an appliance"""
+    if not isinstance(record, dict):
+        raise ErrLoadingFailed('%s, entry %s : not a mapping'
+                               % (filename, position))
+    for field in REQUIRED_FIELDS:
+        if not record.get(field):
+            raise ErrLoadingFailed('%s, entry %s : no %s'
+                                   % (filename, position, field))
+    return record
+
+
+def _iter_yaml(i_file):
+    """Records of a YAML inventory"""
+    return yaml.load(i_file, Loader=YAML_LOADER) or []
+
+
+def _iter_jsonl(i_file):
+    """Records of a JSON lines inventory (blank lines are skipped)"""
+    for line in i_file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_csv(i_file):
+    """Records of a CSV inventory (empty cells are left out)"""
+    for row in csv.DictReader(i_file):
+        record = {key: value for key, value in row.items() if value}
+        if 'port' in record:
+            record['port'] = int(record['port'])
+        yield record
+
+
+def shard_of(record, count):
+    """ Shard of an appliance.
+
+        :params dict record: Inventory record (fqdn and optional port).
+        :params int count: Number of shards.
+        :return: Shard index, from 0 to count - 1.
+        :rtype: int
+    """
+    key = '%s:%s' % (record['fqdn'], record.get('port') or 0)
+    return zlib.crc32(key.encode('utf-8')) % count
+
+
+# File extension -> reader
+READERS = {
+    '.yaml': _iter_yaml,
+    '.yml': _iter_yaml,
+    '.jsonl': _iter_jsonl,
+    '.ndjson': _iter_jsonl,
+    '.csv': _iter_csv,
+}
+
+
+def iter_inventory(filename):
+    """ Read appliance records from an inventory, lazily when the format
+        allows it.
+
+        :params str filename: Inventory filename.
+        :return: Generator of dicts with 'fqdn', 'driver' and optional
+                 'name' and 'port' keys.
+        :raises ErrLoadingFailed: If the file is missing or invalid.
+    """
+    reader = READERS.get(os.path.splitext(filename)[1].lower(), _iter_yaml)
+
+    try:
+        with open(filename, 'r', newline='') as i_file:
+            for position, record in enumerate(reader(i_file), 1):
+                yield _check(record, position, filename)
+    except FileNotFoundError:
+        raise ErrLoadingFailed('File %s not found' % filename)
+    except (ValueError, yaml.YAMLError) as err:
+        raise ErrLoadingFailed('%s : %s' % (filename, err))
@@ -19,19 +19,32 @@
     decouple its tasks.
 """
 
-import yaml
+import itertools
+import json
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import igraph as ig
 from ipaddress import ip_address
 
 from malachite.models.appliance import Appliance
 from malachite.models.node import Node
 from malachite.models.edge import Edge
+from malachite.models.graph_store import GraphStore
 
-from malachite.napalm_collector import NapalmMiddleware
+from malachite.clustering import build_clustering, clustered_layout
+from malachite.ghosts import (
+    GhostAppliance, group_of, read_oui_file, resolve_names
+)
+from malachite.export import read_export, write_export
+from malachite.inventory import iter_inventory, shard_of
+from malachite.resilience import retry
+from malachite.routing import routes_from_list, routes_from_napalm
+from malachite.layout import LayoutCache, choose_algorithm, compute_layout
 
 from malachite.utils.config import CONFIG
 from malachite.utils.exceptions import (
+    ErrConnectionFailed,
     ErrLoadingFailed,
     ErrInvalidDriver,
     ErrNodesNotLoaded,
@@ -39,15 +52,86 @@ from malachite.utils.exceptions import (
 )
 
 
+# Appliance that could not be enriched with napalm data.
+# 'stage' is the step that failed (driver, connect, getters, breaker when
+# the appliance is skipped after failing too often, or cache when polling
+# is disabled) and 'error' the exception raised at that point.
+CollectionFailure = namedtuple(
+    'CollectionFailure', ['appliance', 'stage', 'error']
+)
+
+# Outcome of the enrichment of a single appliance : 'source' tells where
+# data comes from ('cache' or 'napalm', or 'breaker' if it was skipped),
+# 'failure' is a CollectionFailure (None on success) and 'wall_time' the
+# time spent on the appliance.
+EnrichResult = namedtuple(
+    'EnrichResult', ['appliance', 'source', 'failure', 'wall_time']
+)
+
+
+# Inventory fields describing how to reach an appliance (others are tags)
+INVENTORY_FIELDS = ('fqdn', 'driver', 'name', 'port')
+
+
+def _same_routes(routes_a, routes_b):
+    """Whether two routing tables (PrefixTrie or None) hold the same routes"""
+    if routes_a is routes_b:
+        return True
+    if routes_a is None or routes_b is None:
+        return False
+    return list(routes_a.items()) == list(routes_b.items())
+
+
 class Loader:
 
-    def __init__(self):
+    def __init__(self, workers=None, connect_timeout=None,
+                 getter_timeout=None, cache=None, record_dir=None,
+                 layout=None, layout_cache=None, tracer=None, poll=True,
+                 cluster_by=None, ghosts=None, resolver=None, dns_cache=None,
+                 routes=False, attempts=None, breaker=None):
         """ Init loader class.
             Currently, it acts as a temporary storage class
             for every objects needed during the graphin process
             (nodes, edges, igraph and layout, etc).
             In further devs, it might rely on some DB middleware
             for added persistence.
+
+            :params int workers: Number of appliances collected in parallel
+                                 (1 means one after another).
+            :params float connect_timeout: Deadline for connecting to a
+                                           single appliance, in seconds.
+            :params float getter_timeout: Deadline for a single napalm
+                                          getter call, in seconds.
+            :params SnapshotCache cache: Cache of previously collected data.
+                                         Appliances with a fresh enough
+                                         entry are not polled again.
+            :params str record_dir: Record every napalm session as replay
+                                    fixtures in this folder.
+            :params str layout: Layout algorithm (see layout.ALGORITHMS),
+                                or 'auto' to pick one from graph size.
+            :params LayoutCache layout_cache: Cache of computed layouts.
+            :params Tracer tracer: Records timing of every napalm call
+                                   (see tracing.py).
+            :params bool poll: If False, appliances are never polled and
+                               their data only comes from the cache (as
+                               filled by the collector daemon, see
+                               collector_daemon.py).
+            :params str cluster_by: Lay nodes out in clusters : inventory
+                                    field, 'name:<regex>' or 'community'
+                                    (see clustering.py).
+            :params str ghosts: Draw neighbors missing from the inventory
+                                as ghost nodes, one per 'host', 'subnet' or
+                                MAC 'vendor' (see ghosts.py).
+            :params callable resolver: Names ghost neighbors from their IP
+                                       (reverse DNS if None).
+            :params DNSCache dns_cache: Cache of ghost neighbor names.
+            :params bool routes: Also collect routing tables (see
+                                 routing.py and 'build_routed_edges').
+            :params int attempts: Collections of an appliance before it
+                                  is reported as failed (see
+                                  resilience.retry).
+            :params CircuitBreaker breaker: Skips appliances which failed
+                                            too often (see resilience.py).
         """
         # List of network appliances (containing data gathered with Napalm)
         self.appliances = []
@@ -58,14 +142,92 @@ class Loader:
         # List of graph nodes (coordinates, uid...)
         self.nodes = []
 
+        # Coordinates and edges arrays, viewed by nodes and edges
+        # (a node uid is also its row in the store)
+        self.store = GraphStore()
+
         # List of computed edges, each one refs 2 nodes
         self.edges = []
 
+        # Undirected edges, one per linked pair of nodes (see
+        # 'aggregate_edges'), empty until aggregated
+        self.links = []
+        # (lowest uid, highest uid) -> [link, its position in 'self.links',
+        # (edge, edge goes from lowest uid) pairs it aggregates], kept so
+        # that 'update_links' only rebuilds links of changed pairs
+        self.link_pairs = {}
+
         self.missing_neighbor = []  # See 'build_edges'
 
+        # Ghost nodes settings and nodes, if any (see 'build_ghosts')
+        self.ghosts = ghosts
+        self.resolver = resolver
+        self.dns_cache = dns_cache
+        self.ghost_nodes = []
+
+        # Routing tables collection, and edges from each node to the next
+        # hops of its routes (see 'build_routed_edges')
+        self.routes = routes
+        self.routed_edges = []
+
+        # IP address -> list of (node, interface) owning it
+        # (see 'build_ip_index' and 'lookup_ip')
+        self.ip_index = {}
+
+        # Outcome of every ARP entry processed by 'build_edges' :
+        # (node uid, interface) -> Edge, or None for a missing neighbor
+        self.arp_links = {}
+        # IP address -> set of (node uid, interface) having it in ARP table
+        self.arp_index = {}
+
         # napalm middlewares (see how napalm_collector works for more details.
         self.middlewares = {}
 
+        # Collection settings
+        defaults = CONFIG['default']
+        self.workers = workers if workers else defaults['workers']
+        self.connect_timeout = (
+            connect_timeout if connect_timeout
+            else defaults['connect_timeout']
+        )
+        self.getter_timeout = (
+            getter_timeout if getter_timeout
+            else defaults['getter_timeout']
+        )
+
+        # Appliances that could not be enriched (see 'CollectionFailure')
+        self.failed_appliances = []
+        # Appliances collected without their routing table (stage
+        # 'routes'), which still have their edges
+        self.route_failures = []
+
+        # Resilience settings (see resilience.py)
+        self.attempts = (
+            attempts if attempts else defaults['retries']['attempts']
+        )
+        self.breaker = breaker
+
+        # Optional napalm data cache (see snapshot_cache.py)
+        self.cache = cache
+
+        # Optional recording of napalm sessions (see replay_driver.py)
+        self.record_dir = record_dir
+
+        # Optional napalm calls tracing (see tracing.py)
+        self.tracer = tracer
+
+        # Cache only mode (appliances missing from cache are failures)
+        self.poll = poll
+
+        # Layout settings (see layout.py)
+        self.layout = layout if layout else defaults['layout']
+        self.layout_cache = layout_cache
+
+        # Optional clustering (see clustering.py), set by
+        # 'build_coordinates'
+        self.cluster_by = cluster_by
+        self.clustering = None
+
     def _get_uid(self):
         """ Return next available uid (which is basically a node counter)
             and increment the value for next call.
@@ -88,7 +250,13 @@ class Loader:
         if driver in self.middlewares:
             return self.middlewares[driver]
         else:
-            new_middleware = NapalmMiddleware(driver)
+            # napalm and its drivers take most of the startup time : they
+            # are only loaded once an appliance has to be polled
+            from malachite.napalm_collector import NapalmMiddleware
+
+            new_middleware = NapalmMiddleware(
+                driver, self.record_dir, self.tracer
+            )
             self.middlewares[driver] = new_middleware
             return new_middleware
 
@@ -102,71 +270,758 @@ class Loader:
                                           yaml file.
         """
         for appliance in yaml_appliances:
-            new_appliance = Appliance(
-                appliance['fqdn'],
-                appliance['driver'],
-                appliance['name']
-            )
+            self._add_appliance(appliance)
 
-            if 'port' in appliance:
-                new_appliance.port = appliance['port']
+    def _add_appliance(self, record):
+        """ Create an appliance, and the node encapsulating it.
 
-            self.appliances.append(new_appliance)
-            self.nodes.append(Node(self._get_uid(), new_appliance))
+            :params dict record: Appliance fqdn, driver, and optional name
+                                 and port (see inventory.py). Other fields
+                                 are kept as appliance tags.
+            :return: New appliance.
+            :rtype: Appliance
+        """
+        new_appliance = Appliance(
+            record['fqdn'],
+            record['driver'],
+            record.get('name')
+        )
 
-    def _napalm_enrich(self):
-        """ Enrich appliance data with napalm
+        if 'port' in record:
+            new_appliance.port = record['port']
+
+        new_appliance.tags = {
+            key: value for key, value in record.items()
+            if key not in INVENTORY_FIELDS
+        }
+
+        self.appliances.append(new_appliance)
+        self.nodes.append(
+            Node(self._get_uid(), new_appliance, self.store)
+        )
+        return new_appliance
+
+    @staticmethod
+    def _set_napalm_data(appliance, arp_table, ip_addresses,
+                         route_table=None):
+        """ Store raw napalm getters output into an appliance.
+
+            :params Appliance appliance: Appliance to complete.
+            :params list arp_table: Output of napalm get_arp_table.
+            :params dict ip_addresses: Output of napalm get_interfaces_ip.
+            :params dict route_table: Output of napalm get_route_to, if
+                                      collected.
+        """
+        appliance.ip_arp_table = {
+            entry['interface']: ip_address(entry['ip'])
+            for entry in arp_table
+        }
+        appliance.arp_macs = {
+            entry['interface']: entry.get('mac') for entry in arp_table
+        }
+
+        appliance.ip_local = OrderedDict()
+        for interface, entry_data in ip_addresses.items():
+            ipv4 = entry_data['ipv4']
+            for ip in ipv4.keys():
+                appliance.ip_local[ip_address(ip)] = interface
+
+        if route_table is not None:
+            appliance.routes = routes_from_napalm(route_table)
+
+    def _store_napalm_data(self, appliance, arp_table, ip_addresses,
+                           route_table=None):
+        """ Set freshly collected napalm data into an appliance and
+            keep it in cache, if any.
+        """
+        self._set_napalm_data(appliance, arp_table, ip_addresses, route_table)
+        if self.cache:
+            self.cache.put(appliance, arp_table, ip_addresses, route_table)
+
+    def iter_enrich(self, appliances=None, use_cache=True):
+        """ Enrich appliance data with napalm, one appliance at a time.
 
             Currently :
             - get arp table
             - get locally set up IPv4 (from every routed int)
+
+            Appliances with fresh enough data in cache are not polled.
+            Others are polled one after another unless more than one
+            worker is configured (see '_iter_enrich_concurrent'), or
+            reported as failures if polling is disabled, or if their
+            circuit breaker is open (see resilience.py).
+
+            A failing appliance never stops the run : it keeps its node,
+            without any edge, and is marked as such (see
+            Appliance.failure).
+
+            :params list appliances: Appliances to enrich, every appliance
+                                     if None.
+            :params bool use_cache: Read cached data, if any.
+            :return: Generator of EnrichResult, one per appliance, in
+                     completion order. Failures are also gathered in
+                     'self.failed_appliances' (and routing tables which
+                     could not be collected in 'self.route_failures').
         """
-        for appliance in self.appliances:
+        if appliances is None:
+            appliances = self.appliances
+
+        self.failed_appliances = []
+        self.route_failures = []
+
+        # Appliances may be read lazily (see 'iter_appliances') : cached
+        # ones are sorted out on the fly, and reported as soon as polling
+        # reports something (or once every appliance has been read).
+        ready = deque()
+
+        def stale():
+            for appliance in appliances:
+                start = time.perf_counter()
+                entry = None
+                if self.cache and use_cache:
+                    entry = self.cache.get(appliance)
+                if entry and self.routes and entry[2] is None:
+                    if self.poll:
+                        # Cached before routes were collected
+                        entry = None
+                    else:
+                        # Collected without routes (see CollectorDaemon
+                        # 'routes') : keep the appliance and its edges
+                        self.route_failures.append(CollectionFailure(
+                            appliance, 'routes',
+                            ErrLoadingFailed('No routing table collected '
+                                             'for %s' % appliance.fqdn)
+                        ))
+                if entry:
+                    self._set_napalm_data(appliance, *entry)
+                    ready.append(EnrichResult(
+                        appliance, 'cache', None, time.perf_counter() - start
+                    ))
+                elif not self.poll:
+                    failure = self._cached_failure(appliance)
+                    ready.append(EnrichResult(appliance, 'cache', failure, 0))
+                elif self.breaker and not self.breaker.allow(appliance.key):
+                    state = self.breaker.state(appliance.key)
+                    failure = CollectionFailure(
+                        appliance, 'breaker',
+                        ErrConnectionFailed(
+                            'Skipped until %s after %s failures (%s)' % (
+                                time.strftime('%Y-%m-%d %H:%M:%S',
+                                              time.localtime(
+                                                  state['open_until'])),
+                                state['failures'], state['error'])
+                        )
+                    )
+                    ready.append(
+                        EnrichResult(appliance, 'breaker', failure, 0)
+                    )
+                else:
+                    yield appliance
+
+        def report(result):
+            result.appliance.failure = result.failure
+            if result.failure:
+                self.failed_appliances.append(result.failure)
+            if self.breaker and result.source == 'napalm':
+                if not result.failure:
+                    self.breaker.succeeded(result.appliance.key)
+                elif result.failure.stage in ('connect', 'getters'):
+                    self.breaker.failed(
+                        result.appliance.key, result.failure.error
+                    )
+            return result
+
+        if self.workers > 1:
+            polled = self._iter_enrich_concurrent(stale())
+        else:
+            polled = self._iter_enrich_sequential(stale())
+
+        try:
+            for result in itertools.chain(polled, [None]):
+                while ready:
+                    yield report(ready.popleft())
+                if result is None:
+                    break
+                yield report(result)
+        finally:
+            if self.breaker:
+                self.breaker.save()
+
+    def _cached_failure(self, appliance):
+        """ CollectionFailure of an appliance without usable cached data,
+            when polling is disabled : the failure recorded by the
+            collector daemon, if its latest collection failed.
+        """
+        recorded = self.cache.get_failure(appliance) if self.cache else None
+        if recorded is None:
+            return CollectionFailure(
+                appliance, 'cache',
+                ErrLoadingFailed('No collected data for %s' % appliance.fqdn)
+            )
+
+        if recorded['last_success'] is None:
+            since = 'never collected'
+        else:
+            since = 'last collected %s' % time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(recorded['last_success'])
+            )
+        return CollectionFailure(
+            appliance, recorded['stage'],
+            ErrLoadingFailed('%s (%s)' % (recorded['error'], since))
+        )
 
+    def _napalm_enrich(self, appliances=None, use_cache=True):
+        """ Enrich appliances (see 'iter_enrich') and sort them by outcome.
+
+            :return: Appliances successfully enriched, and a list of
+                     CollectionFailure for the others.
+            :rtype: tuple(list, list)
+        """
+        succeeded = []
+        failed = []
+        for result in self.iter_enrich(appliances, use_cache):
+            if result.failure:
+                failed.append(result.failure)
+            else:
+                succeeded.append(result.appliance)
+
+        return succeeded, failed
+
+    def _middleware_of(self, appliance):
+        """ Middleware of an appliance driver, or the EnrichResult of an
+            appliance with an unknown driver.
+
+            :return: (middleware, None), or (None, failure).
+            :rtype: tuple(NapalmMiddleware, EnrichResult)
+        """
+        try:
+            return self._get_middleware(appliance.driver), None
+        except ErrInvalidDriver:
+            failure = CollectionFailure(appliance, 'driver', ErrInvalidDriver(
+                '%s is not a valid driver name (%s)'
+                % (appliance.driver, appliance.fqdn)
+            ))
+            return None, EnrichResult(appliance, 'napalm', failure, 0)
+
+    def _iter_enrich_sequential(self, appliances):
+        """ Poll appliances one after another. A failing appliance
+            doesn't stop the others (see '_iter_enrich_concurrent').
+
+            :params list appliances: Appliances to poll.
+            :return: Generator of EnrichResult.
+        """
+        for appliance in appliances:
+            n_middleware, failed = self._middleware_of(appliance)
+            if failed:
+                yield failed
+                continue
+
+            outcome, wall_time = self._collect_appliance(
+                n_middleware, appliance
+            )
+            yield self._store_outcome(appliance, outcome, wall_time)
+
+    def _collect_appliance(self, n_middleware, appliance):
+        """ Connect to a single appliance and run every getter on it,
+            again if a transient error occurs (see resilience.retry).
+            Meant to be run from a worker thread: nothing is written
+            to the loader here.
+
+            :params NapalmMiddleware n_middleware: Middleware for the
+                                                   appliance driver.
+            :params Appliance appliance: Appliance to collect data from.
+            :return: (arp_table, ip_addresses, route_table, route_error)
+                     napalm outputs and why routes are missing (no
+                     route_table unless 'self.routes'), or a
+                     CollectionFailure if ARP or IP collection went wrong,
+                     and the time spent on the appliance.
+            :rtype: tuple(object, float)
+        """
+        start = time.perf_counter()
+        # Step of the last attempt, for failure reports
+        progress = {'stage': 'connect'}
+        max_time = CONFIG['default']['retries']['max_time']
+
+        def collect():
+            progress['stage'] = 'connect'
+            timeout = self.connect_timeout
+            if max_time:
+                # Retries share the appliance time budget
+                timeout = max(1, min(
+                    timeout, max_time - (time.perf_counter() - start)
+                ))
+            try:
+                # Specific connection info (port,..) are stored in the node
+                broken = n_middleware.connect(
+                    appliance=appliance,
+                    username=CONFIG['default']['username'],
+                    password=CONFIG['default']['password'],
+                    timeout=timeout,
+                    read_timeout=self.getter_timeout)
+                if broken:
+                    raise ErrConnectionFailed(
+                        'Unable to connect to %s' % appliance.fqdn
+                    )
+
+                progress['stage'] = 'getters'
+                arp_table, ip_addresses = n_middleware.get_napalm_data(
+                    appliance.key, self.getter_timeout
+                )
+                route_table = route_error = None
+                if self.routes:
+                    # Best effort, and never retried : an appliance without
+                    # routes still gets its edges, and a getter failing for
+                    # good is not worth reconnecting
+                    try:
+                        route_table = n_middleware.get_route_table(
+                            appliance.key, self.getter_timeout
+                        )
+                    except Exception as err:  # pylint: disable=broad-except
+                        route_error = err
+                return arp_table, ip_addresses, route_table, route_error
+            finally:
+                # Don't keep thousands of sessions open once data is
+                # fetched, nor a broken one before trying again
+                try:
+                    n_middleware.disconnect(device=appliance.key)
+                except Exception:  # pylint: disable=broad-except
+                    pass
+
+        try:
+            outcome = retry(collect, self.attempts, max_time=max_time,
+                            clock=time.perf_counter)
+        except Exception as err:  # pylint: disable=broad-except
+            outcome = CollectionFailure(appliance, progress['stage'], err)
+
+        return outcome, time.perf_counter() - start
+
+    def _iter_enrich_concurrent(self, appliances):
+        """ Poll appliances with a pool of 'self.workers' threads.
+            A failing or slow appliance doesn't stop the others : it is
+            reported in its EnrichResult and its node stays in the graph
+            without any edge.
+
+            :params list appliances: Appliances to poll.
+            :return: Generator of EnrichResult, in completion order.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            jobs = {}
+            finished = deque()
+            for appliance in appliances:
+                # Middlewares are created here, workers only read them.
+                n_middleware, failed = self._middleware_of(appliance)
+                if failed:
+                    yield failed
+                    continue
+
+                job = executor.submit(
+                    self._collect_appliance, n_middleware, appliance
+                )
+                jobs[job] = appliance
+
+                # Report appliances already collected while the next
+                # ones are still being read
+                job.add_done_callback(finished.append)
+                while finished:
+                    yield self._job_result(finished.popleft(), jobs)
+
+            for job in as_completed(list(jobs)):
+                if job in jobs:
+                    yield self._job_result(job, jobs)
+
+    def _job_result(self, job, jobs):
+        """ Store the outcome of a finished collection job.
+
+            :params Future job: Finished '_collect_appliance' job.
+            :params dict jobs: Pending jobs -> appliance, 'job' is removed.
+            :rtype: EnrichResult
+        """
+        appliance = jobs.pop(job)
+        return self._store_outcome(appliance, *job.result())
+
+    def _store_outcome(self, appliance, outcome, wall_time):
+        """ Store the outcome of '_collect_appliance'.
+
+            :rtype: EnrichResult
+        """
+        if isinstance(outcome, CollectionFailure):
+            return EnrichResult(appliance, 'napalm', outcome, wall_time)
+        arp_table, ip_addresses, route_table, route_error = outcome
+        self._store_napalm_data(appliance, arp_table, ip_addresses,
+                                route_table)
+        if route_error is not None:
+            self.route_failures.append(
+                CollectionFailure(appliance, 'routes', route_error)
+            )
+        return EnrichResult(appliance, 'napalm', None, wall_time)
+
+    def iter_appliances(self, node_file, shard=None):
+        """ Read appliances from an inventory (see inventory.py for
+            supported formats) and build corresponding nodes, one at a time.
+
+            :params str node_file: Inventory filename.
+            :params tuple shard: (index, count) to only keep appliances of
+                                 a shard (see sharding.py).
+            :return: Generator of new appliances, each one being added to
+                     the loader before it is yielded.
+            :raises ErrLoadingFailed: If the inventory is missing or invalid.
+        """
+        for record in iter_inventory(node_file):
+            if shard and shard_of(record, shard[1]) != shard[0]:
+                continue
+            yield self._add_appliance(record)
+
+    def iter_shards(self, shard_files):
+        """ Merge appliances collected by shards (see sharding.py) into
+            the loader, as if they were collected by it. Edges are then
+            built as usual, IPs of every shard being checked against each
+            other.
+
+            :params list shard_files: Shard filenames.
+            :return: Generator of EnrichResult, one per appliance, as
+                     reported by its shard. Failures are also gathered in
+                     'self.failed_appliances'.
+            :raises ErrLoadingFailed: If a shard file is missing or invalid,
+                                      or if shards overlap.
+        """
+        self.failed_appliances = []
+        owners = {}
+
+        for shard_file in shard_files:
             try:
-                n_middleware = self._get_middleware(appliance.driver)
-            except ErrInvalidDriver:
-                raise ErrInvalidDriver('%s is not a valid driver name (%s)',
-                                       appliance.driver, appliance.fqdn)
-
-            # Specific connection info (port,..) are stored in the node
-            n_middleware.connect(
-                appliance=appliance,
-                username=CONFIG['default']['username'],
-                password=CONFIG['default']['password'])
-
-            # ARP table at current time
-            arp_table = n_middleware.get_arp_table(device_name=appliance.fqdn)
-            appliance.ip_arp_table = {
-                entry['interface']: ip_address(entry['ip'])
-                for entry in arp_table
-            }
-
-            # Ip address locally set
-            ip_addresses = n_middleware.get_interfaces_ip(
-                device_name=appliance.fqdn
-            )
-            for interface, entry_data in ip_addresses.items():
-                ipv4 = entry_data['ipv4']
-                for ip in ipv4.keys():
+                with open(shard_file, 'r') as s_file:
+                    shard = json.load(s_file)
+            except (OSError, ValueError) as err:
+                raise ErrLoadingFailed('Invalid shard %s (%s)'
+                                       % (shard_file, err))
+            if not isinstance(shard, dict) or 'appliances' not in shard:
+                raise ErrLoadingFailed('Invalid shard %s (no appliances)'
+                                       % shard_file)
+
+            for record in shard['appliances']:
+                key = (record['fqdn'], record['port'])
+                if key in owners:
+                    raise ErrLoadingFailed(
+                        'Appliance %s:%s found in shards %s and %s'
+                        % (key + (owners[key], shard_file))
+                    )
+                owners[key] = shard_file
+
+                appliance = self._add_appliance(dict(
+                    record.get('tags', {}),
+                    **{field: record[field] for field in INVENTORY_FIELDS}
+                ))
+                for ip, interface in record['ip_local']:
                     appliance.ip_local[ip_address(ip)] = interface
+                appliance.arp_macs = record.get('arp_macs', {})
+                if record.get('routes') is not None:
+                    appliance.routes = routes_from_list(record['routes'])
+                for interface, ip in record['ip_arp_table']:
+                    appliance.ip_arp_table[interface] = ip_address(ip)
+
+                failure = None
+                if record['failure']:
+                    failure = CollectionFailure(
+                        appliance, record['failure']['stage'],
+                        ErrLoadingFailed(record['failure']['error'])
+                    )
+                    self.failed_appliances.append(failure)
+                appliance.failure = failure
+
+                yield EnrichResult(
+                    appliance, record['source'], failure, record['wall_time']
+                )
+
+    def read_appliances(self, node_file):
+        """ Load appliances from file and build corresponding nodes,
+            without any napalm data yet (see 'iter_enrich').
+
+            :params str node_file: Filename of the appliance list
+        """
+        for _ in self.iter_appliances(node_file):
+            pass
 
     def load_nodes(self, node_file):
         """ Load appliances from file, build corresponding nodes
             and gather additional data using a NapalmMiddleware.
+            Appliances are collected while the rest of the file is read.
 
-            :params str node_file: Filename of yaml containing the
-                                   appliance list
+            :params str node_file: Filename of the appliance list
+            :return: Appliances successfully enriched, and a list of
+                     CollectionFailure for the others.
+            :rtype: tuple(list, list)
         """
-        try:
-            with open(node_file, 'r') as n_file:
-                appliances = yaml.load(n_file)
-        except FileNotFoundError:
-            raise ErrLoadingFailed('File %s not found' % node_file)
+        enriched = self._napalm_enrich(self.iter_appliances(node_file))
+        self.build_ip_index()
+        return enriched
+
+    def save_snapshot(self, db, label=None):
+        """ Save current state (appliances data, edges and coordinates)
+            as a new snapshot.
+
+            :params TopologyDB db: Database to write to.
+            :params str label: Optional description of the snapshot.
+            :return: Id of the new snapshot.
+            :rtype: int
+        """
+        return db.save(self, label)
+
+    def load_snapshot(self, db, snapshot_id=None):
+        """ Rebuild appliances, nodes and edges from a stored snapshot,
+            without polling anything. Nodes get their stored coordinates
+            back, so that there is no need for 'build_coordinates'.
+            Must be called on an empty loader.
+
+            Appliances which could not be collected get their failure back
+            (also gathered in 'self.failed_appliances'), ghost nodes are
+            restored with their edges, and routed edges are built from
+            stored routing tables if 'self.routes' is set.
+
+            :params TopologyDB db: Database to read from.
+            :params int snapshot_id: Snapshot to load, latest if None.
+            :return: Id of the loaded snapshot.
+            :rtype: int
+            :raises ErrLoadingFailed: If the snapshot doesn't exist.
+        """
+        (snapshot_id, appliances, local_ips, arp_entries, _, route_rows,
+         ghost_rows) = db.read(snapshot_id)
+
+        first = len(self.nodes)
+        self.failed_appliances = []
+        for (_, name, fqdn, port, driver, _, _, _, tags, stage, error,
+             _) in appliances:
+            record = dict(json.loads(tags), fqdn=fqdn, driver=driver,
+                          name=name)
+            if port:
+                record['port'] = port
+            appliance = self._add_appliance(record)
+            if stage:
+                appliance.failure = CollectionFailure(
+                    appliance, stage, ErrLoadingFailed(error)
+                )
+                self.failed_appliances.append(appliance.failure)
+
+        # Stored uid -> node
+        nodes = {
+            row[0]: node for row, node in zip(appliances, self.nodes[first:])
+        }
+        for uid, ip, interface in local_ips:
+            nodes[uid].appliance.ip_local[ip_address(ip)] = interface
+        for uid, interface, ip, mac in arp_entries:
+            appliance = nodes[uid].appliance
+            appliance.ip_arp_table[interface] = ip_address(ip)
+            if mac:
+                appliance.arp_macs[interface] = mac
+
+        # Uid -> prefix -> next hops, in 'routes_to_list' format
+        routes = {row[0]: OrderedDict() for row in appliances if row[11]}
+        for uid, prefix, next_hop, interface in route_rows:
+            routes[uid].setdefault(prefix, []).append([next_hop, interface])
+        for uid, rows in routes.items():
+            nodes[uid].appliance.routes = routes_from_list(rows.items())
+
+        # Edges are built again from ARP data, which gives the stored edges
+        # along with the indexes needed by 'refresh'.
+        self.build_ip_index()
+        self.build_edges()
+        if self.routes:
+            self.build_routed_edges()
+
+        # Ghosts get the ARP entries of their neighbors
+        owners = {}
+        for uid, label, grouped, neighbors, _, _, _ in ghost_rows:
+            neighbors = [tuple(neighbor) for neighbor in json.loads(neighbors)]
+            ghost = Node(self._get_uid(), GhostAppliance(
+                label, neighbors, bool(grouped)
+            ), self.store)
+            self.nodes.append(ghost)
+            self.ghost_nodes.append(ghost)
+            nodes[uid] = ghost
+            for ip, _ in neighbors:
+                owners[ip_address(ip)] = ghost
+        for node, eth, ip in self.missing_neighbor:
+            if ip in owners:
+                self.edges.append(Edge(node, owners[ip], [(eth, str(ip))]))
+
+        coordinates = [row[5:8] for row in appliances] + [
+            row[4:7] for row in ghost_rows
+        ]
+        if all(None not in coord for coord in coordinates):
+            self.store.set_coordinates(
+                coordinates, [node.row for node in nodes.values()]
+            )
+
+        return snapshot_id
+
+    def save_export(self, filename):
+        """ Export current state (appliances data, edges and coordinates)
+            to a file, see export.py for formats.
+
+            :params str filename: Export file (.npz, .json or .graphml).
+        """
+        write_export(self, filename)
+
+    def load_export(self, filename):
+        """ Rebuild appliances, nodes and edges from an export, without
+            polling anything. Nodes get their exported coordinates back,
+            so that there is no need for 'build_coordinates'.
+            Must be called on an empty loader.
+
+            Appliances which could not be collected get their failure back
+            (also gathered in 'self.failed_appliances'), exported edges are
+            restored (built again from ARP entries for exports older than
+            version 3), and routed edges are built from exported routing
+            tables if 'self.routes' is set.
+
+            :params str filename: Export file (.npz or .json).
+            :raises ErrLoadingFailed: If the file is missing or invalid.
+        """
+        columns, coordinates = read_export(filename)
+
+        first = len(self.nodes)
+        for name, fqdn, driver, port, tags in zip(
+                columns['name'], columns['fqdn'], columns['driver'],
+                columns['port'], columns['tags']):
+            self._add_appliance(dict(
+                json.loads(tags),
+                fqdn=fqdn, driver=driver, name=name, port=port
+            ))
+        nodes = self.nodes[first:]
+
+        self.failed_appliances = []
+        for node, stage, error in zip(nodes, columns['failure_stage'],
+                                      columns['failure_error']):
+            if stage:
+                node.appliance.failure = CollectionFailure(
+                    node.appliance, stage, ErrLoadingFailed(error)
+                )
+                self.failed_appliances.append(node.appliance.failure)
+
+        # Uid -> prefix -> next hops, in 'routes_to_list' format
+        route_rows = [
+            OrderedDict() if has_routes else None
+            for has_routes in columns['has_routes']
+        ]
+        for uid, prefix, next_hop, interface in zip(
+                columns['route_uid'], columns['route_prefix'],
+                columns['route_next_hop'], columns['route_interface']):
+            route_rows[uid].setdefault(prefix, []).append(
+                [next_hop or None, interface]
+            )
+        for node, rows in zip(nodes, route_rows):
+            if rows is not None:
+                node.appliance.routes = routes_from_list(rows.items())
+
+        for uid, ip, interface in zip(columns['local_uid'],
+                                      columns['local_ip'],
+                                      columns['local_interface']):
+            nodes[uid].appliance.ip_local[ip] = interface
+        for uid, interface, ip, mac in zip(
+                columns['arp_uid'], columns['arp_interface'],
+                columns['arp_ip'], columns['arp_mac']):
+            appliance = nodes[uid].appliance
+            appliance.ip_arp_table[interface] = ip
+            if mac:
+                appliance.arp_macs[interface] = mac
+
+        self.build_ip_index()
+        if 'edge_source' in columns:
+            self._restore_edges(nodes, columns)
         else:
-            self._build_appliances(appliances)
+            # Older exports : edges are built again from ARP data
+            self.build_edges()
+        if self.routes:
+            self.build_routed_edges()
+
+        if len(coordinates) == len(nodes):
+            self.store.set_coordinates(
+                coordinates, [node.row for node in nodes]
+            )
 
-        self._napalm_enrich()
+    def _restore_edges(self, nodes, columns):
+        """ Create exported ARP edges (see export.py), and index ARP
+            entries as 'build_edges' does, for 'refresh' and
+            'build_ghosts'.
+
+            :params list nodes: Imported nodes, by export uid.
+            :params dict columns: Export columns (see export.read_export).
+        """
+        for source, destination, eth, peer_eth in zip(
+                columns['edge_source'], columns['edge_destination'],
+                columns['edge_interface'], columns['edge_peer_interface']):
+            node = nodes[source]
+            edge = Edge(node, nodes[destination], [(eth, peer_eth)])
+            self.edges.append(edge)
+            self.arp_links[(node.uid, eth)] = edge
+
+        for node in nodes:
+            for eth, ip in node.appliance.ip_arp_table.items():
+                # Management links are never graphed (see
+                # '_link_arp_entry')
+                if 'Management' in eth:
+                    continue
+                self.arp_index.setdefault(ip, set()).add((node.uid, eth))
+                if (node.uid, eth) not in self.arp_links:
+                    self.missing_neighbor.append((node, eth, ip))
+                    self.arp_links[(node.uid, eth)] = None
+
+    def build_ip_index(self):
+        """ Index every local IP of every node, so that finding the owner
+            of an address is a single lookup instead of a scan of all nodes.
+            Must be called again whenever appliances local IPs change.
+        """
+        self.ip_index = {}
+        for node in self.nodes:
+            for ip, interface in node.appliance.ip_local.items():
+                self.ip_index.setdefault(ip, []).append((node, interface))
+
+    def lookup_ip(self, ip):
+        """ Tell which node(s) own a given IP.
+
+            :params ip: IP address (string or ipaddress object).
+            :return: List of (node, interface) tuples, empty if no known
+                     appliance has this IP.
+            :rtype: list
+        """
+        if isinstance(ip, str):
+            ip = ip_address(ip)
+        return list(self.ip_index.get(ip, ()))
+
+    def _link_arp_entry(self, node, eth, ip):
+        """ Create the edge matching a single ARP entry of a node, or
+            remember the entry as a missing neighbor if no node owns the IP.
+
+            :params Node node: Node holding the ARP entry.
+            :params str eth: Interface of the ARP entry.
+            :params ipaddress ip: IP of the ARP entry.
+            :return: New edge, if any.
+            :rtype: Edge
+        """
+        # We don't want to graph management links for now
+        # TODO: needs to be replaced with a generic regex (Mgt/mgmt/..)
+        if 'Management' in eth:
+            return None
+
+        self.arp_index.setdefault(ip, set()).add((node.uid, eth))
+
+        dest = [(dnode, d_eth) for dnode, d_eth in self.ip_index.get(ip, ())
+                if dnode != node]
+
+        if len(dest) > 1:
+            raise ErrRedefinedIP(
+                "Nodes %s all have an IP %s" % ([d[0] for d in dest], ip)
+            )
+
+        if not dest:
+            # Drawn as ghost nodes, if enabled (see 'build_ghosts')
+            self.missing_neighbor.append((node, eth, ip))
+            self.arp_links[(node.uid, eth)] = None
+            return None
+
+        edge = Edge(node, dest[0][0], [(eth, dest[0][1])])
+        self.edges.append(edge)
+        self.arp_links[(node.uid, eth)] = edge
+        return edge
 
     def build_edges(self):
         """ After loading every appliance/node, create every possible direct
@@ -178,29 +1033,355 @@ class Loader:
                 'Call "load_nodes()" or make sure appliance file is not empty'
             )
 
+        if not self.ip_index:
+            self.build_ip_index()
+
         for node in self.nodes:
             # Shortcut to the appliance inside the node (contains network data)
             app = node.appliance
             for eth, ip in app.ip_arp_table.items():
-                # We don't want to graph management links for now
-                # TODO: needs to be replaced with a generic regex (Mgt/mgmt/..)
-                if 'Management' not in eth:
+                self._link_arp_entry(node, eth, ip)
+
+    def build_ghosts(self):
+        """ Add a ghost node for each neighbor (or group of neighbors, see
+            'self.ghosts') missing from the inventory, with an edge from
+            each appliance seeing it. Neighbors are named by reverse DNS,
+            those which can't be resolved are named after their IP.
+
+            'build_edges' must have been called first. Does nothing if
+            ghosts are disabled or were already built.
+
+            :return: New ghost nodes.
+            :rtype: list
+        """
+        if not self.ghosts or self.ghost_nodes:
+            return []
+
+        names = resolve_names(
+            (ip for _, _, ip in self.missing_neighbor),
+            self.resolver, self.dns_cache
+        )
+
+        vendors = None
+        oui_file = CONFIG['default']['ghosts']['oui_file']
+        if self.ghosts == 'vendor' and oui_file:
+            vendors = read_oui_file(oui_file)
+
+        # Ghost label -> [neighbor IPs, (node, interface, IP) ARP entries]
+        groups = OrderedDict()
+        for node, eth, ip in self.missing_neighbor:
+            label = group_of(
+                self.ghosts, ip, node.appliance.arp_macs.get(eth), vendors
+            )
+            group = groups.setdefault(label, [OrderedDict(), []])
+            group[0][str(ip)] = names.get(str(ip))
+            group[1].append((node, eth, ip))
+
+        for label, (neighbors, entries) in groups.items():
+            ghost = Node(self._get_uid(), GhostAppliance(
+                label, list(neighbors.items()), self.ghosts != 'host'
+            ), self.store)
+            self.nodes.append(ghost)
+            self.ghost_nodes.append(ghost)
+            for node, eth, ip in entries:
+                self.edges.append(Edge(node, ghost, [(eth, str(ip))]))
+
+        return self.ghost_nodes
+
+    def aggregate_edges(self):
+        """ Merge edges linking the same pair of nodes (both directions of
+            a link, parallel links) into a single undirected edge, stored
+            in 'self.links'. Each one records its number of links, the
+            interface pairs (from its source node side) and whether both
+            ends see each other. Layout and plot then use these links.
+
+            'build_edges' must have been called first. Later changes of
+            'self.edges' are applied with 'update_links'.
+
+            :return: Aggregated edges.
+            :rtype: list
+        """
+        for link in self.links:
+            self.store.remove_edge(link.row)
+        self.links = []
+        self.link_pairs = {}
 
-                    dest = [dnode for dnode in self.nodes
-                            if dnode.appliance.has_ip(ip) and dnode != node]
+        # A node uid is also its row in the store
+        pairs = OrderedDict()
+        rows = self.store.rows_of(self.edges).tolist() if self.edges else []
+        for edge, (src_row, dst_row) in zip(self.edges, rows):
+            if src_row <= dst_row:
+                pairs.setdefault((src_row, dst_row), []).append((edge, True))
+            else:
+                pairs.setdefault((dst_row, src_row), []).append((edge, False))
 
-                    if len(dest) > 1:
-                        raise ErrRedefinedIP(
-                            "Nodes %s all have an IP %s" % (dest, ip)
+        for key, edges in pairs.items():
+            self._set_link(key, edges)
+
+        return self.links
+
+    def update_links(self, added=(), removed=()):
+        """ Apply changes of 'self.edges' to the aggregated links (see
+            'aggregate_edges') : only links of the node pairs linked by
+            added or removed edges are rebuilt.
+
+            :params list added: Edges added to 'self.edges'.
+            :params list removed: Edges removed from 'self.edges'.
+            :return: Aggregated edges.
+            :rtype: list
+        """
+        # Pair -> (edge, forward) pairs now linking it
+        touched = {}
+
+        def pair_edges(edge):
+            src_row, dst_row = edge.source.row, edge.destination.row
+            key = (min(src_row, dst_row), max(src_row, dst_row))
+            if key not in touched:
+                entry = self.link_pairs.get(key)
+                touched[key] = list(entry[2]) if entry else []
+            return touched[key], src_row <= dst_row
+
+        for edge in removed:
+            edges, _ = pair_edges(edge)
+            edges[:] = [entry for entry in edges if entry[0] is not edge]
+        for edge in added:
+            edges, forward = pair_edges(edge)
+            edges.append((edge, forward))
+
+        for key, edges in touched.items():
+            self._set_link(key, edges)
+
+        return self.links
+
+    def _set_link(self, key, edges):
+        """ Create, update or drop the link of a pair of nodes.
+
+            :params tuple key: (lowest uid, highest uid).
+            :params list edges: (edge, edge goes from lowest uid) pairs now
+                                linking both nodes.
+        """
+        entry = self.link_pairs.get(key)
+
+        if not edges:
+            if entry:
+                # Swap with the last link, to drop it in constant time
+                link, position, _ = self.link_pairs.pop(key)
+                last = self.links.pop()
+                if last is not link:
+                    self.links[position] = last
+                    self.link_pairs[
+                        (last.source.uid, last.destination.uid)
+                    ][1] = position
+                self.store.remove_edge(link.row)
+            return
+
+        directions = set()
+        interfaces = []
+        for edge, forward in edges:
+            directions.add(forward)
+            for src, dst in edge.interfaces:
+                pair = (src, dst) if forward else (dst, src)
+                if pair not in interfaces:
+                    interfaces.append(pair)
+
+        if entry is None:
+            link = Edge(self.store.nodes[key[0]], self.store.nodes[key[1]],
+                        interfaces)
+            self.link_pairs[key] = [link, len(self.links), edges]
+            self.links.append(link)
+        else:
+            link = entry[0]
+            entry[2] = edges
+            link.interfaces = interfaces
+            link.multiplicity = max(1, len(interfaces))
+            # Same row, but not the same link anymore
+            self.store.version += 1
+        link.bidirectionnal = len(directions) == 2
+
+    def build_routed_edges(self, nodes=None):
+        """ Link each node to the next hops of its routes towards every
+            other appliance. The address of each appliance (its first
+            loopback address, or else its first local IP) is looked up in
+            the routing table of every node, and next hop IPs are matched
+            to the node owning them. Edges are stored in
+            'self.routed_edges', one per (node, next hop node) pair, with
+            every (outgoing interface, next hop IP) pair used.
+
+            Routes must have been collected (see 'routes' option) and
+            'build_ip_index' called. Destinations reached without a next
+            hop IP (connected routes) give no edge.
+
+            :params list nodes: Only rebuild routed edges from these nodes
+                                (whose routing table changed), every node
+                                if None.
+            :return: Routed edges.
+            :rtype: list
+        """
+        if nodes is None:
+            sources = self.nodes
+            stale, kept = self.routed_edges, []
+        else:
+            sources = nodes
+            rows = {node.row for node in nodes}
+            stale = [edge for edge in self.routed_edges
+                     if edge.source.row in rows]
+            kept = [edge for edge in self.routed_edges
+                    if edge.source.row not in rows]
+        for edge in stale:
+            self.store.remove_edge(edge.row)
+        self.routed_edges = kept
+
+        # One address per appliance
+        targets = []
+        for node in self.nodes:
+            local = node.appliance.ip_local
+            if not local:
+                continue
+            loopbacks = [ip for ip, interface in local.items()
+                         if interface.lower().startswith('lo')]
+            targets.append(
+                (node, loopbacks[0] if loopbacks else next(iter(local)))
+            )
+        addresses = [ip for _, ip in targets]
+
+        # (node uid, next hop node uid) -> [node, next hop node,
+        # (interface, next hop) pairs]
+        pairs = OrderedDict()
+        for node in sources:
+            routes = node.appliance.routes
+            if routes is None or not targets:
+                continue
+            matches = routes.lookup_many(addresses)
+            for (target, _), next_hops in zip(targets, matches):
+                if target is node or not next_hops:
+                    continue
+                for next_hop, interface in next_hops:
+                    for hop_node, _ in self.ip_index.get(next_hop, ()):
+                        if hop_node is node:
+                            continue
+                        entry = pairs.setdefault(
+                            (node.uid, hop_node.uid), [node, hop_node, []]
                         )
+                        if (interface, str(next_hop)) not in entry[2]:
+                            entry[2].append((interface, str(next_hop)))
 
-                    if not dest:
-                        # TODO: we don't use 'missing_neighbors' yet...
-                        self.missing_neighbor.append((node, ip))
-                    else:
-                        self.edges.append(Edge(node, dest[0]))
+        for source, destination, interfaces in pairs.values():
+            self.routed_edges.append(Edge(source, destination, interfaces))
+
+        return self.routed_edges
+
+    def refresh(self, appliances=None):
+        """ Poll some appliances again and only update what changed since
+            last collection : edges built from modified ARP entries, or
+            pointing to IPs that moved, are replaced and the rest of the
+            graph is left untouched. If any edge changed, the layout is
+            computed again starting from current node coordinates, so that
+            the graph stays visually stable.
+
+            'load_nodes' and 'build_edges' must have been called first.
+            Ghost nodes (see 'build_ghosts') are left as they are.
+
+            :params list appliances: Appliances (or appliance names) to poll,
+                                     every appliance if None.
+            :return: Edges added, edges removed, and CollectionFailure list
+                     of appliances that could not be polled (they keep
+                     their previous data).
+            :rtype: tuple(list, list, list)
+        """
+        if appliances is None:
+            appliances = self.appliances
+        else:
+            by_name = {app.name: app for app in self.appliances}
+            appliances = [
+                by_name[app] if isinstance(app, str) else app
+                for app in appliances
+            ]
+
+        nodes = {node.appliance: node for node in self.nodes}
+        previous = {
+            app: (app.ip_local, app.ip_arp_table, app.routes)
+            for app in appliances
+        }
+
+        # Without polling, latest data is whatever the daemon cached
+        _, failed = self._napalm_enrich(appliances, use_cache=not self.poll)
+
+        # ARP entries (node, interface) whose edge must be computed again
+        stale_entries = set()
+        moved_ips = set()
+        # Nodes whose routing table changed
+        rerouted = []
+
+        for app, (old_local, old_arp, old_routes) in previous.items():
+            node = nodes[app]
+            if self.routes and not _same_routes(old_routes, app.routes):
+                rerouted.append(node)
+
+            for ip in set(old_local) | set(app.ip_local):
+                if old_local.get(ip) == app.ip_local.get(ip):
+                    continue
+                moved_ips.add(ip)
+                owners = [owner for owner in self.ip_index.get(ip, ())
+                          if owner[0] is not node]
+                if ip in app.ip_local:
+                    owners.append((node, app.ip_local[ip]))
+                if owners:
+                    self.ip_index[ip] = owners
+                else:
+                    self.ip_index.pop(ip, None)
+
+            for eth in set(old_arp) | set(app.ip_arp_table):
+                if old_arp.get(eth) != app.ip_arp_table.get(eth):
+                    stale_entries.add((node, eth, old_arp.get(eth)))
 
-    def build_coordinates(self):
+        # Other nodes ARP entries pointing to an IP that changed owner
+        for ip in moved_ips:
+            for uid, eth in self.arp_index.get(ip, ()):
+                stale_entries.add((self.nodes[uid], eth, ip))
+
+        removed = []
+        missing_removed = []
+        for node, eth, old_ip in stale_entries:
+            if (node.uid, eth) in self.arp_links:
+                edge = self.arp_links.pop((node.uid, eth))
+                if edge:
+                    removed.append(edge)
+                else:
+                    missing_removed.append((node, eth, old_ip))
+                self.arp_index.get(old_ip, set()).discard((node.uid, eth))
+
+        for edge in removed:
+            self.store.remove_edge(edge.row)
+        if removed:
+            removed_ids = {id(edge) for edge in removed}
+            self.edges = [
+                edge for edge in self.edges if id(edge) not in removed_ids
+            ]
+        for entry in missing_removed:
+            self.missing_neighbor.remove(entry)
+
+        added = []
+        for node, eth, _ in stale_entries:
+            ip = node.appliance.ip_arp_table.get(eth)
+            if ip is not None and (node.uid, eth) not in self.arp_links:
+                edge = self._link_arp_entry(node, eth, ip)
+                if edge:
+                    added.append(edge)
+
+        if added or removed:
+            if self.links:
+                self.update_links(added, removed)
+            self.build_coordinates(warm_start=True)
+        if self.routes:
+            if moved_ips:
+                # Route targets and next hop owners may have changed
+                self.build_routed_edges()
+            elif rerouted:
+                self.build_routed_edges(rerouted)
+
+        return added, removed, failed
+
+    def build_coordinates(self, warm_start=False):
         """ Compute a layout of coordinates using igraph and set each node
             coordinates.
 
@@ -209,19 +1390,73 @@ class Loader:
             when needed (so far, we have only one set of nodes and
             on set of edges, but later on, we may have multiple
             sets of edges
+
+            The layout algorithm is 'self.layout' (picked from graph size
+            if 'auto', see layout.py). Layouts from scratch are looked up in
+            and saved to 'self.layout_cache', if any.
+
+            With 'self.cluster_by', nodes are clustered first, and laid
+            out cluster by cluster (see clustering.py).
+
+            :params bool warm_start: Start from current node coordinates
+                                     instead of a random layout (fewer
+                                     iterations, and nodes barely move if
+                                     the graph barely changed). Ignored
+                                     with clusters.
         """
 
-        # Create a list of tuples with node indexes instead of the
-        # full objects (so that we can feed it to iGraph)
-        edge_idx = [
-            e.to_indexes()
-            for e in self.edges
-        ]
+        # Edges as (source uid, destination uid) pairs, straight from the
+        # store (so that we can feed it to iGraph). Aggregated links, if
+        # any, give the same layout from fewer edges.
+        edges = self.links if self.links else self.edges
+        edge_idx = self.store.rows_of(edges).tolist() if edges else []
+
+        algorithm = self.layout
+        if algorithm == 'auto':
+            algorithm = choose_algorithm(len(self.nodes))
+
+        # Cached coordinates are mapped back to nodes by appliance key, not
+        # by name (see LayoutCache.node_id)
+        ids = [LayoutCache.node_id(n.appliance) for n in self.nodes]
+
+        if self.cluster_by:
+            self.clustering = build_clustering(
+                self.cluster_by, self.nodes, edge_idx
+            )
+            # Clusters are always laid out from scratch, and their layout
+            # depends on which node went to which cluster
+            warm_start = False
+            algorithm = 'clusters/%s/%s/%s' % (
+                self.cluster_by, self.layout, self.clustering.signature(ids)
+            )
+
+        cache_key = None
+        # Nodes sharing an id (duplicated inventory entries) can't be told
+        # apart in a cached layout
+        if (self.layout_cache and not warm_start
+                and len(set(ids)) == len(ids)):
+            cache_key = self.layout_cache.key(ids, edge_idx, algorithm)
+            cached = self.layout_cache.get(cache_key)
+            if cached and all(node in cached for node in ids):
+                self.store.set_coordinates([cached[node] for node in ids])
+                return
 
-        igraph = ig.Graph(edge_idx, directed=False)
-        layout = igraph.layout('kk', dim=3)
+        if self.clustering:
+            self.store.set_coordinates(
+                clustered_layout(self.clustering, edge_idx, self.layout)
+            )
+        else:
+            seed = None
+            if warm_start:
+                seed = self.store.coordinates.tolist()
 
-        for idx, coord in enumerate(layout):
-            self.nodes[idx].x_coord = coord[0]
-            self.nodes[idx].y_coord = coord[1]
-            self.nodes[idx].z_coord = coord[2]
+            layout = compute_layout(
+                len(self.nodes), edge_idx, algorithm, seed
+            )
+            if layout:
+                self.store.set_coordinates(layout)
+
+        if cache_key:
+            self.layout_cache.put(
+                cache_key, dict(zip(ids, self.store.coordinates.tolist()))
+            )
@@ -1,42 +1,152 @@
 """ Malachite main algorithm
 
-    Still in a messed up state (CLI has to know the algorithm)
-    but not for long.
+    'Malachite.algorithm' runs every step of the graphing process and
+    reports each of them as a StageEvent, so that callers (CLI or any
+    other tool embedding malachite) get progress and timings from a
+    single stream.
 """
 
+import resource
+import tempfile
+import time
+from collections import namedtuple
+
+from malachite.diff import diff_loaders
 from malachite.loader import Loader
-from malachite.plotly_helper import PlotlyHelper
+from malachite.queries import TopologyQuery
+from malachite.sharding import collect_sharded
 from malachite.utils.config import CONFIG
 from malachite.utils.exceptions import ErrNodesNotLoaded
 
 
+# Report of a pipeline step :
+# - stage : load, enrich, edges, ghosts (only if enabled), aggregate, routes
+#   (only if enabled), layout or plot
+# - name : appliance name for per appliance 'enrich' events, None for
+#   events covering a whole stage
+# - wall_time / cpu_time : seconds spent (cpu_time is None for per appliance
+#   events, appliances being collected in parallel)
+# - items : number of objects handled (appliances, edges, nodes...)
+# - memory_delta : change of the process resident memory, in bytes (None
+#   for per appliance events, and accounted in 'enrich' for 'load')
+# - detail : EnrichResult for per appliance events, failures list for the
+#   'enrich' stage event, None otherwise
+StageEvent = namedtuple(
+    'StageEvent',
+    ['stage', 'name', 'wall_time', 'cpu_time', 'items', 'memory_delta',
+     'detail']
+)
+
+
+def _memory_usage():
+    """Resident memory of the process, in bytes"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # No procfs : peak memory is the best we have
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _StageProbe:
+    """Measure resources used between creation and 'event' call"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.memory = _memory_usage()
+
+    def event(self, items, detail=None):
+        """Build the StageEvent of the whole stage"""
+        return StageEvent(
+            self.stage,
+            None,
+            time.perf_counter() - self.wall,
+            time.process_time() - self.cpu,
+            items,
+            _memory_usage() - self.memory,
+            detail
+        )
+
+
+class _TimedIterator:
+    """ Iterate over an iterable, measuring time spent producing items
+        (e.g. reading an inventory lazily while its items are used).
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.items = 0
+        self.wall_time = 0
+        self.cpu_time = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            item = next(self.iterator)
+        finally:
+            self.wall_time += time.perf_counter() - wall
+            self.cpu_time += time.process_time() - cpu
+        self.items += 1
+        return item
+
+
 class Malachite:
     """ Malachite lib entry point.
         Basically wraps Loader and templates graph creation.
     """
 
-    def __init__(self, config_file=None, app_file=None, graph_file=None):
-        """Create a few empty objects that will be initialized later."""
+    def __init__(self, config_file=None, app_file=None, graph_file=None,
+                 processes=1, shard_files=None, **loader_options):
+        """ Create a few empty objects that will be initialized later.
+
+            Any extra keyword argument is given to the Loader
+            (workers, connect_timeout, ...).
+
+            :params int processes: Split collection between this number of
+                                   processes (see sharding.py).
+            :params list shard_files: Merge these shard files instead of
+                                      collecting anything.
+        """
 
         # Malachite loader
         self.loader = None
 
+        # Queries over the loader graph (see 'query')
+        self.queries = None
+
         # TODO : Incorrect but just a reminder that we want to handle custom
         # config file some day.
         self.config = config_file
 
         self.graph_file = graph_file
 
+        self.loader_options = loader_options
+
+        # Sharded collection settings
+        self.processes = processes
+        self.shard_files = shard_files
+
         if app_file:
             self.appliances_file = app_file
         else:
-            self.appliances_file = CONFIG['default']['appliances_file']
+            self.appliances_file = CONFIG['default']['appliances']
 
     def load_appliances(self):
-        """Load appliance file, establish connections and fetch add. data"""
+        """ Load appliance file, establish connections and fetch add. data
 
-        self.loader = Loader()
-        self.loader.load_nodes(self.appliances_file)
+            :return: Appliances successfully enriched, and a list of
+                     CollectionFailure for the others.
+            :rtype: tuple(list, list)
+        """
+
+        self.loader = Loader(**self.loader_options)
+        return self.loader.load_nodes(self.appliances_file)
 
     def load_edges(self):
         """Tell the loader to build and store edge list from node list"""
@@ -46,34 +156,240 @@ class Malachite:
 
         self.loader.build_edges()
 
+    def build_ghosts(self):
+        """Add ghost nodes for neighbors missing from the inventory"""
+
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        return self.loader.build_ghosts()
+
+    def aggregate_edges(self):
+        """Merge edges into one undirected edge per linked pair of nodes"""
+
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        self.loader.aggregate_edges()
+
+    def build_routed_edges(self):
+        """Link nodes to the next hops of their routes"""
+
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        return self.loader.build_routed_edges()
+
     def build_coordinates(self):
         """Set node coordinates from igraph"""
         self.loader.build_coordinates()
 
-    def plot(self):
+    def refresh(self, appliances=None):
+        """ Poll appliances again and update edges and layout in place
+            (see Loader.refresh).
+
+            :params list appliances: Appliances or names, None for all.
+            :return: Edges added, edges removed and collection failures.
+            :rtype: tuple(list, list, list)
+        """
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        return self.loader.refresh(appliances)
+
+    def load_snapshot(self, db, snapshot_id=None):
+        """ Load a stored snapshot instead of polling appliances : edges
+            and coordinates are restored, and the graph can be plotted
+            right away.
+
+            :params TopologyDB db: Snapshots database.
+            :params int snapshot_id: Snapshot to load, latest if None.
+            :return: Id of the loaded snapshot.
+            :rtype: int
+        """
+        self.loader = Loader(**self.loader_options)
+        snapshot_id = self.loader.load_snapshot(db, snapshot_id)
+        self.loader.aggregate_edges()
+        return snapshot_id
+
+    def load_export(self, filename):
+        """ Load an export (see export.py) instead of polling appliances :
+            edges and coordinates are restored, and the graph can be
+            plotted right away.
+
+            :params str filename: Export file (.npz or .json).
+        """
+        self.loader = Loader(**self.loader_options)
+        self.loader.load_export(filename)
+        self.loader.aggregate_edges()
+
+    def save_export(self, filename):
+        """Export current loader state (see export.py)"""
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        self.loader.save_export(filename)
+
+    def save_snapshot(self, db, label=None):
+        """Save current loader state in a snapshots database"""
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        return self.loader.save_snapshot(db, label)
+
+    def plot(self, graph_file=None):
         """Draw 3D graph with plotly"""
 
+        if graph_file:
+            self.graph_file = graph_file
+
+        # Only loaded when plotting (slow to import)
+        from malachite.plotly_helper import PlotlyHelper
+
         # Init with main node list (our appliances)
-        plotlyhelper = PlotlyHelper(self.loader.nodes)
+        plotlyhelper = PlotlyHelper(self.loader.nodes, self.loader.clustering)
 
-        # Add edges as a new scatter
-        plotlyhelper.build_edge_scatter(
-            self.loader.edges,
-            "L3 direct connections",
-        )
+        # Add edges as a new scatter (aggregated ones, if any), or draw
+        # clusters
+        edges = self.loader.links if self.loader.links else self.loader.edges
+        if self.loader.clustering:
+            plotlyhelper.build_cluster_scatters(
+                edges, self.loader.routed_edges
+            )
+        else:
+            plotlyhelper.build_edge_scatter(edges, "L3 direct connections")
+            if self.loader.routed_edges:
+                plotlyhelper.build_edge_scatter(
+                    self.loader.routed_edges, "Routed next hops",
+                    color='rgb(60,120,200)'
+                )
 
         # Plot graph (node scatter + any edge scatter added before this call)
         if not self.graph_file:
-            self.graph_file = self.config['default']['graph_file']
+            self.graph_file = CONFIG['default']['graph_file']
         plotlyhelper.plot(self.graph_file)
 
+    def diff(self, other):
+        """ Changes from another topology to the current one (see
+            diff.py).
+
+            :params Malachite other: Former topology (an older snapshot,
+                                     an export...).
+            :rtype: TopologyDiff
+        """
+        if not self.loader or not other.loader:
+            raise ErrNodesNotLoaded
+
+        return diff_loaders(other.loader, self.loader)
+
+    def plot_diff(self, diff, graph_file=None):
+        """Draw the current graph, with changes of a diff highlighted"""
+
+        if graph_file:
+            self.graph_file = graph_file
+
+        from malachite.plotly_helper import PlotlyHelper
+
+        plotlyhelper = PlotlyHelper(self.loader.nodes)
+        plotlyhelper.build_diff_scatters(diff)
+
+        if not self.graph_file:
+            self.graph_file = CONFIG['default']['graph_file']
+        plotlyhelper.plot(self.graph_file)
+
+    def query(self):
+        """ Path and reachability queries over the current graph.
+
+            :rtype: TopologyQuery
+        """
+        if not self.loader:
+            raise ErrNodesNotLoaded
+
+        if self.queries is None or self.queries.loader is not self.loader:
+            self.queries = TopologyQuery(self.loader)
+        return self.queries
+
+    def _collect_shards(self, workdir):
+        """ Shard files to merge : the given ones, or those written by
+            one collection process per shard.
+
+            :params str workdir: Folder for shard files written here.
+            :rtype: list
+        """
+        if self.shard_files:
+            return self.shard_files
+
+        # Tracers can't be shared between processes
+        options = dict(self.loader_options, tracer=None)
+        return collect_sharded(
+            self.appliances_file, self.processes, workdir, **options
+        )
+
     def algorithm(self):
-        """ Full plotting algorithm
+        """ Full plotting algorithm, as a generator : a StageEvent is
+            yielded after each step, and after each appliance collected.
+            Nothing is done until the generator is consumed.
         """
-        # TODO: yield status/objects __str__ after completion of each step so
-        # that CLI can use this function directly instead of calling every
-        # sub functions.
-        self.load_appliances()
+        # Appliances are collected while the inventory is read : 'load'
+        # and 'enrich' events follow per appliance events, and the time
+        # spent reading is only accounted in 'load'.
+        probe = _StageProbe('enrich')
+        self.loader = Loader(**self.loader_options)
+        with tempfile.TemporaryDirectory() as workdir:
+            if self.shard_files or self.processes > 1:
+                # Reading shard files is the 'load' stage here
+                reader = _TimedIterator(
+                    self.loader.iter_shards(self._collect_shards(workdir))
+                )
+                results = reader
+            else:
+                reader = _TimedIterator(
+                    self.loader.iter_appliances(self.appliances_file)
+                )
+                results = self.loader.iter_enrich(reader)
+
+            for result in results:
+                app = result.appliance
+                yield StageEvent(
+                    'enrich', app.name, result.wall_time, None,
+                    len(app.ip_arp_table) + len(app.ip_local), None, result
+                )
+        self.loader.build_ip_index()
+        enrich = probe.event(
+            len(self.loader.appliances), list(self.loader.failed_appliances)
+        )
+
+        yield StageEvent(
+            'load', None, reader.wall_time, reader.cpu_time,
+            reader.items, 0, None
+        )
+        yield enrich._replace(
+            wall_time=enrich.wall_time - reader.wall_time,
+            cpu_time=enrich.cpu_time - reader.cpu_time
+        )
+
+        probe = _StageProbe('edges')
         self.load_edges()
+        yield probe.event(len(self.loader.edges))
+
+        if self.loader.ghosts:
+            probe = _StageProbe('ghosts')
+            self.build_ghosts()
+            yield probe.event(len(self.loader.ghost_nodes))
+
+        probe = _StageProbe('aggregate')
+        self.aggregate_edges()
+        yield probe.event(len(self.loader.links))
+
+        if self.loader.routes:
+            probe = _StageProbe('routes')
+            self.build_routed_edges()
+            yield probe.event(len(self.loader.routed_edges))
+
+        probe = _StageProbe('layout')
         self.build_coordinates()
+        yield probe.event(len(self.loader.nodes))
+
+        probe = _StageProbe('plot')
         self.plot()
+        yield probe.event(len(self.loader.nodes) + len(self.loader.links))
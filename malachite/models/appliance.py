@@ -16,6 +16,10 @@ class Appliance:
         arp table, etc)
     """
 
+    # Ghost appliances stand for neighbors out of the inventory (see
+    # ghosts.py) : they are never collected nor saved
+    ghost = False
+
     def __init__(self, fqdn, driver, name=None):
 
         # Appliance fqdn - can be used as node label
@@ -28,9 +32,21 @@ class Appliance:
         self.driver = driver
         self.port = 0  # set manually if needed, after object creation
 
+        # Any other inventory field (site, pod...), see clustering.py
+        self.tags = {}
+
         # List of IP addresses configured on appliance and ip arp table
         self.ip_local = OrderedDict()
         self.ip_arp_table = {}
+        # MAC address of each ARP entry, by interface
+        self.arp_macs = {}
+
+        # Routing table (routing.PrefixTrie), None if not collected
+        self.routes = None
+
+        # Why the last collection failed (loader.CollectionFailure), None
+        # if it succeeded : the appliance is then drawn as unreachable
+        self.failure = None
 
     def __repr__(self):
         """Simple representation"""
@@ -65,6 +81,26 @@ class Appliance:
         )
         return desc
 
+    @property
+    def key(self):
+        """ Identify the appliance by its connection settings.
+
+            Several appliances can share the same fqdn (port forwarding,
+            lab setups...), so the fqdn alone is not enough.
+
+            :return: (fqdn, port) tuple.
+            :rtype: tuple
+        """
+        return (self.fqdn, self.port)
+
+    def hover_text(self):
+        """Appliance name, and why it is unreachable if so, for plots"""
+        if not self.failure:
+            return self.name
+        return '%s<br>unreachable (%s failed : %s)' % (
+            self.name, self.failure.stage, self.failure.error
+        )
+
     def has_ip(self, ip_addr):
         """ Check if ip_addr is in the ip_local dict
 
@@ -3,6 +3,15 @@
     Represents and edge in the network graph.
     The edge has a source and destination points, but may be used as
     birdirectional.
+
+    Source and destination are stored as a row of the GraphStore of the
+    source node (see graph_store.py) : both nodes must share a store. Once
+    removed from the store, an edge keeps its own copy of them.
+
+    Edges built from ARP entries are directed, and a physical link usually
+    gives two of them (one per end). Loader.aggregate_edges merges them into
+    a single undirected edge per pair of nodes, which holds every interface
+    pair linking both nodes.
 """
 
 
@@ -12,17 +21,69 @@ class Edge:
         (L3 relations graph using ip/arp table) doesn't require it)
     """
 
-    def __init__(self, source, destination):
-        self.source = source
-        self.destination = destination
+    __slots__ = ('store', 'row', 'ends', 'bidirectionnal', 'multiplicity',
+                 'interfaces')
+
+    def __init__(self, source, destination, interfaces=None):
+        """ Create edge and allocate its row.
+
+            :params Node source: Source node.
+            :params Node destination: Destination node.
+            :params list interfaces: (source interface, destination
+                                     interface) pairs linking both nodes.
+        """
+        self.store = source.store
+        # (source row, destination row) once removed from the store
+        self.ends = None
+        self.row = self.store.add_edge(self, source.row, destination.row)
         self.bidirectionnal = False
 
+        # Number of links between both nodes, and their interfaces
+        self.interfaces = list(interfaces) if interfaces else []
+        self.multiplicity = max(1, len(self.interfaces))
+
+    def detach(self, ends):
+        """ Keep both ends of the edge, as its row is freed (see
+            GraphStore.remove_edge).
+
+            :params tuple ends: (source row, destination row).
+        """
+        self.ends = ends
+        self.row = None
+
+    @property
+    def source(self):
+        """Source node"""
+        if self.row is None:
+            return self.store.nodes[self.ends[0]]
+        return self.store.nodes[self.store.edge_rows[self.row, 0]]
+
+    @property
+    def destination(self):
+        """Destination node"""
+        if self.row is None:
+            return self.store.nodes[self.ends[1]]
+        return self.store.nodes[self.store.edge_rows[self.row, 1]]
+
     def to_indexes(self):
         """ Return plotly friendly representation of edge,
             using source and dest nodes index.
         """
         return (self.source.uid, self.destination.uid)
 
+    def hover_text(self):
+        """Short description of the link(s), for plot hover labels"""
+        desc = "%s %s %s" % (
+            self.source.appliance.name,
+            '<->' if self.bidirectionnal else '->',
+            self.destination.appliance.name
+        )
+        if self.multiplicity > 1:
+            desc += " (%s links)" % self.multiplicity
+        for src_if, dst_if in self.interfaces:
+            desc += "<br>%s - %s" % (src_if, dst_if)
+        return desc
+
     def __str__(self):
         """Edge description"""
 
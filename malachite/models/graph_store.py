@@ -0,0 +1,168 @@
+""" Graph store.
+
+    Holds graph data in a few contiguous numpy arrays instead of one
+    Python object per node/edge attribute :
+    - coordinates of every node, as a (N, 3) float array,
+    - edges, as a (E, 2) int array of node rows.
+    Node and Edge objects are lightweight views on a row of those arrays,
+    so that layout results can be written, and plotting data read, with
+    vectorized slices.
+
+    Rows of removed edges are reused by later edges, so that rebuilding
+    edges (aggregation, refresh, routed edges) doesn't grow the store. Edge
+    views of removed edges are detached from their row first : they keep
+    their ends and stay readable.
+
+    'version' changes whenever a node or an edge is added or removed, so
+    that results computed from the graph structure can be cached (see
+    queries.py).
+"""
+
+import numpy as np
+
+
+class GraphStore:
+    """ Contiguous storage of node coordinates and edges.
+    """
+
+    def __init__(self, capacity=16):
+        """ Init empty store.
+
+            :params int capacity: Initial number of node/edge rows
+                                  (arrays grow automatically).
+        """
+        capacity = max(1, capacity)
+
+        # Node views, by row
+        self.nodes = []
+        self.coords = np.zeros((capacity, 3))
+
+        # Edge views, by row (None for free rows)
+        self.edge_views = []
+        self.edge_rows = np.zeros((capacity, 2), dtype=np.int64)
+        self.edge_valid = np.zeros(capacity, dtype=bool)
+        # Rows of removed edges, reused by 'add_edge'
+        self.free_edge_rows = []
+
+        # Structure changes counter
+        self.version = 0
+
+    @staticmethod
+    def _grow(array, size):
+        """Return array with at least 'size' rows (doubling its capacity)"""
+        if size <= len(array):
+            return array
+        grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:],
+                         dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    @property
+    def node_count(self):
+        """Number of nodes in store"""
+        return len(self.nodes)
+
+    @property
+    def coordinates(self):
+        """(N, 3) array of every node coordinates (not a copy)"""
+        return self.coords[:len(self.nodes)]
+
+    def add_node(self, node):
+        """ Allocate a coordinates row for a node.
+
+            :params Node node: Node view using this row.
+            :return: Row of the node.
+            :rtype: int
+        """
+        row = len(self.nodes)
+        self.coords = self._grow(self.coords, row + 1)
+        self.coords[row] = 0
+        self.nodes.append(node)
+        self.version += 1
+        return row
+
+    def set_coordinates(self, coordinates, rows=None):
+        """ Set coordinates of every node (or of some rows) at once.
+
+            :params coordinates: (N, 3) array-like.
+            :params rows: Rows to set, every node if None.
+        """
+        if rows is None:
+            self.coords[:len(self.nodes)] = coordinates
+        else:
+            self.coords[rows] = coordinates
+
+    def coordinates_of(self, nodes):
+        """ Coordinates of some nodes of this store.
+
+            :params list nodes: Node views.
+            :return: (len(nodes), 3) array.
+            :rtype: numpy.ndarray
+        """
+        rows = np.fromiter((n.row for n in nodes), np.int64, len(nodes))
+        return self.coords[rows]
+
+    def add_edge(self, edge, source_row, destination_row):
+        """ Allocate a row for an edge.
+
+            :params Edge edge: Edge view using this row.
+            :params int source_row: Row of the source node.
+            :params int destination_row: Row of the destination node.
+            :return: Row of the edge.
+            :rtype: int
+        """
+        if self.free_edge_rows:
+            row = self.free_edge_rows.pop()
+            self.edge_views[row] = edge
+        else:
+            row = len(self.edge_views)
+            self.edge_rows = self._grow(self.edge_rows, row + 1)
+            self.edge_valid = self._grow(self.edge_valid, row + 1)
+            self.edge_views.append(edge)
+        self.edge_rows[row] = (source_row, destination_row)
+        self.edge_valid[row] = True
+        self.version += 1
+        return row
+
+    def remove_edge(self, row):
+        """ Free an edge row. Its view is detached (see Edge.detach) and
+            the row is reused by the next edge added.
+        """
+        if row is None or not self.edge_valid[row]:
+            # Already removed
+            return
+        self.edge_views[row].detach(tuple(self.edge_rows[row].tolist()))
+        self.edge_views[row] = None
+        self.edge_valid[row] = False
+        self.free_edge_rows.append(row)
+        self.version += 1
+
+    @property
+    def edge_count(self):
+        """Number of live edges in store"""
+        return len(self.edge_views) - len(self.free_edge_rows)
+
+    @property
+    def edge_array(self):
+        """(E, 2) array of (source row, destination row) of live edges"""
+        count = len(self.edge_views)
+        return self.edge_rows[:count][self.edge_valid[:count]]
+
+    def rows_of(self, edges):
+        """ (source row, destination row) of some edges of this store.
+
+            :params list edges: Edge views.
+            :return: (len(edges), 2) array.
+            :rtype: numpy.ndarray
+        """
+        rows = np.fromiter((e.row for e in edges), np.int64, len(edges))
+        return self.edge_rows[rows]
+
+    def segments_of(self, edges):
+        """ Coordinates of both ends of some edges of this store.
+
+            :params list edges: Edge views.
+            :return: (len(edges), 2, 3) array.
+            :rtype: numpy.ndarray
+        """
+        return self.coords[self.rows_of(edges)]
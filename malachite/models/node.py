@@ -7,19 +7,48 @@
     appliance).
     Edges are then only aware of nodes, but allow for indirect access to i
     appliances
+
+    Coordinates are not stored in the node itself but in a row of a
+    GraphStore (see graph_store.py), shared by every node of a graph.
 """
 
+from malachite.models.graph_store import GraphStore
+
+
+def _coordinate(axis):
+    """Property reading/writing one coordinate of a node in its store"""
+
+    def getter(node):
+        return node.store.coords[node.row, axis]
+
+    def setter(node, value):
+        node.store.coords[node.row, axis] = value
+
+    return property(getter, setter)
+
 
 class Node:
     """ A node of the final 3D graph.
     """
 
-    def __init__(self, uid, appliance):
+    __slots__ = ('uid', 'appliance', 'store', 'row')
+
+    x_coord = _coordinate(0)
+    y_coord = _coordinate(1)
+    z_coord = _coordinate(2)
+
+    def __init__(self, uid, appliance, store=None):
+        """ Create node and allocate its coordinates.
+
+            :params int uid: Node unique id.
+            :params Appliance appliance: Appliance wrapped by the node.
+            :params GraphStore store: Store of the graph, a private one
+                                      is created if None.
+        """
         self.uid = uid
-        self.x_coord = 0
-        self.y_coord = 0
-        self.z_coord = 0
         self.appliance = appliance
+        self.store = store if store is not None else GraphStore(1)
+        self.row = self.store.add_node(self)
 
     def __repr__(self):
         """Short desc"""
@@ -2,30 +2,202 @@
     Napalm based link and requests to appliances.
 """
 
+import threading
+import time
+
 from napalm import get_network_driver
 from napalm.base.exceptions import ModuleImportError, ConnectionException
 
+from malachite.batched_getters import BATCHED_GETTERS, ROUTE_GETTERS
 from malachite.models.appliance import Appliance
+from malachite.replay_driver import ReplayDriver, DeviceRecorder, fixture_path
 from malachite.utils.exceptions import ErrInvalidDriver
 from malachite.utils.exceptions import ErrNotImplemented
 from malachite.utils.exceptions import ErrConnectionFailed
+from malachite.utils.exceptions import ErrDeadlineExceeded
+from malachite.tracing import Span
+from malachite.utils.config import CONFIG
+
+
+# Number of calls abandoned by _run_with_deadline whose thread still runs
+_abandoned = {'count': 0}
+_abandoned_lock = threading.Lock()
+
+
+def _run_with_deadline(func, timeout=None, on_abandon=None):
+    """ Call func() and wait at most 'timeout' seconds for its result.
+
+        Napalm drivers don't expose any way to cancel a pending call, so
+        the call is made from a daemon thread which is abandoned if the
+        deadline is exceeded (the driver transport timeout should end it
+        eventually, see NapalmMiddleware._open_connection).
+
+        on_abandon() is then called right away, and may return a function
+        which the abandoned thread calls once func() returns : what func
+        uses (e.g. its napalm session) must not be reused nor closed before.
+
+        At most CONFIG['default']['max_abandoned_calls'] threads may still
+        run : past that, calls fail without being made.
+
+        :params callable func: Function to call (without arguments).
+        :params float timeout: Deadline in seconds, None means no deadline.
+        :params callable on_abandon: Called if the deadline is exceeded.
+        :return: Whatever func() returns.
+        :raises ErrDeadlineExceeded: If func() did not return in time, or
+                                     too many calls are still running.
+    """
+    if not timeout:
+        return func()
+
+    with _abandoned_lock:
+        if _abandoned['count'] >= CONFIG['default']['max_abandoned_calls']:
+            raise ErrDeadlineExceeded(
+                '%d calls still running past their deadline'
+                % _abandoned['count']
+            )
+
+    outcome = {}
+    # 'abandoned' and 'done' are only read and written under the lock : a
+    # call is either returned to the caller, or cleaned up by its thread.
+    state = {'done': False, 'abandoned': False, 'cleanup': None}
+
+    def target():
+        try:
+            outcome['result'] = func()
+        except Exception as err:  # pylint: disable=broad-except
+            outcome['error'] = err
+
+        with _abandoned_lock:
+            state['done'] = True
+            if state['abandoned']:
+                _abandoned['count'] -= 1
+            cleanup = state['cleanup']
+        if cleanup:
+            try:
+                cleanup()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+
+    with _abandoned_lock:
+        if not state['done']:
+            state['abandoned'] = True
+            _abandoned['count'] += 1
+            if on_abandon:
+                state['cleanup'] = on_abandon()
+
+    if state['abandoned']:
+        raise ErrDeadlineExceeded('No answer after %ss' % timeout)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
 
 
 class NapalmMiddleware:
 
-    def __init__(self, net_os):
+    # Driver names handled by malachite itself rather than napalm
+    LOCAL_DRIVERS = {
+        'replay': ReplayDriver,
+    }
 
-        # Set self.driver or raise ErrInvalidDriver
-        try:
-            self.driver = get_network_driver(net_os)
-        except ModuleImportError:
-            raise ErrInvalidDriver()
+    def __init__(self, net_os, record_dir=None, tracer=None):
+        """ Init middleware for a given napalm driver.
+
+            :params str net_os: Napalm driver name, or 'replay' for serving
+                                recorded sessions (see replay_driver.py).
+            :params str record_dir: If set, every getter output is recorded
+                                    as a replay fixture in this folder.
+            :params Tracer tracer: If set, every connection and getter call
+                                   is recorded in it (see tracing.py).
+        """
 
-        # Dict of connected (reachable) devices (appliance name/addr ; device)
+        # Set self.driver or raise ErrInvalidDriver
+        if net_os in self.LOCAL_DRIVERS:
+            self.driver = self.LOCAL_DRIVERS[net_os]
+        else:
+            try:
+                self.driver = get_network_driver(net_os)
+            except ModuleImportError:
+                raise ErrInvalidDriver()
+
+        self.net_os = net_os
+        self.record_dir = record_dir
+        self.tracer = tracer
+
+        # Function fetching every getter output in one call, if the driver
+        # allows it (see batched_getters.py)
+        self.batch = BATCHED_GETTERS.get(net_os)
+        # Keys of devices on which batching failed once (older OS version,
+        # missing command...) : they always use one call per getter.
+        self.unbatched = set()
+
+        # Dict of connected (reachable) devices (appliance key ; device)
+        # Appliances may share a fqdn and only differ by port, so devices are
+        # indexed by Appliance.key (fqdn, port).
         self.devices = {}
 
-    def _open_connection(self, appliance, login=None):
-        """Open conenction to a device"""
+    def _call(self, device_key, operation, func, timeout=None, device=None):
+        """ Call func() within deadline, and trace the call if a tracer is
+            set.
+
+            If the deadline is exceeded, the device keeps being used by the
+            abandoned call : it is poisoned, i.e. forgotten right away (never
+            reused, nor closed by disconnect under the running call), and
+            closed once the call returns.
+
+            :params tuple device_key: Device (fqdn, port).
+            :params str operation: Name of the call (connect, getter name).
+            :params callable func: Function to call.
+            :params float timeout: Deadline, in seconds.
+            :params device: Device used by func, if not the connected device
+                            of 'device_key' (e.g. while connecting).
+            :return: Whatever func() returns.
+        """
+        if device is None:
+            device = self.devices.get(device_key)
+
+        def poison():
+            if self.devices.get(device_key) is device:
+                del self.devices[device_key]
+            return device.close if device is not None else None
+
+        if not self.tracer:
+            return _run_with_deadline(func, timeout, poison)
+
+        start = time.time()
+        chrono = time.perf_counter()
+        outcome = 'ok'
+        error = None
+        size = None
+        try:
+            result = _run_with_deadline(func, timeout, poison)
+            size = len(result) if hasattr(result, '__len__') else None
+            return result
+        except ErrDeadlineExceeded as err:
+            outcome, error = 'timeout', str(err)
+            raise
+        except Exception as err:
+            outcome, error = 'error', str(err)
+            raise
+        finally:
+            self.tracer.record(Span(
+                '%s:%s' % device_key, self.net_os, operation, start,
+                time.perf_counter() - chrono, size, outcome, error
+            ))
+
+    def _open_connection(self, appliance, login=None, timeout=None,
+                         read_timeout=None):
+        """ Open conenction to a device
+
+            :params Appliance appliance: Appliance to connect to.
+            :params tuple login: username/password tuple.
+            :params float timeout: Connection deadline in seconds.
+            :params float read_timeout: Deadline of later getter calls, in
+                                        seconds.
+        """
 
         assert(isinstance(appliance, Appliance))
 
@@ -41,41 +213,70 @@ class NapalmMiddleware:
         else:
             raise ErrNotImplemented('Login field must be non-empty')
 
-        # Debug
-        '''
-        print("Connecting to : ")
-        print("hostname : %s" % appliance.fqdn)
-        print("on port %s" % appliance.port)
-        print("with creds : %s/%s" % (username, password))
-        print("and opt args : %s" % opt_args)
-        '''
+        # Driver timeout only applies to the transport (and to every call
+        # made through it), the deadline set around open() below also covers
+        # slow handshakes. It lets getters exceeding their deadline end by
+        # themselves rather than run forever (see _run_with_deadline).
+        drv_args = {}
+        if timeout or read_timeout:
+            drv_args['timeout'] = max(timeout or 0, read_timeout or 0)
 
         # Create napalm device
         device = self.driver(
-            hostname="127.0.0.1",  # local test, but should be 'appliance.fqdn'
+            hostname=appliance.fqdn,
             username=username,
             password=password,
-            optional_args=opt_args
+            optional_args=opt_args,
+            **drv_args
         )
 
         # Try to open the connection
         try:
-            device.open()
-        except ConnectionException:
+            self._call(appliance.key, 'connect', device.open, timeout,
+                       device)
+        except (ConnectionException, ErrDeadlineExceeded):
             raise ErrConnectionFailed('Appliance %s', appliance.fqdn)
 
+        if self.record_dir:
+            device = DeviceRecorder(
+                device,
+                fixture_path(self.record_dir, appliance.fqdn, appliance.port)
+            )
+
         # If everything went well up to that point, keep device
-        self.devices[appliance.fqdn] = device
+        self.devices[appliance.key] = device
 
-    def _close_connection(self, device_fqdn):
+    def _close_connection(self, device_key):
         """Close connection to a device"""
 
-        if device_fqdn in self.devices:
-            self.devices[device_fqdn].close()
+        device = self.devices.pop(device_key, None)
+        if device:
+            device.close()
             return True
         return False
 
-    def connect(self, *, appliance, username, password):
+    def is_alive(self, device_key, timeout=None):
+        """ Health check of an open session.
+
+            :params tuple device_key: Key of the device (see Appliance.key).
+            :params float timeout: Deadline of the check, in seconds.
+            :return: False if the device is not connected, or if its
+                     session is dead or doesn't answer in time.
+            :rtype: bool
+        """
+        device = self.devices.get(device_key)
+        if not device:
+            return False
+
+        try:
+            status = self._call(device_key, 'is_alive', device.is_alive,
+                                timeout)
+        except Exception:  # pylint: disable=broad-except
+            return False
+        return bool(status.get('is_alive'))
+
+    def connect(self, *, appliance, username, password, timeout=None,
+                read_timeout=None):
         """ Connect to every appliances known to the middleware, and
             return list (hopefully empty if everything goes right) of
             nodes to which the connection was not possible.
@@ -86,6 +287,9 @@ class NapalmMiddleware:
 
             :params str username: Appliance username
             :params str password: Appliance password
+            :params float timeout: Connection deadline, in seconds.
+            :params float read_timeout: Deadline of getter calls, in seconds
+                                        (given to the driver transport).
             :return: List of appliances to which the connection failed.
             :rtype: list()
         """
@@ -93,7 +297,8 @@ class NapalmMiddleware:
         broken_connections = []
 
         try:
-            self._open_connection(appliance, (username, password))
+            self._open_connection(appliance, (username, password), timeout,
+                                  read_timeout)
         except ErrConnectionFailed:
             broken_connections.append(appliance.fqdn)
 
@@ -105,11 +310,14 @@ class NapalmMiddleware:
         if device:
             return self._close_connection(device)
         else:
-            for device in self.devices:
+            for device in list(self.devices):
                 self._close_connection(device)
 
-    def get_arp_table(self, vrf=None, device_name=None):
+    def get_arp_table(self, vrf=None, device_name=None, timeout=None):
         """ Get arp table for a single device or all of them is device=None
+
+            :params device_name: Key of the device (see Appliance.key).
+            :params float timeout: Deadline for each getter call, in seconds.
         """
 
         if vrf:
@@ -118,24 +326,117 @@ class NapalmMiddleware:
         arp_tables = {}
 
         if device_name and device_name in self.devices:
-            arp_tables[device_name] = self.devices[device_name].get_arp_table()
+            arp_tables[device_name] = self._call(
+                device_name, 'get_arp_table',
+                self.devices[device_name].get_arp_table, timeout
+            )
             return arp_tables[device_name]
 
-        for name, device in self.devices.items():
-            arp_table[name] = device.get_arp_table()
+        for name, device in list(self.devices.items()):
+            arp_tables[name] = self._call(
+                name, 'get_arp_table', device.get_arp_table, timeout
+            )
 
         return arp_tables
 
-    def get_interfaces_ip(self, device_name=None):
+    def get_interfaces_ip(self, device_name=None, timeout=None):
         """ Get every interfaces IP
+
+            :params device_name: Key of the device (see Appliance.key).
+            :params float timeout: Deadline for each getter call, in seconds.
         """
         interfaces_ip = {}
 
         if device_name and device_name in self.devices:
-            interfaces_ip[device_name] = self.devices[device_name].get_interfaces_ip()
+            interfaces_ip[device_name] = self._call(
+                device_name, 'get_interfaces_ip',
+                self.devices[device_name].get_interfaces_ip, timeout
+            )
             return interfaces_ip[device_name]
 
-        for name, device in self.devices.items():
-            interfaces_ip[name] = device.get_interfaces_ip()
+        for name, device in list(self.devices.items()):
+            interfaces_ip[name] = self._call(
+                name, 'get_interfaces_ip', device.get_interfaces_ip, timeout
+            )
 
         return interfaces_ip
+
+    def get_route_table(self, device_name, timeout=None):
+        """ Get the whole routing table of a device : with a single
+            driver command if it has one (see ROUTE_GETTERS), with
+            get_route_to otherwise. Not batched with other getters : full
+            tables are large enough to deserve their own round trip.
+
+            :params device_name: Key of the device (see Appliance.key).
+            :params float timeout: Deadline for the getter call, in seconds.
+            :return: Prefix -> list of routes, as returned by get_route_to.
+            :rtype: dict
+            :raises ErrConnectionFailed: If the device is not connected.
+        """
+        device = self.devices.get(device_name)
+        if not device:
+            raise ErrConnectionFailed('Appliance %s is not connected',
+                                      device_name)
+
+        route_getter = ROUTE_GETTERS.get(self.net_os)
+        if not route_getter:
+            return self._call(
+                device_name, 'get_route_to',
+                lambda: device.get_route_to(destination='', protocol=''),
+                timeout
+            )
+
+        # Route getters run on the napalm device itself, not on its recorder
+        recorder = device if isinstance(device, DeviceRecorder) else None
+        napalm_device = recorder.device if recorder else device
+        route_table = self._call(
+            device_name, 'get_route_to',
+            lambda: route_getter(napalm_device), timeout
+        )
+        if recorder:
+            recorder.record('get_route_to', route_table)
+        return route_table
+
+    def get_napalm_data(self, device_name, timeout=None):
+        """ Get every getter output needed by the Loader for a device,
+            in a single round trip if its driver supports it, with one
+            call per getter otherwise.
+
+            :params device_name: Key of the device (see Appliance.key).
+            :params float timeout: Deadline for each call (the batched call
+                                   included), in seconds.
+            :return: (arp_table, interfaces_ip) tuple, as returned by
+                     get_arp_table and get_interfaces_ip.
+            :rtype: tuple
+            :raises ErrConnectionFailed: If the device is not connected.
+        """
+        device = self.devices.get(device_name)
+        if not device:
+            raise ErrConnectionFailed('Appliance %s is not connected',
+                                      device_name)
+
+        if self.batch and device_name not in self.unbatched:
+            # Batches run on the napalm device itself, not on its recorder
+            recorder = device if isinstance(device, DeviceRecorder) else None
+            napalm_device = recorder.device if recorder else device
+
+            try:
+                arp_table, interfaces_ip = self._call(
+                    device_name, 'batch',
+                    lambda: self.batch(napalm_device), timeout
+                )
+            except ErrDeadlineExceeded:
+                # Device is slow rather than unable to batch : give up
+                raise
+            except Exception:  # pylint: disable=broad-except
+                self.unbatched.add(device_name)
+            else:
+                if recorder:
+                    recorder.record('get_arp_table', arp_table)
+                    recorder.record('get_interfaces_ip', interfaces_ip)
+                return arp_table, interfaces_ip
+
+        return (
+            self.get_arp_table(device_name=device_name, timeout=timeout),
+            self.get_interfaces_ip(device_name=device_name, timeout=timeout)
+        )
@@ -2,6 +2,10 @@
     a plotly 3D  network graph
 """
 
+import math
+
+import numpy as np
+
 from plotly.offline import plot
 from plotly.graph_objs import (
     Scatter3d, Line, Marker,
@@ -10,56 +14,108 @@ from plotly.graph_objs import (
 )
 
 
+# Colors of diff traces (see 'build_diff_scatters')
+DIFF_COLORS = {
+    'unchanged': 'rgb(200,200,200)',
+    'added': 'rgb(40,170,60)',
+    'removed': 'rgb(210,50,50)',
+    'moved': 'rgb(240,150,30)',
+}
+
+# Largest clusters that can be expanded from the plot menu (each one
+# adds hidden traces, and a menu button toggling all of them)
+MAX_EXPANDABLE_CLUSTERS = 100
+
+
 class PlotlyHelper:
 
-    def __init__(self, nodes):
-        """Local storage and processing functions for plotly objects"""
+    def __init__(self, nodes, clustering=None):
+        """ Local storage and processing functions for plotly objects
+
+            :params list nodes: Graph nodes.
+            :params Clustering clustering: If set, nodes are only drawn by
+                                           cluster (see
+                                           'build_cluster_scatters').
+        """
         self.node_scatters = {}
         self.edge_scatters = {}
 
+        # Cluster traces : overview first, then hidden details of each
+        # expandable cluster (see 'build_cluster_scatters'), with the
+        # position in 'expandable' of the cluster owning each detail trace
+        self.cluster_scatters = []
+        self.overview_count = 0
+        self.expandable = []
+        self.detail_owners = []
+
+        # Legend is only useful when traces have a meaning of their own
+        self.legend = False
+
         self.nodes = nodes
-        self._build_node_scatter("Main scatter")
+        self.clustering = clustering
+        if not clustering:
+            self._build_node_scatter("Appliances")
+
+    @staticmethod
+    def _lines(segments):
+        """ Turn (N, 2, 3) segments into x, y, z coordinates of a single
+            trace : each segment is drawn as (start, end, gap), as plotly
+            doesn't join points separated by a NaN.
+        """
+        if not len(segments):
+            return [[], [], []]
+
+        lines = np.full((len(segments), 3, 3), np.nan)
+        lines[:, :2] = segments
+        lines = lines.reshape(-1, 3)
+
+        return [lines[:, 0], lines[:, 1], lines[:, 2]]
 
     def _build_edges_coordinates(self, edges):
         """Build 3-dim edges coordinates from igraph layout and edge list"""
+        if not edges:
+            return [[], [], []]
+        return self._lines(edges[0].store.segments_of(edges))
 
-        Xe = []
-        Ye = []
-        Ze = []
-        for e in edges:
-            Xe += [e.source.x_coord, e.destination.x_coord, None]
-            Ye += [e.source.y_coord, e.destination.y_coord, None]
-            Ze += [e.source.z_coord, e.destination.z_coord, None]
-
-        return [Xe, Ye, Ze]
+    @staticmethod
+    def _symbol(appliance):
+        """ Marker of a node : ghost nodes (neighbors out of the inventory)
+            are hollow, and appliances which could not be collected are
+            crosses.
+        """
+        if appliance.ghost:
+            return 'diamond-open'
+        return 'x' if appliance.failure else 'circle'
 
     def _build_node_scatter(self, scatter_name):
         """ Generate a scatter trace for plotly
             from coordinates computed by _build_nodes_coordinates
         """
 
-        nodes_coords_x = [n.x_coord for n in self.nodes]
-        nodes_coords_y = [n.y_coord for n in self.nodes]
-        nodes_coords_z = [n.z_coord for n in self.nodes]
+        if self.nodes:
+            coords = self.nodes[0].store.coordinates_of(self.nodes)
+        else:
+            coords = np.zeros((0, 3))
 
         node_scatter = Scatter3d(
-            x=nodes_coords_x,
-            y=nodes_coords_y,
-            z=nodes_coords_z,
+            x=coords[:, 0],
+            y=coords[:, 1],
+            z=coords[:, 2],
             mode='markers',
             name=scatter_name,
             marker=Marker(
-                symbol='dot',
+                symbol=[self._symbol(node.appliance) for node in self.nodes],
                 size=6,
                 line=Line(color='rgb(50,50,50)', width=0.5)
             ),
-            hoverinfo=[node.appliance.name for node in self.nodes],
-            text=[node.appliance.name for node in self.nodes]
+            hoverinfo='text',
+            text=[node.appliance.hover_text() for node in self.nodes]
         )
 
         self.node_scatters[scatter_name] = node_scatter
 
-    def build_edge_scatter(self, edges, scatter_name):
+    def build_edge_scatter(self, edges, scatter_name,
+                           color='rgb(125,125,125)'):
         """ Generate a scatter trace for plotly
             from coordinates computed by _build_nodes_coordinates
         """
@@ -71,17 +127,263 @@ class PlotlyHelper:
             y=coord[1],
             z=coord[2],
             mode='lines',
-            line=Line(color='rgb(125,125,125)', width=3),
-            hoverinfo=[e.__str__() for e in edges],
-            text=[e.__str__() for e in edges]
+            name=scatter_name,
+            line=Line(color=color, width=3),
+            hoverinfo='text',
+            # One label per point : source, destination and gap
+            text=[e.hover_text() for e in edges for _ in range(3)]
         )
 
         self.edge_scatters[scatter_name] = edge_scatter
 
-    def _get_axis(self, titles=None):
+    def _segment_scatter(self, segments, texts, scatter_name, color):
+        """ Add lines between pairs of points as a new edge scatter.
+
+            :params segments: (N, 2, 3) array of line ends.
+            :params list texts: Hover label of each line.
+        """
+        coord = self._lines(segments)
+        self.edge_scatters[scatter_name] = Scatter3d(
+            x=coord[0],
+            y=coord[1],
+            z=coord[2],
+            mode='lines',
+            name=scatter_name,
+            line=Line(color=color, width=3),
+            hoverinfo='text',
+            text=[text for text in texts for _ in range(3)]
+        )
+
+    def build_diff_scatters(self, diff):
+        """ Generate one trace per kind of change of a topology diff
+            (see diff.py) : unchanged, added, removed and moved links, and
+            added and removed appliances. Removed appliances are drawn
+            where they used to be.
+
+            :params TopologyDiff diff: Changes to draw.
+        """
+        self.legend = True
+
+        def label(link):
+            return '%s <-> %s%s' % (link.source, link.destination, ''.join(
+                '<br>%s - %s' % pair for pair in link.interfaces
+            ))
+
+        kinds = [
+            ('Unchanged links', 'unchanged', diff.unchanged_segments(),
+             diff.unchanged_labels()),
+            ('Added links', 'added', diff.segments(diff.links_added),
+             [label(link) for link in diff.links_added]),
+            ('Removed links', 'removed', diff.segments(diff.links_removed),
+             [label(link) for link in diff.links_removed]),
+            ('Moved links', 'moved',
+             diff.segments([moved.new for moved in diff.links_moved]),
+             ['%s<br>was %s' % (label(moved.new), label(moved.old))
+              for moved in diff.links_moved]),
+        ]
+        for scatter_name, kind, segments, texts in kinds:
+            self._segment_scatter(
+                segments, texts, scatter_name, DIFF_COLORS[kind]
+            )
+
+        for scatter_name, kind, names in (
+                ('Added appliances', 'added', diff.nodes_added),
+                ('Removed appliances', 'removed', diff.nodes_removed)):
+            coords = diff.positions(names)
+            self.node_scatters[scatter_name] = Scatter3d(
+                x=coords[:, 0],
+                y=coords[:, 1],
+                z=coords[:, 2],
+                mode='markers',
+                name=scatter_name,
+                marker=Marker(
+                    symbol='circle', size=9, color=DIFF_COLORS[kind],
+                    line=Line(color='rgb(50,50,50)', width=0.5)
+                ),
+                hoverinfo='text',
+                text=names
+            )
+
+    def _cluster_links_scatter(self, centers, pairs, counts, scatter_name,
+                               color):
+        """Lines between linked clusters, labelled with their link count"""
+        names = self.clustering.names
+        coord = self._lines(centers[pairs])
+        return Scatter3d(
+            x=coord[0],
+            y=coord[1],
+            z=coord[2],
+            mode='lines',
+            name=scatter_name,
+            line=Line(color=color, width=3),
+            hoverinfo='text',
+            text=['%s <-> %s (%s links)' % (names[src], names[dst], count)
+                  for (src, dst), count in zip(pairs.tolist(), counts.tolist())
+                  for _ in range(3)]
+        )
+
+    def _cluster_detail(self, position, trace):
+        """Add a hidden trace, shown when cluster 'position' is expanded"""
+        self.cluster_scatters.append(trace)
+        self.detail_owners.append(position)
+
+    def build_cluster_scatters(self, edges, routed_edges=None):
+        """ Generate cluster traces : an overview (one marker per cluster,
+            sized by its number of nodes, and one line per pair of linked
+            clusters), plus nodes and edges of the largest clusters, hidden
+            until expanded from the plot menu.
+
+            Clusters made of ghost nodes only are hollow, and clusters with
+            unreachable appliances say so in their label. Expanded nodes
+            use the same markers as the flat plot.
+
+            Hidden traces are only hidden, not lazily loaded : they are all
+            written into the HTML file, hence MAX_EXPANDABLE_CLUSTERS.
+
+            :params list edges: Graph edges (ghost edges included).
+            :params list routed_edges: Routed next hops (see
+                                       Loader.build_routed_edges), drawn
+                                       as their own traces.
+        """
+        store = self.nodes[0].store if self.nodes else None
+        if store is None:
+            return
+
+        def rows_of(edge_list):
+            if not edge_list:
+                return np.zeros((0, 2), int)
+            return store.rows_of(edge_list)
+
+        clustering = self.clustering
+        members = clustering.members()
+        edge_rows = rows_of(edges)
+        routed_rows = rows_of(routed_edges)
+        coords = store.coordinates
+        appliances = [node.appliance for node in self.nodes]
+
+        centers = np.array([coords[rows].mean(axis=0) for rows in members])
+        sizes = [len(rows) for rows in members]
+
+        def overview(cluster):
+            rows = members[cluster]
+            text = '%s (%s appliances)' % (clustering.names[cluster],
+                                           len(rows))
+            failed = sum(
+                1 for row in rows
+                if appliances[row].failure and not appliances[row].ghost
+            )
+            if failed:
+                text += ', %s unreachable' % failed
+            return text
+
+        self.cluster_scatters.append(Scatter3d(
+            x=centers[:, 0],
+            y=centers[:, 1],
+            z=centers[:, 2],
+            mode='markers',
+            name='Clusters',
+            marker=Marker(
+                symbol=[
+                    'diamond-open' if all(appliances[row].ghost
+                                          for row in rows)
+                    else 'circle'
+                    for rows in members
+                ],
+                size=[min(6 + 3 * math.sqrt(size), 40) for size in sizes],
+                line=Line(color='rgb(50,50,50)', width=0.5)
+            ),
+            hoverinfo='text',
+            text=[overview(cluster) for cluster in range(clustering.count)]
+        ))
+
+        pairs, counts = clustering.collapse(edge_rows)
+        self.cluster_scatters.append(self._cluster_links_scatter(
+            centers, pairs, counts, 'Cluster links', 'rgb(125,125,125)'
+        ))
+        if routed_edges:
+            pairs, counts = clustering.collapse(routed_rows)
+            self.cluster_scatters.append(self._cluster_links_scatter(
+                centers, pairs, counts, 'Routed cluster links',
+                'rgb(60,120,200)'
+            ))
+        self.overview_count = len(self.cluster_scatters)
+
+        internal = clustering.internal(edge_rows)
+        routed_internal = clustering.internal(routed_rows)
+        largest = sorted(range(clustering.count), key=lambda c: -sizes[c])
+        for position, cluster in enumerate(
+                largest[:MAX_EXPANDABLE_CLUSTERS]):
+            rows = members[cluster]
+            name = clustering.names[cluster]
+            self.expandable.append(name)
+
+            self._cluster_detail(position, Scatter3d(
+                x=coords[rows, 0],
+                y=coords[rows, 1],
+                z=coords[rows, 2],
+                mode='markers',
+                name=name,
+                visible=False,
+                marker=Marker(
+                    symbol=[self._symbol(appliances[row]) for row in rows],
+                    size=6,
+                    line=Line(color='rgb(50,50,50)', width=0.5)
+                ),
+                hoverinfo='text',
+                text=[appliances[row].hover_text() for row in rows]
+            ))
+
+            details = [(edges, internal[cluster], 'rgb(125,125,125)')]
+            if routed_edges:
+                details.append((routed_edges, routed_internal[cluster],
+                                'rgb(60,120,200)'))
+            for edge_list, indexes, color in details:
+                cluster_edges = [edge_list[index] for index in indexes]
+                coord = self._build_edges_coordinates(cluster_edges)
+                self._cluster_detail(position, Scatter3d(
+                    x=coord[0],
+                    y=coord[1],
+                    z=coord[2],
+                    mode='lines',
+                    name=name,
+                    visible=False,
+                    line=Line(color=color, width=2),
+                    hoverinfo='text',
+                    text=[e.hover_text() for e in cluster_edges
+                          for _ in range(3)]
+                ))
+
+    def _get_cluster_menu(self, first_trace):
+        """ Menu expanding one cluster at a time (by toggling the
+            visibility of its hidden traces, see 'build_cluster_scatters').
+
+            :params int first_trace: Index of the first cluster trace.
+        """
+        # Details of expandable clusters come after the overview traces
+        detail_traces = list(range(
+            first_trace + self.overview_count,
+            first_trace + len(self.cluster_scatters)
+        ))
+
+        def button(label, expanded):
+            visible = [owner == expanded for owner in self.detail_owners]
+            return dict(label=label, method='restyle',
+                        args=[{'visible': visible}, detail_traces])
+
+        return [dict(
+            buttons=[button('Overview', None)] + [
+                button(name, position)
+                for position, name in enumerate(self.expandable)
+            ],
+            direction='down',
+            x=0,
+            xanchor='left',
+            y=1.05,
+            yanchor='top',
+        )]
+
+    def _get_axis(self, title=''):
         """Come on, we can do better than that"""
-        if not titles:
-            titles = ['', '', '']
 
         axis = dict(
             showbackground=False,
@@ -89,18 +391,24 @@ class PlotlyHelper:
             zeroline=False,
             showgrid=False,
             showticklabels=False,
-            title=titles
+            title=title
         )
 
         return axis
 
     def _get_layout(self, axis, title=""):
         """Here too"""
+        menus = []
+        if self.cluster_scatters:
+            menus = self._get_cluster_menu(
+                len(self.node_scatters) + len(self.edge_scatters)
+            )
+
         layout = Layout(
             title=title,
             width=1400,
             height=1000,
-            showlegend=False,
+            showlegend=self.legend,
             scene=Scene(
                 xaxis=XAxis(axis),
                 yaxis=YAxis(axis),
@@ -110,11 +418,12 @@ class PlotlyHelper:
                 t=100
             ),
             hovermode='closest',
+            updatemenus=menus,
         )
 
         return layout
 
-    def _plot(self, plotly_layout, filename):
+    def _plot(self, plotly_layout, filename, auto_open=True):
         """ Last few hidden computations before that lead to
             the actual plot.
         """
@@ -122,18 +431,23 @@ class PlotlyHelper:
         # Add up all traces computed so far into a single list
         traces = [trace for trace in self.node_scatters.values()]
         traces += [trace for trace in self.edge_scatters.values()]
+        traces += self.cluster_scatters
 
         data = Data(traces)
         fig = Figure(data=data, layout=plotly_layout)
 
-        plot(fig, filename=filename)
+        plot(fig, filename=filename, auto_open=auto_open)
 
-    def plot(self, filename):
-        """Create 3D figure and plot it in browser"""
+    def plot(self, filename, auto_open=True):
+        """ Create 3D figure and plot it in browser
+
+            :params str filename: Output html file.
+            :params bool auto_open: Open the file in browser once written.
+        """
 
         # Prepare plotly layout with axis
         # (Doesn't really depend on any of the scatters)
         axis = self._get_axis()
         plotly_layout = self._get_layout(axis)
 
-        self._plot(plotly_layout, filename)
+        self._plot(plotly_layout, filename, auto_open)
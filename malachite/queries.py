@@ -0,0 +1,237 @@
+""" Path and reachability queries.
+
+    TopologyQuery answers questions about a built graph ("which appliances
+    sit between A and B ?", "what is cut off if X goes down ?") without
+    walking Node and Edge objects : edges are packed once into CSR arrays
+    (compressed sparse rows : the neighbors of row i are
+    indices[indptr[i]:indptr[i + 1]]), and traversals expand a whole BFS
+    level at a time with numpy.
+
+    Articulation points and connected components are computed by igraph,
+    from the same edge arrays. Every result is cached until the graph
+    changes (see GraphStore.version).
+"""
+
+import numpy as np
+
+from malachite.utils.exceptions import ErrNodesNotLoaded, ErrUnknownNode
+
+
+class TopologyQuery:
+    """ Queries over the nodes and edges of a Loader. Nodes are given
+        by appliance name, or as Node objects.
+    """
+
+    def __init__(self, loader):
+        """ :params Loader loader: Loader, after 'build_edges' (aggregated
+                                   links are used if any).
+        """
+        self.loader = loader
+
+        # Store version the arrays and cached results were computed for
+        self.version = None
+        self.indptr = None
+        self.indices = None
+        # Undirected edges, as (lowest row, highest row) pairs
+        self.pairs = None
+        # Appliance name -> row
+        self.names = {}
+        self._graph = None
+        self._cache = {}
+
+    def _refresh(self):
+        """Build CSR arrays again (and forget results) if graph changed"""
+        loader = self.loader
+        if not loader.nodes:
+            raise ErrNodesNotLoaded('Nothing to query, graph is empty')
+        if self.version == loader.store.version:
+            return
+
+        count = len(loader.nodes)
+        edges = loader.links if loader.links else loader.edges
+        if edges:
+            rows = loader.store.rows_of(edges)
+            rows = rows[rows[:, 0] != rows[:, 1]]
+        else:
+            rows = np.zeros((0, 2), dtype=np.int64)
+
+        # Undirected : each edge in both directions, without duplicates
+        pairs = np.unique(np.concatenate((rows, rows[:, ::-1])), axis=0)
+        self.indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=count),
+                  out=self.indptr[1:])
+        self.indices = pairs[:, 1].copy()
+        self.pairs = pairs[pairs[:, 0] < pairs[:, 1]]
+
+        self.names = {}
+        for node in reversed(loader.nodes):
+            self.names[node.appliance.name] = node.row
+
+        self._graph = None
+        self._cache = {}
+        self.version = loader.store.version
+
+    def _row(self, node):
+        """Row of a node, given as a Node or an appliance name"""
+        if not isinstance(node, str):
+            return node.row
+        if node not in self.names:
+            raise ErrUnknownNode('No appliance named %s' % node)
+        return self.names[node]
+
+    def _nodes(self, rows):
+        """Nodes of some rows"""
+        return [self.loader.store.nodes[row] for row in rows]
+
+    def _cached(self, key, compute):
+        """Result of a query, computed once per topology version"""
+        self._refresh()
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _bfs(self, sources, max_depth=None, target=None, blocked=None):
+        """ Breadth first search, one whole level per step.
+
+            :params list sources: Rows to start from (depth 0).
+            :params int max_depth: Stop after this many levels.
+            :params int target: Stop as soon as this row is reached.
+            :params int blocked: Row to consider as missing.
+            :return: Depth of every row (-1 if unreached), and the row it
+                     was reached from (-1 for sources and unreached rows).
+            :rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        count = len(self.indptr) - 1
+        depth = np.full(count, -1, dtype=np.int64)
+        parent = np.full(count, -1, dtype=np.int64)
+        if blocked is not None:
+            depth[blocked] = np.iinfo(np.int64).max
+
+        frontier = np.asarray(sources, dtype=np.int64)
+        depth[frontier] = 0
+        level = 0
+        while len(frontier) and (max_depth is None or level < max_depth):
+            if target is not None and depth[target] >= 0:
+                break
+
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            total = counts.sum()
+            if not total:
+                break
+
+            # Positions of every neighbor of the frontier in 'indices'
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            neighbors = self.indices[offsets + np.arange(total)]
+            origins = np.repeat(frontier, counts)
+
+            unseen = depth[neighbors] < 0
+            frontier, first = np.unique(neighbors[unseen], return_index=True)
+            level += 1
+            depth[frontier] = level
+            parent[frontier] = origins[unseen][first]
+
+        if blocked is not None:
+            depth[blocked] = -1
+        return depth, parent
+
+    def shortest_path(self, source, destination):
+        """ Fewest hops path between two appliances.
+
+            :return: Nodes of the path, both ends included, empty if the
+                     destination can't be reached.
+            :rtype: list
+        """
+        self._refresh()
+        start, end = self._row(source), self._row(destination)
+
+        def compute():
+            _, parent = self._bfs([start], target=end)
+            if start != end and parent[end] < 0:
+                return []
+            path = [end]
+            while path[-1] != start:
+                path.append(int(parent[path[-1]]))
+            return self._nodes(reversed(path))
+
+        return self._cached(('path', start, end), compute)
+
+    def k_hop(self, node, hops=1):
+        """ Appliances at most 'hops' links away from an appliance.
+
+            :return: (node, distance) pairs, nearest first (the appliance
+                     itself excluded).
+            :rtype: list
+        """
+        self._refresh()
+        start = self._row(node)
+
+        def compute():
+            depth, _ = self._bfs([start], max_depth=hops)
+            rows = np.flatnonzero(depth > 0)
+            rows = rows[np.argsort(depth[rows], kind='stable')]
+            return list(zip(self._nodes(rows), depth[rows].tolist()))
+
+        return self._cached(('k_hop', start, hops), compute)
+
+    def _igraph(self):
+        """igraph copy of the topology, for algorithms not done here"""
+        if self._graph is None:
+            import igraph as ig
+
+            self._graph = ig.Graph(
+                n=len(self.indptr) - 1, edges=self.pairs.tolist(),
+                directed=False
+            )
+        return self._graph
+
+    def articulation_points(self):
+        """ Appliances whose failure splits the network (or their part of
+            it) in several pieces.
+
+            :rtype: list
+        """
+        return self._cached('articulation_points', lambda: self._nodes(
+            sorted(self._igraph().articulation_points())
+        ))
+
+    def connected_components(self):
+        """ Groups of appliances linked to each other.
+
+            :return: Lists of nodes, largest first.
+            :rtype: list
+        """
+        def compute():
+            components = self._igraph().connected_components()
+            return [self._nodes(members) for members in
+                    sorted(components, key=len, reverse=True)]
+
+        return self._cached('components', compute)
+
+    def impact(self, node):
+        """ What breaks if an appliance goes down : appliances which can no
+            longer reach the largest remaining part of their network.
+
+            :return: Cut off nodes, as one list per piece, largest first.
+            :rtype: list
+        """
+        self._refresh()
+        down = self._row(node)
+
+        def compute():
+            # Each piece holds at least one neighbor of the missing node
+            neighbors = self.indices[self.indptr[down]:self.indptr[down + 1]]
+            reached = np.zeros(len(self.indptr) - 1, dtype=bool)
+            pieces = []
+            for neighbor in neighbors.tolist():
+                if reached[neighbor]:
+                    continue
+                depth, _ = self._bfs([neighbor], blocked=down)
+                piece = np.flatnonzero(depth >= 0)
+                reached[piece] = True
+                pieces.append(piece)
+
+            pieces.sort(key=len, reverse=True)
+            return [self._nodes(piece) for piece in pieces[1:]]
+
+        return self._cached(('impact', down), compute)
@@ -0,0 +1,174 @@
+""" Record/replay of napalm sessions.
+
+    ReplayDriver looks like a napalm driver, but answers getters with
+    outputs previously recorded in fixture files instead of talking to a
+    real appliance. It is selected with the 'replay' driver name, and
+    allows running Malachite (and measuring it) without any network.
+
+    DeviceRecorder wraps a real napalm device and writes every getter
+    output it sees into the same fixture format.
+
+    Fixtures are JSON files, one per appliance (see 'fixture_path'), mapping
+    getter names to their output :
+
+        {"get_arp_table": [...], "get_interfaces_ip": {...}}
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from napalm.base.exceptions import ConnectionException
+
+from malachite.utils.config import CONFIG
+
+
+def fixture_path(directory, hostname, port=None):
+    """ Return fixture filename of an appliance.
+
+        :params str directory: Fixtures folder.
+        :params str hostname: Appliance fqdn or IP.
+        :params int port: Appliance port, if any.
+        :rtype: str
+    """
+    name = '%s_%s' % (hostname, port if port else 0)
+    return os.path.join(directory, '%s.json' % re.sub(r'[^\w.-]', '_', name))
+
+
+class ReplayDriver:
+    """ Fake napalm driver serving recorded getter outputs.
+
+        Supported optional_args (defaults are read from
+        CONFIG['default']['replay']) :
+        - port : appliance port, used to find the fixture file
+        - replay_dir : fixtures folder
+        - latency : seconds spent in each getter call
+        - connect_latency : seconds spent opening the session
+    """
+
+    def __init__(self, hostname, username, password, timeout=60,
+                 optional_args=None):
+        settings = dict(CONFIG['default']['replay'])
+        settings.update(optional_args or {})
+
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+        self.port = settings.get('port')
+        self.latency = settings['latency']
+        self.connect_latency = settings['connect_latency']
+        self.path = fixture_path(
+            os.path.expanduser(settings['replay_dir']), hostname, self.port
+        )
+
+        self.fixture = None
+
+    def open(self):
+        """Load the fixture of the appliance, as if connecting to it"""
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+
+        try:
+            with open(self.path, 'r') as f_file:
+                self.fixture = json.load(f_file)
+        except (OSError, ValueError) as err:
+            raise ConnectionException(
+                'No usable fixture for %s (%s)' % (self.hostname, err)
+            )
+
+    def close(self):
+        """Forget loaded fixture"""
+        self.fixture = None
+
+    def is_alive(self):
+        """Session is alive as long as the fixture is loaded"""
+        return {'is_alive': self.fixture is not None}
+
+    def _round_trip(self):
+        """Check session is open and wait as long as a real call would"""
+        if self.fixture is None:
+            raise ConnectionException('Session to %s is not open'
+                                      % self.hostname)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _output(self, getter):
+        """Return recorded output of a getter"""
+        if getter not in self.fixture:
+            raise NotImplementedError(
+                '%s was not recorded for %s' % (getter, self.hostname)
+            )
+        return self.fixture[getter]
+
+    def _replay(self, getter):
+        """Replay a single getter call"""
+        self._round_trip()
+        return self._output(getter)
+
+    def replay_batch(self, getters):
+        """ Replay several getter calls made in a single round trip
+            (see batched_getters.py).
+
+            :params list getters: Getter names.
+            :return: Output of each getter.
+            :rtype: list
+        """
+        self._round_trip()
+        return [self._output(getter) for getter in getters]
+
+    def get_arp_table(self, vrf=''):
+        """Recorded napalm get_arp_table output"""
+        return self._replay('get_arp_table')
+
+    def get_interfaces_ip(self):
+        """Recorded napalm get_interfaces_ip output"""
+        return self._replay('get_interfaces_ip')
+
+    def get_route_to(self, destination='', protocol='', longer=False):
+        """Recorded napalm get_route_to output (whole table only)"""
+        return self._replay('get_route_to')
+
+
+class DeviceRecorder:
+    """ Proxy to a napalm device, writing the output of every getter
+        called through it into a fixture file usable by ReplayDriver.
+    """
+
+    # Fixtures are rewritten after each call, and a single file may be
+    # shared by several middlewares.
+    _lock = threading.Lock()
+
+    def __init__(self, device, path):
+        self.device = device
+        self.path = path
+
+    def __getattr__(self, name):
+        attr = getattr(self.device, name)
+        if not name.startswith('get_') or not callable(attr):
+            return attr
+
+        def recorded(*args, **kwargs):
+            output = attr(*args, **kwargs)
+            self.record(name, output)
+            return output
+
+        return recorded
+
+    def record(self, getter, output):
+        """Add (or replace) getter output in the fixture file"""
+        with self._lock:
+            try:
+                with open(self.path, 'r') as f_file:
+                    fixture = json.load(f_file)
+            except (OSError, ValueError):
+                fixture = {}
+
+            fixture[getter] = output
+
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w') as f_file:
+                json.dump(fixture, f_file, indent=2, sort_keys=True)
@@ -0,0 +1,208 @@
+""" Resilient collection.
+
+    Appliances fail in two ways : for a moment (a timeout, a dropped
+    session, a busy control plane) or for good (powered off, or removed
+    from the network but not from the inventory). The former deserve
+    another try, the latter shouldn't cost a connection timeout on every
+    run :
+
+    - 'retry' calls a function again after a transient error, waiting
+      twice as long before each new attempt, for a bounded number of
+      attempts and a bounded total time : a dead appliance costs one
+      connection timeout per attempt, which must not add up to minutes.
+    - CircuitBreaker counts consecutive failed collections of each
+      appliance. Past a threshold, its breaker opens : the appliance is
+      skipped until a cool-down period is over, then tried once more. A
+      new failure opens the breaker again for twice as long, a success
+      closes it. Breaker states are kept in a JSON file, so that the
+      next runs skip dead appliances too.
+"""
+
+import json
+import os
+import random
+import time
+
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import (
+    ErrConnectionFailed, ErrDeadlineExceeded, error_text
+)
+
+
+# Errors worth another attempt. Others (unsupported getter, unexpected
+# output...) would fail the same way again.
+TRANSIENT_ERRORS = (ErrConnectionFailed, ErrDeadlineExceeded, OSError)
+
+
+def backoff_delay(attempt, backoff, max_backoff):
+    """ Delay before a new attempt : doubled after each failure, up to
+        'max_backoff', and randomized so that appliances failing together
+        are not retried all at once.
+
+        :params int attempt: Number of failed attempts so far (from 1).
+        :params float backoff: Delay after the first failure, in seconds.
+        :params float max_backoff: Longest delay, in seconds.
+        :rtype: float
+    """
+    delay = min(backoff * 2 ** (attempt - 1), max_backoff)
+    return delay * random.uniform(0.5, 1)
+
+
+def retry(func, attempts=None, backoff=None, max_backoff=None,
+          max_time=None, sleep=time.sleep, clock=time.monotonic):
+    """ Call func() until it doesn't raise a transient error (see
+        TRANSIENT_ERRORS), at most 'attempts' times, and without starting
+        a new attempt past 'max_time' seconds.
+
+        :params callable func: Function to call (without arguments).
+        :params int attempts: Number of calls, 1 means no retry.
+        :params float backoff: Delay after the first failure, in seconds.
+        :params float max_backoff: Longest delay between calls, in seconds.
+        :params float max_time: Time after which no new call is started,
+                                in seconds (0 for no limit).
+        :params callable sleep: Waits a number of seconds.
+        :params callable clock: Current time, in seconds.
+        :return: Whatever func() returns.
+        :raises: Last error if every call failed (or time is up), or the
+                 first non transient one.
+    """
+    settings = CONFIG['default']['retries']
+    attempts = attempts if attempts else settings['attempts']
+    backoff = settings['backoff'] if backoff is None else backoff
+    max_backoff = settings['max_backoff'] if max_backoff is None \
+        else max_backoff
+    max_time = settings['max_time'] if max_time is None else max_time
+
+    start = clock()
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except TRANSIENT_ERRORS:
+            if attempt == attempts:
+                raise
+            delay = backoff_delay(attempt, backoff, max_backoff)
+            if max_time and clock() + delay - start >= max_time:
+                raise
+            sleep(delay)
+
+
+class CircuitBreaker:
+    """ Failure history of every appliance, kept in a single JSON file.
+        Not thread safe : meant to be used from the thread handing
+        appliances to workers (see Loader.iter_enrich).
+    """
+
+    def __init__(self, filename=None, threshold=None, cooldown=None,
+                 max_cooldown=None):
+        """ :params str filename: State file, created when first saved.
+            :params int threshold: Consecutive failures opening a breaker.
+            :params float cooldown: Seconds an appliance is skipped once
+                                    its breaker opens.
+            :params float max_cooldown: Longest cool-down, in seconds.
+        """
+        settings = CONFIG['default']['breaker']
+        self.filename = os.path.expanduser(
+            filename if filename else settings['file']
+        )
+        self.threshold = threshold if threshold else settings['threshold']
+        self.cooldown = cooldown if cooldown else settings['cooldown']
+        self.max_cooldown = (
+            max_cooldown if max_cooldown else settings['max_cooldown']
+        )
+
+        # 'fqdn:port' -> {'failures', 'cooldown', 'open_until', 'error'}
+        self.states = self._read()
+        # Keys changed since last save
+        self.changed = set()
+
+    def _read(self):
+        """States from the state file (an unreadable file is empty)"""
+        try:
+            with open(self.filename, 'r') as b_file:
+                states = json.load(b_file)
+        except (OSError, ValueError):
+            return {}
+        return states if isinstance(states, dict) else {}
+
+    @staticmethod
+    def _key(key):
+        """State key of an appliance, from Appliance.key"""
+        return '%s:%s' % key
+
+    def allow(self, key, now=None):
+        """ Whether an appliance may be polled : its breaker is closed, or
+            its cool-down is over (its next collection then decides).
+
+            :params tuple key: Appliance key (fqdn, port).
+            :rtype: bool
+        """
+        state = self.states.get(self._key(key))
+        now = time.time() if now is None else now
+        return not state or state['open_until'] <= now
+
+    def state(self, key):
+        """ Failure history of an appliance.
+
+            :return: Consecutive failures, end of cool-down (0 if its
+                     breaker is closed) and last error, or None if its last
+                     collection succeeded.
+            :rtype: dict
+        """
+        return self.states.get(self._key(key))
+
+    def succeeded(self, key):
+        """Close the breaker of an appliance"""
+        if self.states.pop(self._key(key), None):
+            self.changed.add(self._key(key))
+
+    def failed(self, key, error=None, now=None):
+        """ Count a failed collection of an appliance, and open its
+            breaker past the threshold.
+
+            :params tuple key: Appliance key (fqdn, port).
+            :params error: Failure cause, kept for reports.
+            :return: True if the breaker is now open.
+            :rtype: bool
+        """
+        state = self.states.setdefault(self._key(key), {
+            'failures': 0, 'cooldown': 0, 'open_until': 0, 'error': None,
+        })
+        state['failures'] += 1
+        state['error'] = error_text(error) if error is not None else None
+        self.changed.add(self._key(key))
+
+        if state['failures'] < self.threshold:
+            return False
+
+        # Failed again right after a cool-down : wait twice as long
+        state['cooldown'] = min(
+            state['cooldown'] * 2 if state['cooldown'] else self.cooldown,
+            self.max_cooldown
+        )
+        state['open_until'] = (
+            time.time() if now is None else now
+        ) + state['cooldown']
+        return True
+
+    def save(self):
+        """ Write changed states to the state file. States written in the
+            meantime by other collectors (shards) are kept.
+        """
+        if not self.changed:
+            return
+
+        states = self._read()
+        for key in self.changed:
+            if key in self.states:
+                states[key] = self.states[key]
+            else:
+                states.pop(key, None)
+
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmp_filename, 'w') as b_file:
+            json.dump(states, b_file)
+        os.replace(tmp_filename, self.filename)
+        self.changed = set()
@@ -0,0 +1,267 @@
+""" Routing tables.
+
+    Routes collected with napalm get_route_to are indexed, per appliance,
+    in a PrefixTrie : a path compressed binary (Patricia) trie, where
+    finding the route to an address is a walk down at most 32 (or 128)
+    bits, whatever the number of prefixes.
+
+    Looking up many addresses at once (e.g. the address of every appliance,
+    see Loader.build_routed_edges) skips the trie : prefixes are frozen in
+    one sorted array per prefix length, and each length is a single
+    vectorized search over every address. Full table routers (100k+
+    prefixes) use about twenty distinct lengths.
+"""
+
+from ipaddress import IPv4Network, IPv6Network, ip_address, ip_network
+
+import numpy as np
+
+
+class _TrieNode:
+    """Node of a PrefixTrie : a prefix, and its route if any"""
+
+    __slots__ = ('key', 'length', 'value', 'children')
+
+    def __init__(self, key, length, value=None):
+        self.key = key
+        self.length = length
+        self.value = value
+        self.children = [None, None]
+
+
+class PrefixTrie:
+    """ Longest prefix match index, for a single address family.
+    """
+
+    def __init__(self, version=4):
+        """ :params int version: IP version (4 or 6).
+        """
+        self.version = version
+        self.width = 32 if version == 4 else 128
+        self.root = _TrieNode(0, 0)
+        self.count = 0
+
+        # Sorted prefixes by length, for 'lookup_many' (see '_freeze')
+        self._frozen = None
+
+    def __len__(self):
+        return self.count
+
+    def _common_length(self, key_a, key_b):
+        """Number of leading bits two keys have in common"""
+        diff = key_a ^ key_b
+        return self.width - diff.bit_length()
+
+    def _bit(self, key, position):
+        """Bit of a key at a given position (0 is the most significant)"""
+        return (key >> (self.width - 1 - position)) & 1
+
+    def insert(self, prefix, value):
+        """ Add (or replace) the route of a prefix.
+
+            :params prefix: Network (string or ipaddress network).
+            :params value: Anything but None (e.g. next hops).
+        """
+        if not isinstance(prefix, (IPv4Network, IPv6Network)):
+            prefix = ip_network(prefix, strict=False)
+        key = int(prefix.network_address)
+        length = prefix.prefixlen
+        self._frozen = None
+
+        node = self.root
+        while True:
+            if node.length == length:
+                # Keys share their first 'length' bits : same prefix
+                if node.value is None:
+                    self.count += 1
+                node.value = value
+                return
+
+            bit = self._bit(key, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _TrieNode(key, length, value)
+                self.count += 1
+                return
+
+            common = min(length, child.length,
+                         self._common_length(key, child.key))
+            if common == child.length:
+                node = child
+                continue
+
+            # Split the edge to 'child' where both prefixes diverge
+            if common == length:
+                branch = _TrieNode(key, length, value)
+                self.count += 1
+            else:
+                mask = ~((1 << (self.width - common)) - 1)
+                branch = _TrieNode(key & mask, common)
+                branch.children[self._bit(key, common)] = \
+                    _TrieNode(key, length, value)
+                self.count += 1
+            branch.children[self._bit(child.key, common)] = child
+            node.children[bit] = branch
+            return
+
+    def lookup(self, address):
+        """ Longest prefix match of an address.
+
+            :params address: IP address (string, int or ipaddress).
+            :return: (prefix length, network key, value) of the best
+                     route, None if no route matches.
+            :rtype: tuple
+        """
+        key = int(ip_address(address)) if isinstance(address, str) \
+            else int(address)
+
+        best = None
+        node = self.root
+        while node is not None:
+            if node.length and (key ^ node.key) >> (self.width - node.length):
+                break
+            if node.value is not None:
+                best = node
+            if node.length == self.width:
+                break
+            node = node.children[self._bit(key, node.length)]
+
+        if best is None:
+            return None
+        return best.length, best.key, best.value
+
+    def _nodes(self):
+        """Every node holding a route"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                yield node
+            stack.extend(child for child in node.children if child)
+
+    def items(self):
+        """ Every route of the trie.
+
+            :return: Generator of (network, value) tuples.
+        """
+        for node in self._nodes():
+            yield ip_network((node.key, node.length)), node.value
+
+    def _freeze(self):
+        """ Build one sorted network array per prefix length (longest
+            first), along with the matching values.
+        """
+        by_length = {}
+        for node in self._nodes():
+            by_length.setdefault(node.length, []).append(
+                (node.key, node.value)
+            )
+
+        frozen = []
+        for length in sorted(by_length, reverse=True):
+            routes = sorted(by_length[length], key=lambda route: route[0])
+            frozen.append((
+                length,
+                np.array([key for key, _ in routes], dtype=np.uint64),
+                [value for _, value in routes],
+            ))
+        self._frozen = frozen
+
+    def lookup_many(self, addresses):
+        """ Longest prefix match of many addresses at once.
+
+            :params addresses: Iterable of IP addresses (strings, ints or
+                               ipaddress objects).
+            :return: Value of the best route of each address, None if no
+                     route matches.
+            :rtype: list
+        """
+        keys = [int(ip_address(address)) if isinstance(address, str)
+                else int(address) for address in addresses]
+        if self.version != 4:
+            # Keys don't fit in numpy integers
+            found = (self.lookup(key) for key in keys)
+            return [match[2] if match else None for match in found]
+
+        if self._frozen is None:
+            self._freeze()
+
+        keys = np.array(keys, dtype=np.uint64)
+        results = [None] * len(keys)
+        pending = np.arange(len(keys))
+        for length, networks, values in self._frozen:
+            if not len(pending):
+                break
+            mask = np.uint64(((1 << length) - 1) << (self.width - length))
+            masked = keys[pending] & mask
+            positions = np.minimum(
+                np.searchsorted(networks, masked), len(networks) - 1
+            )
+            hits = networks[positions] == masked
+            for index, position in zip(pending[hits].tolist(),
+                                       positions[hits].tolist()):
+                results[index] = values[position]
+            pending = pending[~hits]
+
+        return results
+
+
+def routes_from_napalm(route_table):
+    """ Index active routes of a napalm get_route_to output.
+
+        :params dict route_table: Prefix -> list of route dicts, as returned
+                                  by get_route_to(destination='').
+        :return: IPv4 trie, with a tuple of (next hop IP or None, outgoing
+                 interface) pairs per prefix.
+        :rtype: PrefixTrie
+    """
+    trie = PrefixTrie(4)
+    for prefix, routes in route_table.items():
+        try:
+            network = ip_network(prefix, strict=False)
+        except ValueError:
+            continue
+        if network.version != 4:
+            continue
+
+        next_hops = []
+        for route in routes:
+            if not route.get('current_active', True):
+                continue
+            next_hop = route.get('next_hop') or None
+            try:
+                next_hop = ip_address(next_hop) if next_hop else None
+            except ValueError:
+                next_hop = None
+            pair = (next_hop, route.get('outgoing_interface') or '')
+            if pair not in next_hops:
+                next_hops.append(pair)
+        if next_hops:
+            trie.insert(network, tuple(next_hops))
+    return trie
+
+
+def routes_to_list(trie):
+    """ Routes of a trie as JSON friendly lists (see 'routes_from_list').
+
+        :rtype: list
+    """
+    return [
+        [str(network), [[str(next_hop) if next_hop else None, interface]
+                        for next_hop, interface in next_hops]]
+        for network, next_hops in trie.items()
+    ]
+
+
+def routes_from_list(rows):
+    """ Rebuild a trie from 'routes_to_list' output.
+
+        :rtype: PrefixTrie
+    """
+    trie = PrefixTrie(4)
+    for network, next_hops in rows:
+        trie.insert(network, tuple(
+            (ip_address(next_hop) if next_hop else None, interface)
+            for next_hop, interface in next_hops
+        ))
+    return trie
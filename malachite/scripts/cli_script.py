@@ -1,8 +1,79 @@
 """ CLI entrypoint for malachite
 """
 
+import os
+import signal
+import time
+from collections import OrderedDict
+from ipaddress import ip_address
+
 import click
-from malachite.malachite import Malachite
+from malachite.ghosts import GROUPINGS, DNSCache, StubResolver
+from malachite.layout import ALGORITHMS, LayoutCache
+from malachite.resilience import CircuitBreaker
+from malachite.snapshot_cache import SnapshotCache
+from malachite.topology_db import TopologyDB
+from malachite.tracing import Tracer
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import MalachiteException
+
+
+# Message displayed when each stage of Malachite.algorithm starts
+# (appliances are collected while the appliances file is read)
+STAGE_MESSAGES = OrderedDict([
+    ('load', '-- Loading appliances file and collecting appliances data...'),
+    ('enrich', None),
+    ('edges', '-- Building appliances edges...'),
+    ('ghosts', '-- Resolving neighbors missing from appliances file...'),
+    ('aggregate', '-- Merging edges between the same appliances...'),
+    ('routes', '-- Following routes to their next hops...'),
+    ('layout', '-- Generating layout and setting nodes coordinates'),
+    ('plot', '-- Ploting graph...'),
+])
+
+
+def _malachite(**kwargs):
+    """ New Malachite instance. The library (and numpy with it) is only
+        imported by commands which need it, so that '--help' and the like
+        start fast ; napalm, igraph and plotly are themselves imported by
+        the stages using them.
+    """
+    from malachite.malachite import Malachite
+
+    return Malachite(**kwargs)
+
+
+def _print_breakdown(stage_events):
+    """Display time and memory used by each stage"""
+    click.secho('-- Performance breakdown :', fg='green')
+    click.secho('   %-8s %9s %10s %10s %12s' % (
+        'stage', 'items', 'wall (s)', 'cpu (s)', 'memory (MB)'), fg='white')
+    for event in stage_events:
+        click.secho('   %-8s %9s %10.3f %10.3f %+12.1f' % (
+            event.stage, event.items, event.wall_time, event.cpu_time,
+            event.memory_delta / 1e6), fg='white')
+    click.secho('   %-8s %9s %10.3f %10.3f' % (
+        'total', '',
+        sum(event.wall_time for event in stage_events),
+        sum(event.cpu_time for event in stage_events)), fg='white')
+
+
+def _print_trace_summary(tracer, count=5):
+    """Display slowest appliances and statistics of each napalm call"""
+    click.secho('-- Slowest appliances :', fg='green')
+    for device, driver, total, failed in tracer.slowest_devices(count):
+        click.secho('   %-30s %-8s %8.3fs %s' % (
+            device, driver, total,
+            '(%s failed calls)' % failed if failed else ''), fg='white')
+
+    click.secho('-- Napalm calls :', fg='green')
+    click.secho('   %-20s %7s %7s %10s %10s %10s' % (
+        'call', 'count', 'failed', 'total (s)', 'mean (s)', 'max (s)'),
+        fg='white')
+    for operation, stats in tracer.operation_stats().items():
+        click.secho('   %-20s %7d %7d %10.3f %10.3f %10.3f' % (
+            operation, stats['count'], stats['failed'], stats['total'],
+            stats['mean'], stats['max']), fg='white')
 
 
 @click.group(invoke_without_command=True)
@@ -17,41 +88,606 @@ def cli(config):
 @click.option('-o', '--output', 'output_file')
 @click.option('-c', '--conf', default=None)
 @click.option('-v', '--verbose', is_flag=True)
-@click.argument('appliances', type=click.Path(exists=True, readable=True))
-def graph(output_file, appliances, conf, verbose):
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Number of appliances collected in parallel')
+@click.option('--connect-timeout', type=float, default=None,
+              help='Connection deadline per appliance, in seconds')
+@click.option('--getter-timeout', type=float, default=None,
+              help='Deadline per napalm getter call, in seconds')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None,
+              help='Folder of the collected data cache')
+@click.option('--max-age', type=click.FloatRange(min=0), default=None,
+              help='Reuse cached appliance data younger than this (seconds)')
+@click.option('--refresh', is_flag=True,
+              help='Poll every appliance, ignoring cached data')
+@click.option('--from-daemon', is_flag=True,
+              help='Never poll appliances, use data cached by the daemon '
+                   '(up to a few daemon intervals old, see --max-age)')
+@click.option('--attempts', type=click.IntRange(min=1), default=None,
+              help='Collections of an appliance before giving up on it')
+@click.option('--no-breaker', is_flag=True,
+              help='Poll every appliance, even those which failed too often '
+                   'lately')
+@click.option('--record', 'record_dir', type=click.Path(file_okay=False),
+              default=None,
+              help='Record napalm sessions as replay fixtures in this folder')
+@click.option('--layout', type=click.Choice(['auto'] + sorted(ALGORITHMS)),
+              default=None,
+              help='Layout algorithm (auto picks one from graph size : '
+                   'above 3000 nodes, fr-grid lays nodes out on a flat '
+                   'plane, drl keeps 3D but is much slower)')
+@click.option('--no-layout-cache', is_flag=True,
+              help='Always compute the layout, even for a known topology')
+@click.option('--ghosts', type=click.Choice(GROUPINGS), default=None,
+              help='Draw neighbors missing from the appliances file, one '
+                   'node per host, subnet or MAC vendor')
+@click.option('--hosts-file', type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help='Name ghost neighbors from this hosts file instead of DNS')
+@click.option('--no-dns', is_flag=True,
+              help='Name ghost neighbors after their IP, without DNS')
+@click.option('--routes', is_flag=True,
+              help='Also collect routing tables, and draw routed next hops')
+@click.option('--cluster-by', default=None,
+              help='Draw appliances by cluster : inventory field (site, '
+                   'pod...), community, or name:<regex>')
+@click.option('--trace', 'trace_file', type=click.Path(dir_okay=False),
+              default=None,
+              help='Write timing of every napalm call as JSON lines')
+@click.option('--prometheus', 'prom_file', type=click.Path(dir_okay=False),
+              default=None,
+              help='Write timing of napalm calls as a Prometheus textfile')
+@click.option('--save', is_flag=True,
+              help='Save collected topology as a new snapshot')
+@click.option('--db', 'db_file', type=click.Path(dir_okay=False),
+              default=None, help='Snapshots database (for --save)')
+@click.option('--label', default=None, help='Description of saved snapshot')
+@click.option('--export', 'export_file', type=click.Path(dir_okay=False),
+              default=None,
+              help='Export collected topology (.npz, .json or .graphml)')
+@click.option('-p', '--processes', type=click.IntRange(min=1), default=1,
+              help='Split collection between this number of processes')
+@click.option('--shard-file', 'shard_files', multiple=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Graph appliances collected by collect-shard instead of '
+                   'collecting them (repeat for each shard)')
+@click.argument('appliances', type=click.Path(exists=True, readable=True),
+                required=False)
+def graph(output_file, appliances, conf, verbose, workers, connect_timeout,
+          getter_timeout, cache_dir, max_age, refresh, from_daemon, attempts,
+          no_breaker, record_dir, layout, no_layout_cache, ghosts, hosts_file,
+          no_dns, routes, cluster_by, trace_file, prom_file, save, db_file,
+          label, export_file, processes, shard_files):
     """ Generate graph.
-
-        TODO : use the malachite.algorithm() method instead, once it's ready.
     """
 
     # Malachite init with correct appliance file.
-    click.secho('# Using appliances file %s' % appliances, fg='green')
-    malachite = Malachite(appliances_file=appliances)
+    if shard_files:
+        click.secho('# Using %s shard files' % len(shard_files), fg='green')
+    elif appliances:
+        click.secho('# Using appliances file %s' % appliances, fg='green')
+    else:
+        raise click.UsageError('Missing appliances file (or --shard-file)')
+    # Cached appliances are not polled, hence not recorded either
+    refresh = refresh or record_dir
+    if from_daemon:
+        # Latest daemon state, unless the daemon missed a few polls
+        if max_age is None:
+            daemon_conf = CONFIG['default']['daemon']
+            max_age = daemon_conf['interval'] * daemon_conf['stale_intervals']
+        cache = SnapshotCache(cache_dir, max_age)
+    else:
+        cache = SnapshotCache(cache_dir, 0 if refresh else max_age)
+    tracer = Tracer() if trace_file or prom_file else None
+    resolver = None
+    if hosts_file:
+        resolver = StubResolver.from_hosts_file(hosts_file)
+    elif no_dns:
+        resolver = StubResolver()
+    malachite = _malachite(
+        app_file=appliances,
+        graph_file=output_file,
+        processes=processes,
+        shard_files=shard_files,
+        workers=workers,
+        connect_timeout=connect_timeout,
+        getter_timeout=getter_timeout,
+        cache=cache,
+        record_dir=record_dir,
+        layout=layout,
+        layout_cache=None if no_layout_cache else LayoutCache(),
+        tracer=tracer,
+        poll=not from_daemon,
+        cluster_by=cluster_by,
+        ghosts=ghosts,
+        resolver=resolver,
+        # DNS answers are cached, other names are always read again
+        dns_cache=None if resolver else DNSCache(),
+        routes=routes,
+        attempts=attempts,
+        breaker=None if no_breaker else CircuitBreaker()
+    )
 
     # Use custom configuration file  or built-in
     conf_file = conf if conf else 'default'
     click.secho('# Using config file : %s' % conf_file, fg='green')
 
-    # Loading nodes from appliance file and napalm
-    click.secho('-- Loading appliances nodes...', fg='green')
-    malachite.load_appliances()
-    if verbose:
-        [click.secho("%s" % n, fg='white') for n in malachite.loader.nodes]
+    click.secho(STAGE_MESSAGES['load'], fg='green')
+
+    stage_events = []
+    collected = 0
+    for event in malachite.algorithm():
+
+        # Per appliance collection events
+        if event.name:
+            collected += 1
+            failure = event.detail.failure
+            if failure:
+                click.secho(
+                    '-- Unable to collect %s (%s failed: %s)' % (
+                        failure.appliance.name, failure.stage, failure.error),
+                    fg='red'
+                )
+            elif verbose:
+                click.secho('[%s] %s collected from %s in %.3fs' % (
+                    collected, event.name, event.detail.source,
+                    event.wall_time), fg='white')
+            continue
+
+        stage_events.append(event)
+
+        if verbose and event.stage == 'enrich':
+            [click.secho("%s" % n, fg='white') for n in malachite.loader.nodes]
+        if verbose and event.stage == 'layout':
+            click.secho('-- Current state of edges is : ', fg='green')
+            [click.secho("%s" % e, fg='white') for e in malachite.loader.edges]
+
+        # Announce next stage
+        optional = {'ghosts': ghosts, 'routes': routes}
+        stages = [stage for stage in STAGE_MESSAGES
+                  if optional.get(stage, True)]
+        next_stage = stages.index(event.stage) + 1
+        if next_stage < len(stages) and STAGE_MESSAGES[stages[next_stage]]:
+            click.secho(STAGE_MESSAGES[stages[next_stage]], fg='green')
+
+    _print_breakdown(stage_events)
+
+    failures = malachite.loader.failed_appliances
+    if failures:
+        click.secho(
+            '-- Partial graph : %s of %s appliances unreachable (%s skipped '
+            'by circuit breaker), drawn as crosses' % (
+                len(failures), len(malachite.loader.appliances),
+                sum(failure.stage == 'breaker' for failure in failures)),
+            fg='red'
+        )
+
+    route_failures = malachite.loader.route_failures
+    if route_failures:
+        click.secho(
+            '-- Routing tables missing for %s appliances, drawn without '
+            'routed next hops' % len(route_failures), fg='red'
+        )
+        if verbose:
+            for failure in route_failures:
+                click.secho('   %s (%s)' % (
+                    failure.appliance.name, failure.error), fg='red')
 
-    # Building model edges.
-    click.secho('-- Building appliances edges...', fg='green')
-    malachite.load_edges()
+    if save:
+        db = TopologyDB(db_file)
+        snapshot_id = malachite.save_snapshot(db, label)
+        db.close()
+        click.secho('-- Saved as snapshot %s' % snapshot_id, fg='green')
 
-    # Creating igraph and setting nodes coordinates:
-    click.secho(
-        '-- Generating layout and setting nodes coordinates',
-        fg='green'
+    if export_file:
+        malachite.save_export(export_file)
+        click.secho('-- Exported to %s' % export_file, fg='green')
+
+    if tracer:
+        _print_trace_summary(tracer)
+        if trace_file:
+            tracer.export_jsonl(trace_file)
+        if prom_file:
+            tracer.export_prometheus(prom_file)
+
+
+def _parse_shard(ctx, param, value):
+    """Read 'K/N' shard option as a (index from 0, count) tuple"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise click.BadParameter('expected K/N, e.g. 1/4')
+    if not 1 <= index <= count:
+        raise click.BadParameter('shard must be between 1 and %s' % count)
+    return index - 1, count
+
+
+@cli.command('collect-shard')
+@click.option('-s', '--shard', required=True, callback=_parse_shard,
+              help='Shard to collect, as K/N (from 1/N to N/N)')
+@click.option('-o', '--output', 'output_file', required=True,
+              type=click.Path(dir_okay=False), help='Shard file to write')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Number of appliances collected in parallel')
+@click.option('--connect-timeout', type=float, default=None,
+              help='Connection deadline per appliance, in seconds')
+@click.option('--getter-timeout', type=float, default=None,
+              help='Deadline per napalm getter call, in seconds')
+@click.argument('appliances', type=click.Path(exists=True, readable=True))
+def collect_shard_command(appliances, shard, output_file, workers,
+                          connect_timeout, getter_timeout):
+    """ Collect one shard of the appliances, for 'graph --shard-file'.
+    """
+    from malachite.sharding import collect_shard
+
+    index, count = shard
+    click.secho('-- Collecting shard %s/%s of %s' % (
+        index + 1, count, appliances), fg='green')
+    _, failed = collect_shard(
+        appliances, index, count, output_file,
+        workers=workers,
+        connect_timeout=connect_timeout,
+        getter_timeout=getter_timeout
     )
-    malachite.build_coordinates()
+    click.secho('-- Shard written to %s (%s failed appliances)' % (
+        output_file, failed), fg='red' if failed else 'green')
+
+
+@cli.command()
+@click.option('--db', 'db_file', type=click.Path(dir_okay=False),
+              default=None, help='Snapshots database')
+@click.option('--prune', type=click.FloatRange(min=0), default=None,
+              help='Delete snapshots older than this number of days')
+@click.option('--ip', default=None,
+              help='List appliances owning, or seeing in ARP, this IP in '
+                   'every snapshot')
+def history(db_file, prune, ip):
+    """ List saved snapshots.
+    """
+    db = TopologyDB(db_file)
+    try:
+        if prune is not None:
+            deleted = db.prune(time.time() - prune * 86400)
+            click.secho('-- Deleted %s snapshots' % deleted, fg='green')
+        if ip:
+            try:
+                found = db.find_ip(ip_address(ip))
+            except ValueError:
+                raise click.BadParameter('%s is not an IP address' % ip)
+            for kind, label in (('local', 'owned by'), ('arp', 'seen by')):
+                for snapshot_id, name, interface in found[kind]:
+                    click.secho('   %6s  %s %s (%s)' % (
+                        snapshot_id, label, name, interface), fg='white')
+            if not found['local'] and not found['arp']:
+                click.secho('-- %s not found' % ip, fg='red')
+            return
+
+        click.secho('   %6s  %-19s %10s  %s' % (
+            'id', 'date', 'appliances', 'label'), fg='white')
+        for snapshot_id, created, label, count in db.snapshots():
+            click.secho('   %6s  %-19s %10s  %s' % (
+                snapshot_id,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+                count, label or ''), fg='white')
+    finally:
+        db.close()
+
+
+@cli.command()
+@click.option('-o', '--output', 'output_file')
+@click.option('--db', 'db_file', type=click.Path(dir_okay=False),
+              default=None, help='Snapshots database')
+@click.option('--from-file', 'import_file',
+              type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Graph an export (.npz or .json) instead of a snapshot')
+@click.argument('snapshot_id', type=int, required=False)
+def render(output_file, db_file, import_file, snapshot_id):
+    """ Graph a saved snapshot (latest one by default), or an export,
+        without polling.
+    """
+    malachite = _malachite(graph_file=output_file)
+    if import_file:
+        malachite.load_export(import_file)
+        click.secho('-- Ploting %s...' % import_file, fg='green')
+    else:
+        db = TopologyDB(db_file)
+        snapshot_id = malachite.load_snapshot(db, snapshot_id)
+        db.close()
+        click.secho('-- Ploting snapshot %s...' % snapshot_id, fg='green')
+    malachite.plot()
+
+
+def _load_topology(malachite, source, db_file):
+    """ Load a snapshot (given by id, latest one if None) or an export
+        file.
+
+        :return: Description of the loaded topology.
+        :rtype: str
+    """
+    if source is not None and os.path.isfile(source):
+        _run_query(malachite.load_export, source)
+        return source
+
+    try:
+        snapshot_id = int(source) if source is not None else None
+    except ValueError:
+        raise click.BadParameter(
+            '%s is neither a snapshot id nor an export file' % source
+        )
+    db = TopologyDB(db_file)
+    try:
+        snapshot_id = _run_query(malachite.load_snapshot, db, snapshot_id)
+    finally:
+        db.close()
+    return 'snapshot %s' % snapshot_id
+
+
+def _format_link(link):
+    """One line description of a diff link"""
+    return '%s <-> %s (%s)' % (link.source, link.destination, ', '.join(
+        '%s - %s' % pair for pair in link.interfaces
+    ))
+
+
+@cli.command('diff')
+@click.option('-o', '--output', 'output_file')
+@click.option('--db', 'db_file', type=click.Path(dir_okay=False),
+              default=None, help='Snapshots database')
+@click.option('-v', '--verbose', is_flag=True, help='List every change')
+@click.option('--no-plot', is_flag=True, help='Only display changes')
+@click.argument('old')
+@click.argument('new', required=False)
+def diff_command(output_file, db_file, verbose, no_plot, old, new):
+    """ Changes from OLD to NEW topology, each one being a snapshot id
+        or an export file (NEW is the latest snapshot by default). The
+        NEW graph is drawn with changes highlighted.
+    """
+    former = _malachite()
+    current = _malachite(graph_file=output_file)
+    old_label = _load_topology(former, old, db_file)
+    new_label = _load_topology(current, new, db_file)
+
+    start = time.perf_counter()
+    changes = current.diff(former)
+    click.secho('-- Compared %s to %s in %.3fs' % (
+        old_label, new_label, time.perf_counter() - start), fg='green')
+
+    for kind, count in changes.counts().items():
+        click.secho('   %-14s %8s' % (kind.replace('_', ' '), count),
+                    fg='white')
+
     if verbose:
-        click.secho('-- Current state of edges is : ', fg='green')
-        [click.secho("%s" % e, fg='white') for e in malachite.loader.edges]
+        lines = (
+            ['+ %s' % name for name in changes.nodes_added] +
+            ['- %s' % name for name in changes.nodes_removed] +
+            ['+ %s' % _format_link(link) for link in changes.links_added] +
+            ['- %s' % _format_link(link)
+             for link in changes.links_removed] +
+            ['~ %s, was %s' % (_format_link(moved.new),
+                               _format_link(moved.old))
+             for moved in changes.links_moved] +
+            ['+ %s on %s (%s)' % owner for owner in changes.ips_added] +
+            ['- %s on %s (%s)' % owner for owner in changes.ips_removed] +
+            ['~ %s on %s (%s), was on %s (%s)' % (
+                moved.new.ip, moved.new.name, moved.new.interface,
+                moved.old.name, moved.old.interface)
+             for moved in changes.ips_moved]
+        )
+        for line in lines:
+            click.secho('   %s' % line, fg='white')
+
+    if not no_plot:
+        click.secho('-- Ploting changes...', fg='green')
+        current.plot_diff(changes)
+
+
+@cli.command()
+@click.option('--db', 'db_file', type=click.Path(dir_okay=False),
+              default=None, help='Snapshots database')
+@click.option('--host', default=None,
+              help='Address to listen on (localhost by default)')
+@click.option('--port', type=click.IntRange(0, 65535), default=None,
+              help='Port to listen on')
+@click.option('--refresh', type=click.FloatRange(min=0), default=None,
+              help='Seconds between two checks for a newer topology '
+                   '(0 to never reload)')
+@click.argument('source', required=False)
+def serve(db_file, host, port, refresh, source):
+    """ Serve a topology as JSON over HTTP (nodes, edges and coordinates,
+        paged, with ETags and gzip). SOURCE is a snapshot id or an export
+        file, the latest snapshot being served by default : it is reloaded
+        when a newer snapshot is saved, or when the export file changes.
+    """
+    from malachite.api_server import (
+        ExportSource, SnapshotSource, TopologyServer
+    )
+
+    if source is not None and os.path.isfile(source):
+        topology = ExportSource(source)
+    else:
+        try:
+            snapshot_id = int(source) if source is not None else None
+        except ValueError:
+            raise click.BadParameter(
+                '%s is neither a snapshot id nor an export file' % source
+            )
+        topology = SnapshotSource(db_file, snapshot_id)
+        if snapshot_id is not None:
+            refresh = 0
+
+    server = TopologyServer(topology, host=host, port=port, refresh=refresh)
+
+    def on_start(address, view):
+        click.secho('-- Serving %s (%s nodes, %s edges) on http://%s:%s/api/'
+                    % (view.label, len(view.nodes), len(view.edges),
+                       address[0], address[1]), fg='green')
+
+    def on_load(view, duration):
+        click.secho('-- Reloaded %s in %.3fs (version %s)' % (
+            view.label, duration, view.version), fg='green')
+
+    def on_error(err):
+        if isinstance(err, MalachiteException):
+            err = err.args[-1]
+        click.secho('-- Reload failed : %s' % err, fg='red')
+
+    try:
+        server.run(on_start=on_start, on_load=on_load, on_error=on_error)
+    except KeyboardInterrupt:
+        click.secho('-- Server stopped', fg='green')
+    except MalachiteException as err:
+        raise click.ClickException(str(err.args[-1]))
+    except OSError as err:
+        raise click.ClickException('Cannot serve : %s' % err)
+
+
+@cli.group()
+@click.option('--db', 'db_file', type=click.Path(dir_okay=False),
+              default=None, help='Snapshots database')
+@click.option('-s', '--snapshot', 'snapshot_id', type=int, default=None,
+              help='Snapshot to query (latest one by default)')
+@click.option('--from-file', 'import_file',
+              type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Query an export (.npz or .json) instead of a snapshot')
+@click.pass_context
+def query(ctx, db_file, snapshot_id, import_file):
+    """ Paths and reachability in a saved snapshot, or an export.
+    """
+    malachite = _malachite()
+    if import_file:
+        _run_query(malachite.load_export, import_file)
+    else:
+        db = TopologyDB(db_file)
+        try:
+            _run_query(malachite.load_snapshot, db, snapshot_id)
+        finally:
+            db.close()
+    ctx.obj = malachite.query()
+
+
+def _run_query(func, *args):
+    """Run a query, reporting errors (unknown appliance...) as CLI
+    errors"""
+    try:
+        return func(*args)
+    except MalachiteException as err:
+        raise click.ClickException(str(err.args[-1]))
+
+
+@query.command()
+@click.argument('source')
+@click.argument('destination')
+@click.pass_obj
+def path(queries, source, destination):
+    """ Appliances between SOURCE and DESTINATION.
+    """
+    nodes = _run_query(queries.shortest_path, source, destination)
+    if not nodes:
+        click.secho('-- %s can\'t reach %s' % (source, destination),
+                    fg='red')
+        return
+    click.secho('-- %s hops :' % (len(nodes) - 1), fg='green')
+    for node in nodes:
+        click.secho('   %s' % node.appliance.name, fg='white')
+
+
+@query.command()
+@click.option('-k', '--hops', type=click.IntRange(min=1), default=1,
+              help='Maximum distance, in links')
+@click.argument('appliance')
+@click.pass_obj
+def neighbors(queries, appliance, hops):
+    """ Appliances at most HOPS links away from APPLIANCE.
+    """
+    for node, distance in _run_query(queries.k_hop, appliance, hops):
+        click.secho('   %3s  %s' % (distance, node.appliance.name),
+                    fg='white')
+
+
+@query.command('articulation-points')
+@click.pass_obj
+def articulation_points(queries):
+    """ Appliances whose failure splits the network.
+    """
+    for node in _run_query(queries.articulation_points):
+        click.secho('   %s' % node.appliance.name, fg='white')
+
+
+@query.command()
+@click.pass_obj
+def components(queries):
+    """ Groups of appliances linked to each other.
+    """
+    for index, nodes in enumerate(_run_query(queries.connected_components)):
+        click.secho('-- Component %s (%s appliances) :' % (
+            index + 1, len(nodes)), fg='green')
+        click.secho('   %s' % ', '.join(
+            node.appliance.name for node in nodes), fg='white')
+
+
+@query.command()
+@click.argument('appliance')
+@click.pass_obj
+def impact(queries, appliance):
+    """ Appliances cut off if APPLIANCE goes down.
+    """
+    pieces = _run_query(queries.impact, appliance)
+    if not pieces:
+        click.secho('-- Nothing is cut off', fg='green')
+    for nodes in pieces:
+        click.secho('-- %s appliances cut off :' % len(nodes), fg='red')
+        click.secho('   %s' % ', '.join(
+            node.appliance.name for node in nodes), fg='white')
+
+
+@cli.command()
+@click.option('-i', '--interval', type=click.FloatRange(min=1), default=None,
+              help='Seconds between two polls of every appliance')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=None,
+              help='Number of appliances polled in parallel')
+@click.option('--connect-timeout', type=float, default=None,
+              help='Connection deadline per appliance, in seconds')
+@click.option('--getter-timeout', type=float, default=None,
+              help='Deadline per napalm getter call, in seconds')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None,
+              help='Folder where collected data is stored')
+@click.option('--cycles', type=click.IntRange(min=1), default=None,
+              help='Stop after this number of polls')
+@click.option('--routes', is_flag=True,
+              help='Also collect routing tables (for graph --routes)')
+@click.argument('appliances', type=click.Path(exists=True, readable=True))
+def daemon(appliances, interval, workers, connect_timeout, getter_timeout,
+           cache_dir, cycles, routes):
+    """ Keep appliance sessions open and poll them on a schedule.
+        Run 'graph --from-daemon' to graph the latest collected state.
+    """
+    from malachite.collector_daemon import CollectorDaemon
+
+    click.secho('# Using appliances file %s' % appliances, fg='green')
+    collector = CollectorDaemon(
+        appliances,
+        cache=SnapshotCache(cache_dir),
+        interval=interval,
+        workers=workers,
+        connect_timeout=connect_timeout,
+        getter_timeout=getter_timeout,
+        routes=routes
+    )
+
+    def report(result, duration):
+        succeeded, failed = result
+        click.secho('-- Polled %s appliances in %.3fs (%s failed)' % (
+            len(succeeded) + len(failed), duration, len(failed)), fg='green')
+        for failure in failed:
+            click.secho('   %s (%s failed: %s)' % (
+                failure.appliance.name, failure.stage, failure.error),
+                fg='red')
 
-    # Ploting plotly graph
-    click.secho('-- Ploting graph...', fg='green')
-    malachite.plot(output_file)
+    signal.signal(signal.SIGTERM, lambda *_: collector.stop())
+    click.secho('-- Polling every %ss, stop with Ctrl-C' % collector.interval,
+                fg='green')
+    try:
+        collector.run(cycles, report)
+    except KeyboardInterrupt:
+        collector.stop()
+    click.secho('-- Sessions closed', fg='green')
@@ -0,0 +1,126 @@
+""" Sharded collection.
+
+    A single process is limited by the GIL when parsing napalm outputs, and
+    by its own file descriptors and SSL sessions. The inventory can instead
+    be split in N shards, each one being collected by its own process, or
+    by a separate collector host :
+
+        $ malachite-cli collect-shard appliances.yaml --shard 1/4 -o s1.json
+
+    Each shard writes a shard file holding its appliances and the data
+    collected from them, and the coordinator merges every shard file into a
+    single Loader (see Loader.iter_shards). Edges are built on the merged
+    state, so ErrRedefinedIP checks span every shard.
+
+    Appliances are assigned to a shard from a hash of (fqdn, port), which
+    gives the same split on every host (see inventory.shard_of).
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from malachite.loader import Loader
+from malachite.routing import routes_to_list
+
+
+def write_shard(loader, results, index, count, filename):
+    """ Write appliances of a loader, and how their collection went, as a
+        shard file.
+
+        :params Loader loader: Loader holding the shard appliances.
+        :params list results: EnrichResult of every appliance.
+        :params int index: Shard index.
+        :params int count: Number of shards.
+        :params str filename: Shard file to write.
+    """
+    by_appliance = {id(result.appliance): result for result in results}
+
+    appliances = []
+    for appliance in loader.appliances:
+        result = by_appliance.get(id(appliance))
+        failure = result.failure if result else None
+        appliances.append({
+            'fqdn': appliance.fqdn,
+            'name': appliance.name,
+            'driver': appliance.driver,
+            'port': appliance.port,
+            'tags': appliance.tags,
+            'ip_local': [
+                [str(ip), interface]
+                for ip, interface in appliance.ip_local.items()
+            ],
+            'ip_arp_table': [
+                [interface, str(ip)]
+                for interface, ip in appliance.ip_arp_table.items()
+            ],
+            'arp_macs': appliance.arp_macs,
+            'routes': routes_to_list(appliance.routes)
+            if appliance.routes is not None else None,
+            'source': result.source if result else None,
+            'wall_time': result.wall_time if result else 0,
+            'failure': {
+                'stage': failure.stage,
+                'error': str(failure.error),
+            } if failure else None,
+        })
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_filename = '%s.%s.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'w') as s_file:
+        json.dump(
+            {'shard': index, 'shards': count, 'appliances': appliances},
+            s_file
+        )
+    os.replace(tmp_filename, filename)
+
+
+def collect_shard(node_file, index, count, filename, **loader_options):
+    """ Collect the appliances of one shard of an inventory and write
+        them as a shard file.
+
+        :params str node_file: Inventory filename.
+        :params int index: Shard to collect, from 0 to count - 1.
+        :params int count: Number of shards.
+        :params str filename: Shard file to write.
+        :params loader_options: Loader settings (workers, timeouts...).
+        :return: Shard filename, and number of failed appliances.
+        :rtype: tuple(str, int)
+    """
+    loader = Loader(**loader_options)
+    results = list(loader.iter_enrich(
+        loader.iter_appliances(node_file, shard=(index, count))
+    ))
+    write_shard(loader, results, index, count, filename)
+    return filename, len(loader.failed_appliances)
+
+
+def collect_sharded(node_file, processes, directory, **loader_options):
+    """ Collect an inventory with one process per shard.
+
+        :params str node_file: Inventory filename.
+        :params int processes: Number of shards (and processes).
+        :params str directory: Folder where shard files are written.
+        :params loader_options: Loader settings, sent to every process
+                                (must be picklable : no tracer).
+        :return: Shard filenames, by shard index.
+        :rtype: list
+    """
+    filenames = [
+        os.path.join(directory, 'shard_%s_of_%s.json' % (index, processes))
+        for index in range(processes)
+    ]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        jobs = [
+            executor.submit(collect_shard, node_file, index, processes,
+                            filename, **loader_options)
+            for index, filename in enumerate(filenames)
+        ]
+        for job in jobs:
+            job.result()
+
+    return filenames
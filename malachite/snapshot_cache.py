@@ -0,0 +1,164 @@
+""" On-disk cache of raw data collected with napalm.
+
+    Each appliance, identified by (fqdn, port, driver), gets its own JSON
+    file holding the output of every getter used by the Loader and the time
+    at which it was collected. Entries older than the cache max age are
+    considered stale and the appliance is polled again.
+
+    Collection failures can be recorded too (see CollectorDaemon) : the
+    entry then keeps the last successful collection time, but its data is
+    not served anymore, so that the failure is reported instead of
+    outdated data.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from malachite.utils.config import CONFIG
+
+
+class SnapshotCache:
+    """ Store and retrieve napalm getters output for appliances.
+    """
+
+    def __init__(self, directory=None, max_age=None):
+        """ Init cache.
+
+            :params str directory: Folder holding the cache files (created
+                                   if needed).
+            :params float max_age: Age (in seconds) after which an entry is
+                                   stale. 0 means every entry is stale,
+                                   which forces a full refresh.
+        """
+        defaults = CONFIG['default']
+        self.directory = os.path.expanduser(
+            directory if directory else defaults['cache_dir']
+        )
+        self.max_age = (
+            defaults['cache_max_age'] if max_age is None else max_age
+        )
+
+    @staticmethod
+    def key(appliance):
+        """ Cache key of an appliance.
+
+            :params Appliance appliance: Appliance to identify.
+            :return: (fqdn, port, driver) tuple.
+            :rtype: tuple
+        """
+        return (appliance.fqdn, appliance.port, appliance.driver)
+
+    def _path(self, appliance):
+        """Return filename of the cache entry of an appliance"""
+        digest = hashlib.sha1(
+            ('%s:%s:%s' % self.key(appliance)).encode('utf-8')
+        ).hexdigest()
+        return os.path.join(self.directory, '%s.json' % digest)
+
+    def _read(self, appliance):
+        """Return the cache entry of an appliance, or None"""
+        try:
+            with open(self._path(appliance), 'r') as c_file:
+                entry = json.load(c_file)
+        except (OSError, ValueError):
+            return None
+
+        # Hash collisions are unlikely, but cheap to rule out
+        if tuple(entry['key']) != self.key(appliance):
+            return None
+        return entry
+
+    def _write(self, appliance, entry):
+        """Store the cache entry of an appliance"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(appliance)
+
+        # Write then rename, so that readers never see half written entries
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as c_file:
+            json.dump(entry, c_file)
+        os.replace(tmp_path, path)
+
+    def get(self, appliance, max_age=None):
+        """ Fetch the cached data of an appliance, if fresh enough.
+
+            :params Appliance appliance: Appliance to look for.
+            :params float max_age: Override cache max age for this lookup.
+            :return: (arp_table, interfaces_ip, route_table) napalm
+                     outputs (route_table is None if routes were not
+                     collected), or None if the entry is missing, stale,
+                     or if its latest collection failed.
+            :rtype: tuple
+        """
+        max_age = self.max_age if max_age is None else max_age
+        if max_age <= 0:
+            return None
+
+        entry = self._read(appliance)
+        if entry is None or 'failure' in entry:
+            return None
+
+        if time.time() - entry['timestamp'] > max_age:
+            return None
+
+        return (
+            entry['arp_table'], entry['interfaces_ip'], entry.get('routes')
+        )
+
+    def get_failure(self, appliance):
+        """ Fetch the latest collection failure of an appliance, if its
+            latest collection failed.
+
+            :params Appliance appliance: Appliance to look for.
+            :return: Dict with 'stage', 'error' (message) and 'timestamp'
+                     of the failure, and 'last_success' (collection time of
+                     the data kept in cache, None if never collected), or
+                     None.
+            :rtype: dict
+        """
+        entry = self._read(appliance)
+        if entry is None or 'failure' not in entry:
+            return None
+        return dict(entry['failure'], last_success=entry.get('timestamp'))
+
+    def put(self, appliance, arp_table, interfaces_ip, route_table=None,
+            timestamp=None):
+        """ Store freshly collected data of an appliance (clearing its
+            failure, if any).
+
+            :params Appliance appliance: Appliance the data comes from.
+            :params list arp_table: Output of napalm get_arp_table.
+            :params dict interfaces_ip: Output of napalm get_interfaces_ip.
+            :params dict route_table: Output of napalm get_route_to, if
+                                      collected.
+            :params float timestamp: Collection time (defaults to now).
+        """
+        entry = {
+            'key': self.key(appliance),
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'arp_table': arp_table,
+            'interfaces_ip': interfaces_ip,
+        }
+        if route_table is not None:
+            entry['routes'] = route_table
+        self._write(appliance, entry)
+
+    def put_failure(self, appliance, stage, error, timestamp=None):
+        """ Record a failed collection of an appliance. Data of its last
+            successful collection is kept, but not served by 'get' until
+            the appliance is collected again.
+
+            :params Appliance appliance: Appliance which failed.
+            :params str stage: Step which failed (see CollectionFailure).
+            :params str error: Error message.
+            :params float timestamp: Failure time (defaults to now).
+        """
+        entry = self._read(appliance) or {'key': self.key(appliance)}
+        entry['failure'] = {
+            'stage': stage,
+            'error': error,
+            'timestamp': time.time() if timestamp is None else timestamp,
+        }
+        self._write(appliance, entry)
@@ -0,0 +1,321 @@
+""" SQLite topology store.
+
+    Each run can be saved as a snapshot : appliances (with their inventory
+    tags and collection failure, if any), their local IPs, ARP entries
+    and routing tables, ghost nodes (see ghosts.py), nodes coordinates and
+    edges. Snapshots are kept side by side in a single SQLite file, indexed
+    by snapshot id and by IP address, so that weeks of history stay quick
+    to query, and any past snapshot can be graphed again without polling
+    anything.
+
+    Rows reference nodes by uid, which is the node index in its snapshot
+    (ghost nodes included). Databases created by older versions get the
+    missing columns when opened : their snapshots have no tags, failures,
+    ARP MACs, routes nor ghosts.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+from malachite.routing import routes_to_list
+
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import ErrLoadingFailed, error_text
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS appliances (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    uid INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    fqdn TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    driver TEXT NOT NULL,
+    x REAL, y REAL, z REAL,
+    tags TEXT NOT NULL DEFAULT '{}',
+    failure_stage TEXT,
+    failure_error TEXT,
+    has_routes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (snapshot_id, uid)
+);
+CREATE TABLE IF NOT EXISTS local_ips (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    uid INTEGER NOT NULL,
+    ip TEXT NOT NULL,
+    interface TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS arp_entries (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    uid INTEGER NOT NULL,
+    interface TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    mac TEXT
+);
+CREATE TABLE IF NOT EXISTS routes (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    uid INTEGER NOT NULL,
+    prefix TEXT NOT NULL,
+    next_hop TEXT,
+    interface TEXT
+);
+CREATE TABLE IF NOT EXISTS ghosts (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    uid INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    grouped INTEGER NOT NULL,
+    neighbors TEXT NOT NULL,
+    x REAL, y REAL, z REAL,
+    PRIMARY KEY (snapshot_id, uid)
+);
+CREATE TABLE IF NOT EXISTS edges (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    source_uid INTEGER NOT NULL,
+    destination_uid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS local_ips_snapshot ON local_ips (snapshot_id);
+CREATE INDEX IF NOT EXISTS local_ips_ip ON local_ips (ip, snapshot_id);
+CREATE INDEX IF NOT EXISTS arp_entries_snapshot ON arp_entries (snapshot_id);
+CREATE INDEX IF NOT EXISTS arp_entries_ip ON arp_entries (ip, snapshot_id);
+CREATE INDEX IF NOT EXISTS edges_snapshot ON edges (snapshot_id);
+CREATE INDEX IF NOT EXISTS routes_snapshot ON routes (snapshot_id);
+'''
+
+# Columns missing from databases created by older versions
+ADDED_COLUMNS = (
+    ('appliances', 'tags', "TEXT NOT NULL DEFAULT '{}'"),
+    ('appliances', 'failure_stage', 'TEXT'),
+    ('appliances', 'failure_error', 'TEXT'),
+    ('appliances', 'has_routes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('arp_entries', 'mac', 'TEXT'),
+)
+
+
+class TopologyDB:
+    """ Snapshots of loader state, in a SQLite database.
+    """
+
+    def __init__(self, filename=None):
+        """ Open (and create if needed) the database.
+
+            :params str filename: SQLite file, CONFIG['default']['db_file']
+                                  if None.
+        """
+        self.filename = os.path.expanduser(
+            filename if filename else CONFIG['default']['db_file']
+        )
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        # Readers (graph rendering, queries) don't block a saving collector
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self._migrate()
+        self.connection.executescript(SCHEMA)
+
+    def _migrate(self):
+        """Add columns missing from tables created by older versions"""
+        for table, column, declaration in ADDED_COLUMNS:
+            columns = [row[1] for row in self.connection.execute(
+                'PRAGMA table_info(%s)' % table
+            )]
+            # No columns : table doesn't exist yet, SCHEMA creates it
+            if columns and column not in columns:
+                self.connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table, column, declaration
+                ))
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+    def save(self, loader, label=None, timestamp=None):
+        """ Store loader state as a new snapshot, in a single transaction.
+
+            :params Loader loader: Loader, after 'build_edges' (and
+                                   'build_coordinates' to keep the layout).
+            :params str label: Optional description of the snapshot.
+            :params float timestamp: Snapshot time (defaults to now).
+            :return: Id of the new snapshot.
+            :rtype: int
+        """
+        coordinates = loader.store.coordinates.tolist()
+        nodes = [node for node in loader.nodes if not node.appliance.ghost]
+        ghosts = [node for node in loader.nodes if node.appliance.ghost]
+
+        def failure(app):
+            if not app.failure:
+                return None, None
+            return app.failure.stage, error_text(app.failure.error)
+
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO snapshots (created, label) VALUES (?, ?)',
+                (time.time() if timestamp is None else timestamp, label)
+            )
+            snapshot_id = cursor.lastrowid
+
+            self.connection.executemany(
+                'INSERT INTO appliances VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((snapshot_id, node.uid, node.appliance.name,
+                  node.appliance.fqdn, node.appliance.port or 0,
+                  node.appliance.driver, *coordinates[node.row],
+                  json.dumps(node.appliance.tags, sort_keys=True),
+                  *failure(node.appliance),
+                  node.appliance.routes is not None)
+                 for node in nodes)
+            )
+            self.connection.executemany(
+                'INSERT INTO local_ips VALUES (?, ?, ?, ?)',
+                ((snapshot_id, node.uid, str(ip), interface)
+                 for node in nodes
+                 for ip, interface in node.appliance.ip_local.items())
+            )
+            self.connection.executemany(
+                'INSERT INTO arp_entries VALUES (?, ?, ?, ?, ?)',
+                ((snapshot_id, node.uid, interface, str(ip),
+                  node.appliance.arp_macs.get(interface))
+                 for node in nodes
+                 for interface, ip in node.appliance.ip_arp_table.items())
+            )
+            # One row per next hop, NULL for directly connected networks
+            self.connection.executemany(
+                'INSERT INTO routes VALUES (?, ?, ?, ?, ?)',
+                ((snapshot_id, node.uid, prefix, next_hop, interface)
+                 for node in nodes if node.appliance.routes is not None
+                 for prefix, next_hops in routes_to_list(
+                     node.appliance.routes)
+                 for next_hop, interface in next_hops)
+            )
+            self.connection.executemany(
+                'INSERT INTO ghosts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((snapshot_id, node.uid, node.appliance.fqdn,
+                  node.appliance.grouped,
+                  json.dumps(node.appliance.neighbors),
+                  *coordinates[node.row])
+                 for node in ghosts)
+            )
+            self.connection.executemany(
+                'INSERT INTO edges VALUES (?, ?, ?)',
+                ((snapshot_id, edge.source.uid, edge.destination.uid)
+                 for edge in loader.edges)
+            )
+
+        return snapshot_id
+
+    def snapshots(self):
+        """ List stored snapshots, oldest first.
+
+            :return: List of (id, created timestamp, label, appliance count).
+            :rtype: list
+        """
+        return self.connection.execute(
+            'SELECT s.id, s.created, s.label, COUNT(a.uid) '
+            'FROM snapshots s LEFT JOIN appliances a ON a.snapshot_id = s.id '
+            'GROUP BY s.id ORDER BY s.id'
+        ).fetchall()
+
+    def latest_snapshot(self):
+        """Id of the most recent snapshot, None if database is empty"""
+        return self.connection.execute(
+            'SELECT MAX(id) FROM snapshots'
+        ).fetchone()[0]
+
+    def _snapshot_id(self, snapshot_id):
+        """Check a snapshot exists (latest one if None) and return its id"""
+        if snapshot_id is None:
+            snapshot_id = self.latest_snapshot()
+        elif not self.connection.execute(
+                'SELECT 1 FROM snapshots WHERE id = ?', (snapshot_id,)
+        ).fetchone():
+            snapshot_id = None
+
+        if snapshot_id is None:
+            raise ErrLoadingFailed('No such snapshot in %s' % self.filename)
+        return snapshot_id
+
+    def read(self, snapshot_id=None):
+        """ Read raw content of a snapshot.
+
+            :params int snapshot_id: Snapshot to read, latest if None.
+            :return: Snapshot id, appliance rows (uid, name, fqdn, port,
+                     driver, x, y, z, tags, failure stage, failure error,
+                     has routes) by uid, and local IPs (uid, ip, interface),
+                     ARP entries (uid, interface, ip, mac), edges (source
+                     uid, destination uid), routes (uid, prefix, next hop,
+                     interface) and ghosts (uid, label, grouped, neighbors,
+                     x, y, z) lists.
+            :rtype: tuple
+            :raises ErrLoadingFailed: If the snapshot doesn't exist.
+        """
+        snapshot_id = self._snapshot_id(snapshot_id)
+
+        def rows(query):
+            return self.connection.execute(query, (snapshot_id,)).fetchall()
+
+        return (
+            snapshot_id,
+            rows('SELECT uid, name, fqdn, port, driver, x, y, z, tags, '
+                 'failure_stage, failure_error, has_routes '
+                 'FROM appliances WHERE snapshot_id = ? ORDER BY uid'),
+            rows('SELECT uid, ip, interface FROM local_ips '
+                 'WHERE snapshot_id = ? ORDER BY rowid'),
+            rows('SELECT uid, interface, ip, mac FROM arp_entries '
+                 'WHERE snapshot_id = ? ORDER BY rowid'),
+            rows('SELECT source_uid, destination_uid FROM edges '
+                 'WHERE snapshot_id = ? ORDER BY rowid'),
+            rows('SELECT uid, prefix, next_hop, interface FROM routes '
+                 'WHERE snapshot_id = ? ORDER BY rowid'),
+            rows('SELECT uid, label, grouped, neighbors, x, y, z '
+                 'FROM ghosts WHERE snapshot_id = ? ORDER BY uid'),
+        )
+
+    def find_ip(self, ip, snapshot_id=None):
+        """ Tell which appliances owned, or had in their ARP table, an IP.
+
+            :params ip: IP address (string or ipaddress object).
+            :params int snapshot_id: Restrict to a snapshot, every snapshot
+                                     if None.
+            :return: 'local' and 'arp' lists of (snapshot id, appliance
+                     name, interface) tuples, by snapshot id.
+            :rtype: dict
+        """
+        found = {}
+        for kind, table in (('local', 'local_ips'), ('arp', 'arp_entries')):
+            query = (
+                'SELECT t.snapshot_id, a.name, t.interface FROM %s t '
+                'JOIN appliances a '
+                'ON a.snapshot_id = t.snapshot_id AND a.uid = t.uid '
+                'WHERE t.ip = ?' % table
+            )
+            params = (str(ip),)
+            if snapshot_id is not None:
+                query += ' AND t.snapshot_id = ?'
+                params += (snapshot_id,)
+            found[kind] = self.connection.execute(
+                query + ' ORDER BY t.snapshot_id', params
+            ).fetchall()
+        return found
+
+    def prune(self, before):
+        """ Delete snapshots older than a given time.
+
+            :params float before: Timestamp, older snapshots are deleted.
+            :return: Number of deleted snapshots.
+            :rtype: int
+        """
+        with self.connection:
+            deleted = self.connection.execute(
+                'DELETE FROM snapshots WHERE created < ?', (before,)
+            ).rowcount
+        return deleted
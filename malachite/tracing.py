@@ -0,0 +1,142 @@
+""" Timing of napalm calls.
+
+    NapalmMiddleware records a Span for every connection and getter call
+    into a Tracer, which can then summarize them (slowest devices, stats
+    per getter) or export them as JSON lines or as a Prometheus textfile
+    (for node_exporter textfile collector).
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+
+# Single napalm call :
+# - device : appliance 'fqdn:port'
+# - driver : napalm driver name
+# - operation : connect, is_alive, batch, get_arp_table, get_interfaces_ip...
+# - start : call start (epoch), duration : seconds spent
+# - size : number of items returned (None if the call failed)
+# - outcome : ok, timeout or error ; error : error message, if any
+Span = namedtuple(
+    'Span',
+    ['device', 'driver', 'operation', 'start', 'duration', 'size', 'outcome',
+     'error']
+)
+
+
+def _escape_label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+class Tracer:
+    """ Thread safe collection of Spans.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        """Add a span (may be called from any thread)"""
+        with self._lock:
+            self.spans.append(span)
+
+    def slowest_devices(self, count=10):
+        """ Devices sorted by total time spent in napalm calls.
+
+            :params int count: Number of devices to return.
+            :return: List of (device, driver, total seconds, failed calls).
+            :rtype: list
+        """
+        devices = {}
+        for span in self.spans:
+            total, failed = devices.get((span.device, span.driver), (0, 0))
+            devices[(span.device, span.driver)] = (
+                total + span.duration,
+                failed + (span.outcome != 'ok')
+            )
+
+        ranking = sorted(devices.items(), key=lambda d: d[1][0], reverse=True)
+        return [
+            (device, driver, total, failed)
+            for (device, driver), (total, failed) in ranking[:count]
+        ]
+
+    def operation_stats(self):
+        """ Statistics of each kind of call (connect and each getter).
+
+            :return: Operation -> dict with count, failed, total, mean and
+                     max duration (seconds), by decreasing total time.
+            :rtype: OrderedDict
+        """
+        stats = {}
+        for span in self.spans:
+            entry = stats.setdefault(span.operation, {
+                'count': 0, 'failed': 0, 'total': 0, 'max': 0
+            })
+            entry['count'] += 1
+            entry['failed'] += span.outcome != 'ok'
+            entry['total'] += span.duration
+            entry['max'] = max(entry['max'], span.duration)
+
+        for entry in stats.values():
+            entry['mean'] = entry['total'] / entry['count']
+
+        return OrderedDict(
+            sorted(stats.items(), key=lambda s: s[1]['total'], reverse=True)
+        )
+
+    def export_jsonl(self, filename):
+        """Write one JSON object per span"""
+        with open(filename, 'w') as t_file:
+            for span in self.spans:
+                t_file.write(json.dumps(span._asdict()) + '\n')
+
+    def export_prometheus(self, filename):
+        """ Write spans aggregated by device/driver/operation/outcome in
+            Prometheus text format. The file is written then renamed, as
+            expected by node_exporter textfile collector.
+        """
+        series = OrderedDict()
+        for span in self.spans:
+            labels = (span.device, span.driver, span.operation, span.outcome)
+            total, count, size = series.get(labels, (0, 0, 0))
+            series[labels] = (
+                total + span.duration, count + 1, size + (span.size or 0)
+            )
+
+        lines = [
+            '# HELP malachite_napalm_call_seconds Time spent in napalm calls',
+            '# TYPE malachite_napalm_call_seconds summary',
+        ]
+        sizes = [
+            '# HELP malachite_napalm_call_items Items returned by napalm '
+            'calls',
+            '# TYPE malachite_napalm_call_items counter',
+        ]
+        for labels, (total, count, size) in series.items():
+            label_str = ','.join(
+                '%s="%s"' % (name, _escape_label(value))
+                for name, value in zip(
+                    ('device', 'driver', 'operation', 'outcome'), labels
+                )
+            )
+            lines.append(
+                'malachite_napalm_call_seconds_sum{%s} %f' % (label_str, total)
+            )
+            lines.append(
+                'malachite_napalm_call_seconds_count{%s} %d'
+                % (label_str, count)
+            )
+            sizes.append(
+                'malachite_napalm_call_items_total{%s} %d' % (label_str, size)
+            )
+
+        tmp_filename = '%s.%s.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'w') as t_file:
+            t_file.write('\n'.join(lines + sizes) + '\n')
+        os.replace(tmp_filename, filename)
@@ -16,3 +16,114 @@ CONFIG['default']['graph_file'] = 'graph.html'
 
 CONFIG['default']['username'] = 'vagrant'
 CONFIG['default']['password'] = 'vagrant'
+
+# Collection settings (number of appliances polled in parallel, connection
+# and per getter deadlines in seconds)
+CONFIG['default']['workers'] = 1
+CONFIG['default']['connect_timeout'] = 60
+CONFIG['default']['getter_timeout'] = 60
+
+# Napalm calls can't be cancelled : a call exceeding its deadline keeps
+# running in its own thread (see napalm_collector._run_with_deadline). Past
+# this number of such calls, new ones fail right away instead of piling up
+# more threads.
+CONFIG['default']['max_abandoned_calls'] = 64
+
+# Retries of a failed appliance collection (see resilience.py) : number of
+# attempts (1 means no retry), delay before the first retry in seconds
+# (doubled after each failure, up to 'max_backoff'), and total time spent on
+# an appliance in seconds : no attempt starts past it, and connections get
+# what is left of it at most (0 for no limit)
+CONFIG['default']['retries'] = {
+    'attempts': 3,
+    'backoff': 1,
+    'max_backoff': 30,
+    'max_time': 90,
+}
+
+# Circuit breaker of failing appliances (see resilience.py) : state file,
+# consecutive failed collections before an appliance is skipped, and how
+# long it is skipped in seconds (doubled after each failure once skipped,
+# up to 'max_cooldown')
+CONFIG['default']['breaker'] = {
+    'file': '~/.cache/malachite/breaker.json',
+    'threshold': 3,
+    'cooldown': 600,
+    'max_cooldown': 86400,
+}
+
+# Cache of collected napalm data (folder, and max age of entries in seconds)
+CONFIG['default']['cache_dir'] = '~/.cache/malachite/snapshots'
+CONFIG['default']['cache_max_age'] = 300
+
+# Replay driver settings (fixtures folder, latency added to each getter call
+# and to connection, in seconds)
+CONFIG['default']['replay'] = {
+    'replay_dir': 'fixtures',
+    'latency': 0,
+    'connect_latency': 0,
+}
+
+# Layout algorithm ('auto' picks the first (algorithm, max node count) entry
+# of 'layout_thresholds' fitting the graph, or 'layout_fallback' for bigger
+# graphs : grid Fruchterman-Reingold is flat (z = 0), 'drl' stays 3D but is
+# much slower, see layout.py)
+CONFIG['default']['layout'] = 'auto'
+CONFIG['default']['layout_thresholds'] = [('kk', 1000), ('fr', 3000)]
+CONFIG['default']['layout_fallback'] = 'fr-grid'
+CONFIG['default']['layout_cache_dir'] = '~/.cache/malachite/layouts'
+
+# Kamada-Kawai iterations per node when refreshing an existing layout
+# (igraph default for a layout from scratch is 50)
+CONFIG['default']['warm_layout_iterations'] = 10
+# Fruchterman-Reingold iterations when refreshing an existing layout
+# (igraph default for a layout from scratch is 500)
+CONFIG['default']['warm_fr_iterations'] = 50
+
+# Collector daemon (see collector_daemon.py) : seconds between two polls of
+# every appliance, and delay before reconnecting to an unreachable appliance
+# (doubled after each failure, up to 'max_backoff'). 'graph --from-daemon'
+# ignores data older than 'stale_intervals' polls (the daemon is probably
+# stopped), unless --max-age is set.
+CONFIG['default']['daemon'] = {
+    'interval': 300,
+    'backoff': 5,
+    'max_backoff': 600,
+    'stale_intervals': 3,
+}
+
+# Topology snapshots database (see topology_db.py)
+CONFIG['default']['db_file'] = '~/.local/share/malachite/topology.sqlite'
+
+# Ghost nodes for unknown ARP neighbors (see ghosts.py) : reverse DNS cache
+# file and lifetime of its entries (seconds), number of concurrent lookups
+# and deadline for all of them (seconds), prefix lengths used to group
+# neighbors by subnet, and optional IEEE OUI file (oui.txt) naming MAC
+# vendors
+CONFIG['default']['ghosts'] = {
+    'dns_cache': '~/.cache/malachite/dns.json',
+    'dns_ttl': 86400,
+    'dns_workers': 32,
+    'dns_timeout': 2,
+    'prefix_v4': 24,
+    'prefix_v6': 64,
+    'oui_file': None,
+}
+
+# Local HTTP API (see api_server.py) : listening address and port, default
+# and largest number of items per page, seconds between two checks for a
+# newer topology (0 never reloads it), seconds before an idle connection is
+# closed, smallest response compressed with gzip (bytes) and gzip level,
+# decimals of coordinates, and number of encoded pages kept in memory
+CONFIG['default']['api'] = {
+    'host': '127.0.0.1',
+    'port': 8347,
+    'page_size': 1000,
+    'max_page_size': 10000,
+    'refresh': 10,
+    'idle_timeout': 30,
+    'gzip_min_size': 1024,
+    'gzip_level': 6,
+    'decimals': 4,
+    'cached_pages': 256,
+}
@@ -22,6 +22,11 @@ class ErrConnectionFailed(MalachiteException):
     pass
 
 
+class ErrDeadlineExceeded(MalachiteException):
+    """An appliance did not answer before the given deadline"""
+    pass
+
+
 class ErrNotImplemented(MalachiteException):
     """Planned feature not yet available"""
     pass
@@ -40,3 +45,40 @@ class ErrNodesNotLoaded(MalachiteException):
 class ErrRedefinedIP(MalachiteException):
     """Multiple nodes claim to have the same IP"""
     pass
+
+
+class ErrInvalidLayout(MalachiteException):
+    """Unknown layout algorithm requested"""
+    pass
+
+
+class ErrUnknownNode(MalachiteException):
+    """Query about an appliance which is not in the graph"""
+    pass
+
+
+class ErrBadRequest(MalachiteException):
+    """Invalid request to the HTTP API (see api_server.py)"""
+    pass
+
+
+def error_text(error):
+    """ Message of an error, formatted with its parameters for
+        MalachiteException.
+
+        :params Exception error: Error to describe.
+        :rtype: str
+    """
+    if not isinstance(error, MalachiteException):
+        return str(error)
+
+    # args[0] is the exception itself, then a message and its parameters
+    message = error.args[1:]
+    if not message:
+        return type(error).__name__
+    if len(message) == 1:
+        return str(message[0])
+    try:
+        return str(message[0]) % message[1:]
+    except (TypeError, ValueError):
+        return ' '.join(str(arg) for arg in message)
@@ -7,6 +7,7 @@ setup(
     install_requires=[
         'Click',
         'napalm',
+        'numpy',
         'python-igraph',
         'plotly'
     ],
@@ -0,0 +1,151 @@
+""" Shared fixtures : small networks described as a list of appliance
+    dicts, built either straight into a Loader ('make_loader'), or as an
+    inventory and replay fixtures for tests polling appliances
+    ('replay_network').
+
+    Appliance dict keys : 'fqdn' (required), 'driver' ('eos' by default),
+    'name', 'port', 'tags', 'ip_local' ({ip: interface}), 'arp'
+    ({interface: ip}), 'macs' ({interface: mac}), 'routes' (see
+    routing.routes_to_list), 'failure' ((stage, message)) and 'ghost'
+    (neighbor (IP, name) pairs : a ghost node labelled 'fqdn').
+"""
+
+import json
+import os
+from ipaddress import ip_address
+
+import pytest
+
+from malachite.ghosts import GhostAppliance
+from malachite.loader import CollectionFailure, Loader
+from malachite.models.node import Node
+from malachite.replay_driver import fixture_path
+from malachite.routing import routes_from_list
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import ErrConnectionFailed
+
+
+# Two linked switches, and a third one linked to the second
+TRIANGLE = [
+    {'fqdn': 'switch1', 'ip_local': {'10.0.0.0': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.1'}},
+    {'fqdn': 'switch2',
+     'ip_local': {'10.0.0.1': 'Ethernet1', '10.0.0.2': 'Ethernet2'},
+     'arp': {'Ethernet1': '10.0.0.0', 'Ethernet2': '10.0.0.3'}},
+    {'fqdn': 'switch3', 'ip_local': {'10.0.0.3': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.2'}},
+]
+
+
+def _record(spec):
+    """Inventory record of an appliance dict"""
+    record = dict(spec.get('tags', {}))
+    record['fqdn'] = spec['fqdn']
+    record['driver'] = spec.get('driver', 'eos')
+    for field in ('name', 'port'):
+        if field in spec:
+            record[field] = spec[field]
+    return record
+
+
+def build_loader(appliances, **options):
+    """ Loader holding the given appliances, edges built.
+
+        :params list appliances: Appliance dicts (see module docstring).
+        :params options: Loader options.
+        :rtype: Loader
+    """
+    loader = Loader(**options)
+    for spec in appliances:
+        if 'ghost' in spec:
+            ghost = Node(loader._get_uid(), GhostAppliance(
+                spec['fqdn'], spec['ghost'], False
+            ), loader.store)
+            loader.nodes.append(ghost)
+            loader.ghost_nodes.append(ghost)
+            continue
+
+        appliance = loader._add_appliance(_record(spec))
+        for ip, interface in spec.get('ip_local', {}).items():
+            appliance.ip_local[ip_address(ip)] = interface
+        for interface, ip in spec.get('arp', {}).items():
+            appliance.ip_arp_table[interface] = ip_address(ip)
+        appliance.arp_macs = dict(spec.get('macs', {}))
+        if spec.get('routes') is not None:
+            appliance.routes = routes_from_list(spec['routes'])
+        if spec.get('failure'):
+            stage, message = spec['failure']
+            appliance.failure = CollectionFailure(
+                appliance, stage, ErrConnectionFailed(message)
+            )
+
+    loader.build_ip_index()
+    loader.build_edges()
+    if loader.ghosts:
+        loader.build_ghosts()
+    return loader
+
+
+@pytest.fixture
+def make_loader():
+    """Factory of loaders built from appliance dicts (see 'build_loader')"""
+    return build_loader
+
+
+class ReplayNetwork:
+    """ Inventory and replay fixtures of appliance dicts. Appliances are
+        served by the replay driver, without latency.
+    """
+
+    def __init__(self, directory):
+        self.inventory = str(directory / 'appliances.jsonl')
+        self.fixtures = str(directory / 'fixtures')
+
+    def write(self, appliances):
+        """ (Re)write inventory and fixtures. Appliances without 'ip_local'
+            have no fixture, and can't be connected to.
+        """
+        with open(self.inventory, 'w') as i_file:
+            for spec in appliances:
+                record = _record(spec)
+                record['driver'] = 'replay'
+                i_file.write(json.dumps(record) + '\n')
+
+        for spec in appliances:
+            path = fixture_path(self.fixtures, spec['fqdn'], spec.get('port'))
+            if 'ip_local' not in spec:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            fixture = {
+                'get_arp_table': [{
+                    'interface': interface, 'ip': ip, 'age': 1.0,
+                    'mac': spec.get('macs', {}).get(
+                        interface, '00:1c:73:00:00:01'
+                    ),
+                } for interface, ip in spec.get('arp', {}).items()],
+                'get_interfaces_ip': {},
+            }
+            for ip, interface in spec['ip_local'].items():
+                fixture['get_interfaces_ip'].setdefault(
+                    interface, {'ipv4': {}}
+                )['ipv4'][ip] = {'prefix_length': 31}
+            if 'route_to' in spec:
+                fixture['get_route_to'] = spec['route_to']
+            with open(path, 'w') as f_file:
+                json.dump(fixture, f_file)
+
+
+@pytest.fixture
+def replay_network(tmp_path, monkeypatch):
+    """ReplayNetwork in a temporary folder, fixtures used by 'replay'"""
+    network = ReplayNetwork(tmp_path)
+    (tmp_path / 'fixtures').mkdir()
+    monkeypatch.setitem(CONFIG['default'], 'replay', dict(
+        CONFIG['default']['replay'], replay_dir=network.fixtures,
+        latency=0, connect_latency=0
+    ))
+    monkeypatch.setitem(CONFIG['default'], 'retries', dict(
+        CONFIG['default']['retries'], backoff=0
+    ))
+    return network
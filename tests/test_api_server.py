@@ -0,0 +1,186 @@
+""" HTTP API : paged lists, ETag and 304 answers until the topology is
+    reloaded, and gzip bodies for clients accepting them.
+"""
+
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from malachite.api_server import ExportSource, TopologyServer
+from malachite.utils.config import CONFIG
+
+
+def chain(count):
+    """Appliance dicts of switch1..switch<count>, each linked to the next"""
+    network = [{'fqdn': 'switch%s' % index, 'ip_local': {}, 'arp': {}}
+               for index in range(1, count + 1)]
+    for index, (left, right) in enumerate(zip(network, network[1:])):
+        left['ip_local']['10.0.%s.0' % index] = 'Ethernet2'
+        left['arp']['Ethernet2'] = '10.0.%s.1' % index
+        right['ip_local']['10.0.%s.1' % index] = 'Ethernet1'
+        right['arp']['Ethernet1'] = '10.0.%s.0' % index
+    return network
+
+
+class Export:
+    """Export file of a chain of appliances"""
+
+    def __init__(self, filename, build):
+        self.filename = filename
+        self.build = build
+
+    def write(self, count):
+        self.build(chain(count)).save_export(self.filename)
+
+
+@pytest.fixture
+def export(tmp_path, make_loader):
+    """Export of a chain of 12 appliances"""
+    export = Export(str(tmp_path / 'topology.json'), make_loader)
+    export.write(12)
+    return export
+
+
+@pytest.fixture
+def server(export, monkeypatch):
+    monkeypatch.setitem(CONFIG['default'], 'api', dict(
+        CONFIG['default']['api'], gzip_min_size=256
+    ))
+    server = TopologyServer(ExportSource(export.filename), port=0,
+                            page_size=5, max_page_size=10)
+    asyncio.run(server.reload(force=True))
+    return server
+
+
+def get(server, target, **headers):
+    """Status, headers and decoded JSON body of a GET request"""
+    status, response_headers, body = asyncio.run(server.respond(
+        'GET', target,
+        {name.replace('_', '-'): value for name, value in headers.items()}
+    ))
+    response_headers = dict(response_headers)
+    if response_headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return status, response_headers, json.loads(body) if body else None
+
+
+def test_topology(server):
+    status, headers, body = get(server, '/api/topology')
+    assert status == 200
+    assert headers['ETag'] == 'W/"%s"' % body['version']
+    assert (body['nodes'], body['edges'], body['unreachable']) == (12, 11, 0)
+
+
+def test_paging(server):
+    # Default page size
+    _, _, page = get(server, '/api/nodes')
+    assert (page['total'], page['offset'], page['limit'], page['next']) \
+        == (12, 0, 5, 5)
+    assert [node['name'] for node in page['items']] == [
+        'switch%s' % index for index in range(1, 6)
+    ]
+
+    names, offset = [], 0
+    while offset is not None:
+        _, _, page = get(server, '/api/nodes?offset=%s&limit=4' % offset)
+        names.extend(node['name'] for node in page['items'])
+        offset = page['next']
+    assert names == ['switch%s' % index for index in range(1, 13)]
+
+    _, _, page = get(server, '/api/edges?offset=10')
+    assert page['next'] is None
+    edge, = page['items']
+    assert edge['id'] == 10
+    assert {edge['source'], edge['destination']} == {10, 11}
+    _, _, page = get(server, '/api/coordinates/?limit=10')
+    assert len(page['items']) == 10 and len(page['items'][0]) == 3
+    # Past the end
+    _, _, page = get(server, '/api/nodes?offset=20')
+    assert (page['items'], page['next']) == ([], None)
+
+
+@pytest.mark.parametrize('query', [
+    'offset=-1', 'limit=0', 'limit=11', 'offset=one'
+])
+def test_bad_pages(server, query):
+    status, _, body = get(server, '/api/nodes?%s' % query)
+    assert status == 400 and 'error' in body
+
+
+def test_errors(server):
+    assert get(server, '/api/routes')[0] == 404
+    status, headers, _ = asyncio.run(server.respond('POST', '/api/nodes', {}))
+    assert status == 405 and ('Allow', 'GET, HEAD') in headers
+    assert get(TopologyServer(None), '/api/topology')[0] == 503
+
+
+def test_etag(server, export):
+    status, headers, _ = get(server, '/api/nodes')
+    etag = headers['ETag']
+    status, not_modified, body = get(server, '/api/nodes',
+                                     if_none_match=etag)
+    assert (status, not_modified['ETag'], body) == (304, etag, None)
+    # Any list, and strong or listed tags, as long as the topology holds
+    assert get(server, '/api/edges',
+               if_none_match='"x", %s' % etag[2:])[0] == 304
+    assert get(server, '/api/nodes', if_none_match='"other"')[0] == 200
+
+    # Unchanged file : nothing reloaded
+    assert not asyncio.run(server.reload())
+    export.write(13)
+    assert asyncio.run(server.reload())
+    status, headers, body = get(server, '/api/nodes', if_none_match=etag)
+    assert status == 200 and headers['ETag'] != etag
+    assert body['total'] == 13
+
+
+def test_gzip(server):
+    status, headers, body = get(server, '/api/nodes',
+                                accept_encoding='br, gzip')
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert get(server, '/api/nodes')[2] == body
+
+    for refused in ('gzip;q=0', 'br', ''):
+        headers = get(server, '/api/nodes', accept_encoding=refused)[1]
+        assert 'Content-Encoding' not in headers
+    # Small bodies are left alone
+    headers = get(server, '/api/coordinates?limit=1',
+                  accept_encoding='gzip')[1]
+    assert 'Content-Encoding' not in headers
+
+
+def test_connection(server):
+    async def exchange():
+        host, port = await server.start()
+        reader, writer = await asyncio.open_connection(host, port)
+        responses = []
+        # Two requests on a kept alive connection, the last one closing it
+        for request in ('GET /api/topology HTTP/1.1\r\n\r\n',
+                        'HEAD /api/nodes HTTP/1.1\r\nConnection: close'
+                        '\r\n\r\n'):
+            writer.write(request.encode())
+            head = (await reader.readuntil(b'\r\n\r\n')).decode()
+            lines = head.strip().split('\r\n')
+            headers = dict(line.split(': ', 1) for line in lines[1:])
+            body = b''
+            if request.startswith('GET'):
+                body = await reader.readexactly(
+                    int(headers['Content-Length'])
+                )
+            responses.append((lines[0], headers, body))
+        assert await reader.read() == b''
+        writer.close()
+        server.server.close()
+        await server.server.wait_closed()
+        return responses
+
+    (get_line, get_headers, body), (head_line, head_headers, _) = \
+        asyncio.run(exchange())
+    assert get_line == head_line == 'HTTP/1.1 200 OK'
+    assert get_headers['Connection'] == 'keep-alive'
+    assert json.loads(body)['nodes'] == 12
+    assert head_headers['Connection'] == 'close'
+    assert int(head_headers['Content-Length']) > 0
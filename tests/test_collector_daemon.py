@@ -0,0 +1,83 @@
+""" Collector daemon : failed polls are recorded in the cache, and reported
+    as failures by loaders reading the daemon data.
+"""
+
+import time
+
+from conftest import TRIANGLE
+
+from malachite.collector_daemon import CollectorDaemon
+from malachite.loader import Loader
+from malachite.snapshot_cache import SnapshotCache
+from malachite.utils.exceptions import error_text
+
+
+def poll(replay_network, cache):
+    """Poll every appliance once with a new daemon"""
+    collector = CollectorDaemon(replay_network.inventory, cache=cache)
+    try:
+        return collector.poll()
+    finally:
+        collector.pool.close()
+
+
+def daemon_failures(replay_network, cache):
+    """Failures reported by a loader reading the daemon data"""
+    loader = Loader(cache=cache, poll=False)
+    loader.read_appliances(replay_network.inventory)
+    loader._napalm_enrich()
+    return {
+        failure.appliance.fqdn: (failure.stage, error_text(failure.error))
+        for failure in loader.failed_appliances
+    }
+
+
+def test_failed_polls_are_reported(replay_network, tmp_path):
+    cache = SnapshotCache(str(tmp_path / 'cache'), max_age=60)
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3 can't be connected to
+    ip_local = network[2].pop('ip_local')
+    replay_network.write(network)
+
+    succeeded, failed = poll(replay_network, cache)
+    assert [app.fqdn for app in succeeded] == ['switch1', 'switch2']
+    assert [(f.appliance.fqdn, f.stage) for f in failed] == [
+        ('switch3', 'connect')
+    ]
+    failures = daemon_failures(replay_network, cache)
+    assert list(failures) == ['switch3']
+    assert failures['switch3'][0] == 'connect'
+    assert 'never collected' in failures['switch3'][1]
+
+    # Back up : the failure is cleared
+    network[2]['ip_local'] = ip_local
+    replay_network.write(network)
+    assert len(poll(replay_network, cache)[0]) == 3
+    assert daemon_failures(replay_network, cache) == {}
+
+    # Down again : previous data is kept, but reported as failed
+    del network[2]['ip_local']
+    replay_network.write(network)
+    poll(replay_network, cache)
+    loader = Loader()
+    loader.read_appliances(replay_network.inventory)
+    switch3 = loader.appliances[2]
+    recorded = cache.get_failure(switch3)
+    assert recorded['stage'] == 'connect'
+    assert time.time() - recorded['last_success'] < 60
+    assert cache.get(switch3) is None
+    assert 'last collected' in daemon_failures(replay_network, cache)[
+        'switch3'][1]
+
+
+def test_old_daemon_data_is_reported(replay_network, tmp_path):
+    cache = SnapshotCache(str(tmp_path / 'cache'), max_age=60)
+    replay_network.write(TRIANGLE)
+    loader = Loader()
+    loader.read_appliances(replay_network.inventory)
+    for appliance in loader.appliances:
+        cache.put(appliance, [], {}, timestamp=time.time() - 120)
+
+    failures = daemon_failures(replay_network, cache)
+    assert sorted(failures) == ['switch1', 'switch2', 'switch3']
+    assert {stage for stage, _ in failures.values()} == {'cache'}
@@ -0,0 +1,90 @@
+""" Getter calls exceeding their deadline : the device they use is poisoned,
+    and abandoned calls are capped.
+"""
+
+import threading
+
+import pytest
+
+from malachite import napalm_collector
+from malachite.napalm_collector import NapalmMiddleware, _run_with_deadline
+from malachite.utils.config import CONFIG
+from malachite.utils.exceptions import ErrDeadlineExceeded
+
+
+KEY = ('switch1', 443)
+
+
+class SlowDevice:
+    """Device whose getters block until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.returned = threading.Event()
+        self.closed = threading.Event()
+        self.closed_while_running = False
+
+    def get_arp_table(self, vrf=''):
+        self.release.wait(5)
+        self.closed_while_running = self.closed.is_set()
+        self.returned.set()
+        return []
+
+    def close(self):
+        self.closed.set()
+
+
+def test_timed_out_device_is_poisoned():
+    n_middleware = NapalmMiddleware('replay')
+    device = SlowDevice()
+    n_middleware.devices[KEY] = device
+
+    with pytest.raises(ErrDeadlineExceeded):
+        n_middleware.get_arp_table(device_name=KEY, timeout=0.05)
+
+    # Forgotten right away, but not closed under the running call
+    assert KEY not in n_middleware.devices
+    assert not n_middleware.disconnect(device=KEY)
+    assert not device.closed.is_set()
+
+    device.release.set()
+    assert device.closed.wait(5)
+    assert device.returned.is_set()
+    assert not device.closed_while_running
+
+
+def test_call_in_time_keeps_device():
+    n_middleware = NapalmMiddleware('replay')
+    device = SlowDevice()
+    device.release.set()
+    n_middleware.devices[KEY] = device
+
+    assert n_middleware.get_arp_table(device_name=KEY, timeout=5) == []
+    assert n_middleware.devices[KEY] is device
+    assert not device.closed.is_set()
+
+
+def test_abandoned_calls_are_capped(monkeypatch):
+    monkeypatch.setitem(CONFIG['default'], 'max_abandoned_calls', 2)
+    monkeypatch.setattr(napalm_collector, '_abandoned', {'count': 0})
+    release = threading.Event()
+    started = []
+
+    def blocked():
+        started.append(True)
+        release.wait(5)
+
+    for _ in range(2):
+        with pytest.raises(ErrDeadlineExceeded):
+            _run_with_deadline(blocked, 0.01)
+
+    with pytest.raises(ErrDeadlineExceeded, match='still running'):
+        _run_with_deadline(blocked, 0.01)
+    assert len(started) == 2
+
+    release.set()
+    for _ in range(100):
+        if napalm_collector._abandoned['count'] == 0:
+            break
+        threading.Event().wait(0.05)
+    assert _run_with_deadline(lambda: 'ok', 1) == 'ok'
@@ -0,0 +1,136 @@
+""" Topology diff : appliances, links and IPs added, removed, or moved
+    (recabled links, IPs now owned by another appliance or interface).
+"""
+
+from ipaddress import ip_address
+
+from conftest import TRIANGLE
+
+from malachite.diff import (
+    IPOwner, MovedIP, MovedLink, StateLink, diff_loaders
+)
+
+
+def changed(make_loader, network):
+    """Diff from TRIANGLE to a network"""
+    return diff_loaders(make_loader(TRIANGLE), make_loader(network))
+
+
+def test_no_change(make_loader):
+    changes = changed(make_loader, TRIANGLE)
+    assert not changes
+    assert set(changes.counts().values()) == {0}
+    assert sorted(changes.unchanged_labels()) == [
+        'switch1 <-> switch2', 'switch2 <-> switch3'
+    ]
+
+
+def test_added_and_removed(make_loader):
+    network = [dict(spec) for spec in TRIANGLE[1:]]
+    # switch1 is gone, and switch4 is linked to switch3
+    network[1] = dict(network[1],
+                      ip_local={'10.0.0.3': 'Ethernet1',
+                                '10.0.0.4': 'Ethernet2'},
+                      arp={'Ethernet1': '10.0.0.2',
+                           'Ethernet2': '10.0.0.5'})
+    network.append({'fqdn': 'switch4', 'ip_local': {'10.0.0.5': 'Ethernet1'},
+                    'arp': {'Ethernet1': '10.0.0.4'}})
+    changes = changed(make_loader, network)
+
+    assert changes.counts() == {
+        'nodes_added': 1, 'nodes_removed': 1, 'links_added': 1,
+        'links_removed': 1, 'links_moved': 0, 'ips_added': 2,
+        'ips_removed': 1, 'ips_moved': 0,
+    }
+    assert (changes.nodes_added, changes.nodes_removed) == (
+        ['switch4'], ['switch1']
+    )
+    assert changes.links_added == [
+        StateLink('switch3', 'switch4', [('Ethernet2', 'Ethernet1')])
+    ]
+    assert changes.links_removed == [
+        StateLink('switch1', 'switch2', [('Ethernet1', 'Ethernet1')])
+    ]
+    assert sorted(changes.ips_added) == [
+        IPOwner(ip_address('10.0.0.4'), 'switch3', 'Ethernet2'),
+        IPOwner(ip_address('10.0.0.5'), 'switch4', 'Ethernet1'),
+    ]
+    assert changes.ips_removed == [
+        IPOwner(ip_address('10.0.0.0'), 'switch1', 'Ethernet1')
+    ]
+    assert changes.unchanged_labels() == ['switch2 <-> switch3']
+    # Removed appliances are drawn where they were
+    assert changes.segments(changes.links_removed).shape == (1, 2, 3)
+
+
+def test_moved_interfaces(make_loader):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch2 link to switch3 moves from Ethernet2 to Ethernet3
+    network[1] = dict(network[1],
+                      ip_local={'10.0.0.1': 'Ethernet1',
+                                '10.0.0.2': 'Ethernet3'},
+                      arp={'Ethernet1': '10.0.0.0', 'Ethernet3': '10.0.0.3'})
+    changes = changed(make_loader, network)
+
+    assert changes.links_moved == [MovedLink(
+        StateLink('switch2', 'switch3', [('Ethernet2', 'Ethernet1')]),
+        StateLink('switch2', 'switch3', [('Ethernet3', 'Ethernet1')]),
+    )]
+    assert changes.ips_moved == [MovedIP(
+        IPOwner(ip_address('10.0.0.2'), 'switch2', 'Ethernet2'),
+        IPOwner(ip_address('10.0.0.2'), 'switch2', 'Ethernet3'),
+    )]
+    assert not (changes.links_added or changes.links_removed
+                or changes.ips_added or changes.ips_removed)
+
+
+def test_recabled_link(make_loader):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3 cable (and its peer IP) moves from switch2 to switch1
+    network[0] = dict(network[0],
+                      ip_local={'10.0.0.0': 'Ethernet1',
+                                '10.0.0.2': 'Ethernet2'},
+                      arp={'Ethernet1': '10.0.0.1', 'Ethernet2': '10.0.0.3'})
+    network[1] = dict(network[1], ip_local={'10.0.0.1': 'Ethernet1'},
+                      arp={'Ethernet1': '10.0.0.0'})
+    changes = changed(make_loader, network)
+
+    # A removed and an added link sharing switch3 Ethernet1
+    assert changes.links_moved == [MovedLink(
+        StateLink('switch2', 'switch3', [('Ethernet2', 'Ethernet1')]),
+        StateLink('switch1', 'switch3', [('Ethernet2', 'Ethernet1')]),
+    )]
+    assert changes.ips_moved == [MovedIP(
+        IPOwner(ip_address('10.0.0.2'), 'switch2', 'Ethernet2'),
+        IPOwner(ip_address('10.0.0.2'), 'switch1', 'Ethernet2'),
+    )]
+    assert changes.counts() == {
+        'nodes_added': 0, 'nodes_removed': 0, 'links_added': 0,
+        'links_removed': 0, 'links_moved': 1, 'ips_added': 0,
+        'ips_removed': 0, 'ips_moved': 1,
+    }
+
+
+def test_ipv6(make_loader):
+    old = [dict(spec) for spec in TRIANGLE]
+    old[0] = dict(old[0], ip_local={'10.0.0.0': 'Ethernet1',
+                                    '2001:db8::1': 'Loopback0'})
+    old[2] = dict(old[2], ip_local={'10.0.0.3': 'Ethernet1',
+                                    '2001:db8::3': 'Loopback0'})
+    new = [dict(spec) for spec in TRIANGLE]
+    new[1] = dict(new[1], ip_local={'10.0.0.1': 'Ethernet1',
+                                    '10.0.0.2': 'Ethernet2',
+                                    '2001:db8::1': 'Loopback0',
+                                    '2001:db8::2': 'Loopback1'})
+    changes = diff_loaders(make_loader(old), make_loader(new))
+
+    assert changes.ips_moved == [MovedIP(
+        IPOwner(ip_address('2001:db8::1'), 'switch1', 'Loopback0'),
+        IPOwner(ip_address('2001:db8::1'), 'switch2', 'Loopback0'),
+    )]
+    assert changes.ips_added == [
+        IPOwner(ip_address('2001:db8::2'), 'switch2', 'Loopback1')
+    ]
+    assert changes.ips_removed == [
+        IPOwner(ip_address('2001:db8::3'), 'switch3', 'Loopback0')
+    ]
@@ -0,0 +1,104 @@
+""" Exports keep collection failures, routing tables and edges, and
+    version 1 files (without them) can still be imported.
+"""
+
+import numpy as np
+import pytest
+
+from malachite.loader import Loader
+from malachite.routing import routes_to_list
+
+
+ROUTES = [
+    ['10.0.0.0/31', [[None, 'Ethernet1']]],
+    ['10.1.0.0/24', [['10.0.0.1', 'Ethernet1'], ['10.0.0.3', 'Ethernet2']]],
+]
+
+
+# switch1 also sees an unknown neighbor, and a management one
+NETWORK = [
+    {'fqdn': 'switch1', 'ip_local': {'10.0.0.1': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.0', 'Ethernet2': '10.0.1.10',
+             'Management1': '10.0.0.0'}},
+    {'fqdn': 'switch2', 'port': 2222, 'ip_local': {'10.0.0.0': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.1'}, 'routes': ROUTES},
+    {'fqdn': 'switch3', 'failure': ('connect', 'Appliance switch3')},
+]
+
+
+EDGES = [
+    ('switch1', 'switch2', (('Ethernet1', 'Ethernet1'),)),
+    ('switch2', 'switch1', (('Ethernet1', 'Ethernet1'),)),
+]
+
+
+def describe(edges):
+    """Comparable content of edges"""
+    return sorted(
+        (edge.source.appliance.fqdn, edge.destination.appliance.fqdn,
+         tuple(tuple(pair) for pair in edge.interfaces))
+        for edge in edges
+    )
+
+
+def arp_indexes(loader):
+    """ARP indexes used by refresh and ghosts, by appliance name"""
+    name = {node.uid: node.appliance.fqdn for node in loader.nodes}
+    return (
+        sorted((name[uid], eth, describe([edge]) if edge else None)
+               for (uid, eth), edge in loader.arp_links.items()),
+        sorted((str(ip), sorted((name[uid], eth) for uid, eth in entries))
+               for ip, entries in loader.arp_index.items()),
+        sorted((node.appliance.fqdn, eth, str(ip))
+               for node, eth, ip in loader.missing_neighbor),
+    )
+
+
+@pytest.mark.parametrize('extension', ['npz', 'json'])
+def test_export_round_trip(tmp_path, extension, make_loader):
+    filename = str(tmp_path / ('topology.%s' % extension))
+    exported = make_loader(NETWORK)
+    exported.save_export(filename)
+
+    loader = Loader()
+    loader.load_export(filename)
+    switch1, switch2, switch3 = loader.appliances
+
+    assert switch1.failure is None and switch2.failure is None
+    assert switch3.failure.stage == 'connect'
+    assert switch3.failure.error.args[-1] == 'Appliance switch3'
+    assert loader.failed_appliances == [switch3.failure]
+
+    assert switch1.routes is None and switch3.routes is None
+    assert sorted(routes_to_list(switch2.routes)) == ROUTES
+
+    # Edges are restored, along with the ARP indexes 'build_edges' gives
+    assert describe(loader.edges) == EDGES
+    assert arp_indexes(loader) == arp_indexes(exported)
+    assert describe(loader.aggregate_edges()) == [
+        ('switch1', 'switch2', (('Ethernet1', 'Ethernet1'),))
+    ]
+
+
+def test_export_version_1(tmp_path, make_loader):
+    filename = str(tmp_path / 'topology.npz')
+    make_loader(NETWORK).save_export(filename)
+
+    # Strip what version 1 didn't have
+    with np.load(filename) as arrays:
+        arrays = {
+            name: array for name, array in arrays.items()
+            if not name.startswith(('failure_', 'route_', 'has_routes'))
+        }
+    arrays['format_version'] = np.array(1)
+    np.savez_compressed(filename, **arrays)
+
+    loader = Loader()
+    loader.load_export(filename)
+    assert [app.fqdn for app in loader.appliances] == [
+        'switch1', 'switch2', 'switch3'
+    ]
+    assert all(app.failure is None and app.routes is None
+               for app in loader.appliances)
+    # Built again from ARP entries
+    assert describe(loader.edges) == EDGES
@@ -0,0 +1,109 @@
+""" Ghost nodes : reverse DNS of unknown neighbors, its cache, and grouping.
+"""
+
+import time
+from ipaddress import ip_address
+
+from malachite.ghosts import DNSCache, StubResolver, group_of, resolve_names
+from malachite.utils.config import CONFIG
+
+
+NAMES = {
+    '10.0.1.10': 'web1.example.net',
+    '10.0.1.11': 'web2.example.net',
+}
+
+
+# Two switches sharing a link, each seeing unknown neighbors. 10.0.2.20 has
+# no name.
+NETWORK = [
+    {'fqdn': 'switch1', 'ip_local': {'10.0.0.1': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.2', 'Ethernet2': '10.0.1.10',
+             'Ethernet3': '10.0.1.11'}},
+    {'fqdn': 'switch2', 'ip_local': {'10.0.0.2': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.1', 'Ethernet2': '10.0.2.20'}},
+]
+
+
+def ghost_loader(make_loader, ghosts, resolver, tmp_path):
+    """Loader of NETWORK, with ghost nodes"""
+    return make_loader(NETWORK, ghosts=ghosts, resolver=resolver,
+                       dns_cache=DNSCache(str(tmp_path / 'dns.json')))
+
+
+def test_resolve_names():
+    names = resolve_names(
+        ['10.0.1.10', ip_address('10.0.1.10'), '10.0.2.20'],
+        StubResolver(NAMES)
+    )
+    assert names == {'10.0.1.10': 'web1.example.net', '10.0.2.20': None}
+
+
+def test_slow_lookups_give_up_at_deadline():
+    start = time.monotonic()
+    names = resolve_names(['10.0.1.10', '10.0.1.11'],
+                          StubResolver(NAMES, latency=5), timeout=0.1)
+    assert time.monotonic() - start < 1
+    assert names == {'10.0.1.10': None, '10.0.1.11': None}
+
+
+def test_dns_cache_ttl(tmp_path):
+    cache = DNSCache(str(tmp_path / 'dns.json'), ttl=60)
+    cache.put('10.0.1.10', 'web1.example.net')
+    cache.put('10.0.2.20', None)
+    assert cache.get('10.0.1.10') == (True, 'web1.example.net')
+    assert cache.get('10.0.2.20') == (True, None)
+
+    cache.entries['10.0.1.10'] = ('web1.example.net', time.time() - 61)
+    assert cache.get('10.0.1.10') == (False, None)
+
+    # Expired entries are dropped when saved, and looked up again
+    cache.save()
+    reloaded = DNSCache(str(tmp_path / 'dns.json'), ttl=60)
+    assert reloaded.get('10.0.1.10') == (False, None)
+    assert reloaded.get('10.0.2.20') == (True, None)
+
+    names = resolve_names(['10.0.1.10', '10.0.2.20'],
+                          StubResolver(NAMES), reloaded)
+    assert names == {'10.0.1.10': 'web1.example.net', '10.0.2.20': None}
+
+
+def test_group_of():
+    ip = ip_address('10.0.1.10')
+    assert group_of('host', ip) == '10.0.1.10'
+    assert group_of('subnet', ip) == '10.0.1.0/24'
+    assert group_of('vendor', ip, '00:1c:73:00:00:01',
+                    {'00:1c:73': 'Arista'}) == 'Arista'
+    assert group_of('vendor', ip, '02:00:00:00:00:01') == \
+        'locally administered'
+
+
+def test_ghosts_per_host(tmp_path, make_loader):
+    loader = ghost_loader(make_loader, 'host', StubResolver(NAMES),
+                          tmp_path)
+
+    ghosts = {node.appliance.fqdn: node for node in loader.ghost_nodes}
+    assert set(ghosts) == {'10.0.1.10', '10.0.1.11', '10.0.2.20'}
+    assert ghosts['10.0.1.10'].appliance.name == 'web1.example.net'
+    # Unresolved neighbors are kept, named after their IP
+    assert ghosts['10.0.2.20'].appliance.name == '10.0.2.20'
+    assert ghosts['10.0.2.20'] in loader.nodes
+
+    ghost_edges = [edge for edge in loader.edges
+                   if edge.destination in loader.ghost_nodes]
+    assert len(ghost_edges) == 3
+
+
+def test_ghosts_per_subnet(tmp_path, monkeypatch, make_loader):
+    monkeypatch.setitem(CONFIG['default']['ghosts'], 'dns_timeout', 0.1)
+    loader = ghost_loader(make_loader, 'subnet',
+                          StubResolver(NAMES, latency=5), tmp_path)
+
+    # Every lookup timed out : neighbors are still grouped and drawn
+    ghosts = {node.appliance.fqdn: node.appliance
+              for node in loader.ghost_nodes}
+    assert set(ghosts) == {'10.0.1.0/24', '10.0.2.0/24'}
+    assert ghosts['10.0.1.0/24'].name == '10.0.1.0/24 (2 hosts)'
+    assert sorted(ghosts['10.0.1.0/24'].neighbors) == [
+        ('10.0.1.10', None), ('10.0.1.11', None)
+    ]
@@ -0,0 +1,62 @@
+""" Graph store : rows of removed edges are reused, so rebuilding edges
+    doesn't grow the store.
+"""
+
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+from malachite.models.edge import Edge
+from malachite.models.graph_store import GraphStore
+from malachite.models.node import Node
+
+
+def test_removed_rows_are_reused():
+    store = GraphStore()
+    nodes = [Node(uid, None, store) for uid in range(3)]
+    first = Edge(nodes[0], nodes[1])
+    second = Edge(nodes[1], nodes[2])
+
+    store.remove_edge(first.row)
+    assert store.edge_count == 1
+    assert store.edge_array.tolist() == [[1, 2]]
+    # Detached views keep their ends
+    assert (first.source, first.destination) == (nodes[0], nodes[1])
+    store.remove_edge(first.row)
+    assert store.edge_count == 1
+
+    third = Edge(nodes[2], nodes[0])
+    assert len(store.edge_views) == 2
+    assert (third.source, third.destination) == (nodes[2], nodes[0])
+    assert (second.source, second.destination) == (nodes[1], nodes[2])
+    assert sorted(store.edge_array.tolist()) == [[1, 2], [2, 0]]
+
+
+def test_rows_stay_flat_across_aggregation(make_loader):
+    loader = make_loader(TRIANGLE)
+    loader.aggregate_edges()
+    rows = len(loader.store.edge_views)
+
+    for _ in range(5):
+        loader.aggregate_edges()
+    assert len(loader.store.edge_views) == rows
+    assert len(loader.links) == 2
+
+
+def test_rows_stay_flat_across_refresh(replay_network):
+    network = [dict(spec) for spec in TRIANGLE]
+    replay_network.write(network)
+    loader = Loader(layout='fr')
+    loader.load_nodes(replay_network.inventory)
+    loader.build_edges()
+    loader.aggregate_edges()
+    rows = len(loader.store.edge_views)
+
+    # switch3 link goes down, then up again, twice
+    for _ in range(2):
+        for arp in ({}, {'Ethernet1': '10.0.0.2'}):
+            network[2]['arp'] = arp
+            replay_network.write(network)
+            added, removed, failed = loader.refresh(['switch3'])
+            assert not failed and (added or removed)
+    assert len(loader.store.edge_views) == rows
+    assert loader.store.edge_count == len(loader.edges) + len(loader.links)
@@ -0,0 +1,93 @@
+""" Inventory readers : YAML, JSON lines and CSV give the same records,
+    the latter two being read lazily.
+"""
+
+import pytest
+
+from malachite.inventory import iter_inventory
+from malachite.loader import Loader
+from malachite.utils.exceptions import ErrLoadingFailed
+
+
+RECORDS = [
+    {'fqdn': 'switch1.example.net', 'driver': 'eos', 'name': 'switch1'},
+    {'fqdn': 'switch2.example.net', 'driver': 'junos', 'port': 2222,
+     'site': 'paris'},
+]
+
+INVENTORIES = {
+    'appliances.yaml': '''
+- fqdn: switch1.example.net
+  driver: eos
+  name: switch1
+- fqdn: switch2.example.net
+  driver: junos
+  port: 2222
+  site: paris
+''',
+    'appliances.jsonl': '''
+{"fqdn": "switch1.example.net", "driver": "eos", "name": "switch1"}
+
+{"fqdn": "switch2.example.net", "driver": "junos", "port": 2222, \
+"site": "paris"}
+''',
+    'appliances.csv': '''fqdn,driver,name,port,site
+switch1.example.net,eos,switch1,,
+switch2.example.net,junos,,2222,paris
+''',
+}
+
+
+@pytest.mark.parametrize('filename', sorted(INVENTORIES))
+def test_formats(tmp_path, filename):
+    path = tmp_path / filename
+    path.write_text(INVENTORIES[filename])
+    assert list(iter_inventory(str(path))) == RECORDS
+
+
+@pytest.mark.parametrize('extension', ['jsonl', 'csv'])
+def test_streaming(tmp_path, extension):
+    # Records before an invalid one are read before it is reached
+    path = tmp_path / ('appliances.%s' % extension)
+    lines = INVENTORIES['appliances.%s' % extension].strip().splitlines()
+    path.write_text('\n'.join(lines[:2] + ['{,,}' if extension == 'jsonl'
+                                            else 'switch3,']) + '\n')
+    records = iter_inventory(str(path))
+    assert next(records)['fqdn'] == 'switch1.example.net'
+    with pytest.raises(ErrLoadingFailed) as error:
+        list(records)
+    assert 'appliances.%s' % extension in error.value.args[-1]
+
+
+def test_invalid_inventories(tmp_path):
+    with pytest.raises(ErrLoadingFailed):
+        list(iter_inventory(str(tmp_path / 'missing.jsonl')))
+
+    path = tmp_path / 'appliances.jsonl'
+    path.write_text('{"fqdn": "switch1"}\n')
+    with pytest.raises(ErrLoadingFailed) as error:
+        list(iter_inventory(str(path)))
+    assert error.value.args[-1].endswith('entry 1 : no driver')
+
+    path = tmp_path / 'appliances.yaml'
+    path.write_text('- [switch1, eos]\n')
+    with pytest.raises(ErrLoadingFailed) as error:
+        list(iter_inventory(str(path)))
+    assert error.value.args[-1].endswith('entry 1 : not a mapping')
+
+
+def test_loader_streams_appliances(tmp_path):
+    path = tmp_path / 'appliances.jsonl'
+    path.write_text(INVENTORIES['appliances.jsonl'])
+    loader = Loader()
+
+    appliances = loader.iter_appliances(str(path))
+    first = next(appliances)
+    # Added to the loader as soon as read
+    assert loader.appliances == [first]
+    assert (first.fqdn, first.name, first.driver) == (
+        'switch1.example.net', 'switch1', 'eos'
+    )
+    second = next(appliances)
+    assert (second.port, second.tags) == (2222, {'site': 'paris'})
+
@@ -0,0 +1,83 @@
+""" IP index : owners of local IPs, looked up when building edges and kept
+    up to date by refresh.
+"""
+
+from ipaddress import ip_address
+
+import pytest
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+from malachite.utils.exceptions import ErrRedefinedIP
+
+
+def owners(loader, ip):
+    """(fqdn, interface) owners of an IP"""
+    return [(node.appliance.fqdn, interface)
+            for node, interface in loader.lookup_ip(ip)]
+
+
+def test_lookup_ip(make_loader):
+    loader = make_loader(TRIANGLE)
+
+    assert len(loader.ip_index) == 4
+    assert owners(loader, '10.0.0.2') == [('switch2', 'Ethernet2')]
+    assert owners(loader, ip_address('10.0.0.3')) == [('switch3', 'Ethernet1')]
+    assert owners(loader, '10.9.9.9') == []
+
+
+def test_edges_follow_index(make_loader):
+    network = [dict(spec) for spec in TRIANGLE]
+    # An ARP entry of its own IP, and an unknown neighbor
+    network[0] = dict(network[0], arp={'Ethernet1': '10.0.0.1',
+                                       'Ethernet2': '10.0.0.0',
+                                       'Ethernet3': '10.0.1.10'})
+    loader = make_loader(network)
+
+    assert sorted((edge.source.appliance.fqdn,
+                   edge.destination.appliance.fqdn, tuple(edge.interfaces))
+                  for edge in loader.edges) == [
+        ('switch1', 'switch2', (('Ethernet1', 'Ethernet1'),)),
+        ('switch2', 'switch1', (('Ethernet1', 'Ethernet1'),)),
+        ('switch2', 'switch3', (('Ethernet2', 'Ethernet1'),)),
+        ('switch3', 'switch2', (('Ethernet1', 'Ethernet2'),)),
+    ]
+    assert [(node.appliance.fqdn, eth, str(ip))
+            for node, eth, ip in loader.missing_neighbor] == [
+        ('switch1', 'Ethernet2', '10.0.0.0'),
+        ('switch1', 'Ethernet3', '10.0.1.10'),
+    ]
+
+
+def test_redefined_ip(make_loader):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3 also claims switch1 IP, which switch2 sees
+    network[2] = dict(network[2], ip_local={'10.0.0.3': 'Ethernet1',
+                                            '10.0.0.0': 'Ethernet2'})
+    with pytest.raises(ErrRedefinedIP):
+        make_loader(network)
+
+
+def test_refresh_updates_index(replay_network):
+    network = [dict(spec) for spec in TRIANGLE]
+    replay_network.write(network)
+    loader = Loader(layout='fr')
+    loader.load_nodes(replay_network.inventory)
+    loader.build_edges()
+
+    # 10.0.0.3 moves from switch3 to switch1
+    network[0]['ip_local'] = {'10.0.0.0': 'Ethernet1',
+                              '10.0.0.3': 'Ethernet2'}
+    network[2]['ip_local'] = {'10.0.0.4': 'Ethernet1'}
+    replay_network.write(network)
+    loader.refresh(['switch1', 'switch3'])
+
+    assert owners(loader, '10.0.0.3') == [('switch1', 'Ethernet2')]
+    assert owners(loader, '10.0.0.4') == [('switch3', 'Ethernet1')]
+    # switch2 now reaches switch1 through its Ethernet2 ARP entry
+    assert sorted((edge.destination.appliance.fqdn, tuple(edge.interfaces))
+                  for edge in loader.edges
+                  if edge.source.appliance.fqdn == 'switch2') == [
+        ('switch1', (('Ethernet1', 'Ethernet1'),)),
+        ('switch1', (('Ethernet2', 'Ethernet2'),)),
+    ]
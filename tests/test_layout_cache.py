@@ -0,0 +1,51 @@
+""" Cached layouts are mapped back to nodes by appliance key, not by name.
+"""
+
+from malachite.ghosts import GhostAppliance
+from malachite.layout import LayoutCache
+from malachite.loader import Loader
+from malachite.models.edge import Edge
+
+
+# Chain of appliances sharing the same name, behind a single fqdn, and a
+# ghost neighbor named like them
+NETWORK = [
+    {'fqdn': 'lab', 'name': 'switch', 'port': port}
+    for port in (2201, 2202, 2203)
+] + [{'fqdn': 'lab', 'ghost': [('10.0.0.9', 'switch')]}]
+
+
+def chain_loader(make_loader, tmp_path):
+    """Loader of NETWORK, with a layout cache"""
+    loader = make_loader(NETWORK, layout='fr',
+                         layout_cache=LayoutCache(str(tmp_path)))
+    nodes = loader.nodes
+    for src, dst in ((0, 1), (1, 2), (2, 3)):
+        loader.edges.append(Edge(nodes[src], nodes[dst]))
+    return loader
+
+
+def test_node_id():
+    loader = Loader()
+    appliance = loader._add_appliance({'fqdn': 'lab', 'driver': 'eos',
+                                       'port': 2201})
+    ghost = GhostAppliance('lab', [('10.0.0.9', None)], False)
+    assert LayoutCache.node_id(appliance) == 'lab:2201'
+    assert LayoutCache.node_id(ghost) == 'ghost:lab:0'
+
+
+def test_cached_layout_by_appliance_key(tmp_path, monkeypatch,
+                                        make_loader):
+    first = chain_loader(make_loader, tmp_path)
+    first.build_coordinates()
+    computed = first.store.coordinates.tolist()
+    assert len(list(tmp_path.iterdir())) == 1
+
+    def no_layout(*args, **kwargs):
+        raise AssertionError('Layout should come from the cache')
+
+    monkeypatch.setattr('malachite.loader.compute_layout', no_layout)
+    second = chain_loader(make_loader, tmp_path)
+    second.build_coordinates()
+    assert second.store.coordinates.tolist() == computed
+    assert len({tuple(coord) for coord in computed}) == 4
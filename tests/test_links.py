@@ -0,0 +1,60 @@
+""" Aggregated links : one undirected edge per linked pair of nodes, updated
+    pair by pair when edges change.
+"""
+
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+
+
+def describe(links):
+    """Comparable content of links"""
+    return sorted(
+        (link.source.appliance.fqdn, link.destination.appliance.fqdn,
+         link.bidirectionnal, link.multiplicity, tuple(link.interfaces))
+        for link in links
+    )
+
+
+def test_aggregate_edges(make_loader):
+    network = [dict(spec) for spec in TRIANGLE]
+    # Second link between switch1 and switch2, only seen from switch1
+    network[0] = dict(network[0], arp={'Ethernet1': '10.0.0.1',
+                                       'Ethernet2': '10.0.0.2'})
+    loader = make_loader(network)
+    assert len(loader.edges) == 5
+
+    assert describe(loader.aggregate_edges()) == [
+        ('switch1', 'switch2', True, 2,
+         (('Ethernet1', 'Ethernet1'), ('Ethernet2', 'Ethernet2'))),
+        ('switch2', 'switch3', True, 1, (('Ethernet2', 'Ethernet1'),)),
+    ]
+
+
+def test_update_links_only_touches_changed_pairs(replay_network):
+    network = [dict(spec) for spec in TRIANGLE]
+    replay_network.write(network)
+    loader = Loader(layout='fr')
+    loader.load_nodes(replay_network.inventory)
+    loader.build_edges()
+    loader.aggregate_edges()
+
+    # switch3 stops seeing switch2 : their link becomes one way
+    network[2]['arp'] = {}
+    replay_network.write(network)
+    loader.refresh(['switch3'])
+    updated = describe(loader.links)
+    assert updated == describe(loader.aggregate_edges())
+    assert ('switch2', 'switch3', False, 1,
+            (('Ethernet2', 'Ethernet1'),)) in updated
+
+    # Then switch2 too : the link is dropped, the other one is untouched
+    network[1]['arp'] = {'Ethernet1': '10.0.0.0'}
+    replay_network.write(network)
+    links = {link.destination.appliance.fqdn: link for link in loader.links}
+    loader.refresh(['switch2'])
+    assert [link.destination.appliance.fqdn for link in loader.links] == [
+        'switch2'
+    ]
+    assert loader.links[0] is links['switch2']
+    assert describe(loader.links) == describe(loader.aggregate_edges())
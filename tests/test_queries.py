@@ -0,0 +1,132 @@
+""" Topology queries : BFS over CSR arrays, articulation points and impact
+    of an appliance going down, results following graph changes.
+"""
+
+import pytest
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+from malachite.queries import TopologyQuery
+from malachite.utils.exceptions import ErrNodesNotLoaded, ErrUnknownNode
+
+
+def linked(pairs, count):
+    """ Appliance dicts of switch1..switch<count>, one /31 per linked pair
+        of appliance numbers.
+    """
+    network = [{'fqdn': 'switch%s' % index, 'name': 'switch%s' % index,
+                'ip_local': {}, 'arp': {}} for index in range(1, count + 1)]
+    for subnet, (left, right) in enumerate(pairs):
+        ends = ((left, right, 0), (right, left, 1))
+        for index, peer, offset in ends:
+            spec = network[index - 1]
+            eth = 'Ethernet%s' % (len(spec['ip_local']) + 1)
+            spec['ip_local']['10.0.%s.%s' % (subnet, offset)] = eth
+            spec['arp'][eth] = '10.0.%s.%s' % (subnet, 1 - offset)
+    return network
+
+
+# A ring of 4 (1-2-3-4-1), with a tail 4-5-6 and a spur 5-7, and switch8
+# linked to nothing
+NETWORK = linked([(1, 2), (2, 3), (3, 4), (4, 1), (4, 5), (5, 6), (5, 7)], 8)
+
+
+def names(nodes):
+    return [node.appliance.name for node in nodes]
+
+
+@pytest.fixture
+def query(make_loader):
+    return TopologyQuery(make_loader(NETWORK))
+
+
+def test_shortest_path(query):
+    assert names(query.shortest_path('switch1', 'switch6')) == [
+        'switch1', 'switch4', 'switch5', 'switch6'
+    ]
+    assert names(query.shortest_path('switch2', 'switch4')) in (
+        ['switch2', 'switch1', 'switch4'], ['switch2', 'switch3', 'switch4']
+    )
+    assert names(query.shortest_path('switch3', 'switch3')) == ['switch3']
+    assert query.shortest_path('switch1', 'switch8') == []
+
+    # Nodes are accepted as well as names
+    node = query.loader.nodes[6]
+    assert names(query.shortest_path(node, 'switch6')) == [
+        'switch7', 'switch5', 'switch6'
+    ]
+
+
+def test_k_hop(query):
+    assert [(node.appliance.name, depth)
+            for node, depth in query.k_hop('switch5')] == [
+        ('switch4', 1), ('switch6', 1), ('switch7', 1)
+    ]
+    assert sorted((node.appliance.name, depth)
+                  for node, depth in query.k_hop('switch5', hops=2)) == [
+        ('switch1', 2), ('switch3', 2), ('switch4', 1), ('switch6', 1),
+        ('switch7', 1)
+    ]
+    assert query.k_hop('switch8', hops=3) == []
+
+
+def test_articulation_points(query):
+    assert names(query.articulation_points()) == ['switch4', 'switch5']
+    assert [sorted(names(component))
+            for component in query.connected_components()] == [
+        ['switch%s' % index for index in range(1, 8)], ['switch8']
+    ]
+
+
+def test_impact(query):
+    # switch4 cuts off the tail, switch5 both its leaves
+    assert [sorted(names(piece)) for piece in query.impact('switch4')] == [
+        ['switch5', 'switch6', 'switch7']
+    ]
+    assert sorted(names(piece) for piece in query.impact('switch5')) == [
+        ['switch6'], ['switch7']
+    ]
+    # The ring survives the loss of any of its other members
+    assert query.impact('switch1') == []
+    assert query.impact('switch6') == []
+    assert query.impact('switch8') == []
+
+
+def test_unknown_nodes():
+    with pytest.raises(ErrNodesNotLoaded):
+        TopologyQuery(Loader()).shortest_path('switch1', 'switch2')
+
+
+def test_unknown_node(query):
+    with pytest.raises(ErrUnknownNode):
+        query.impact('switch9')
+
+
+def test_results_follow_graph(replay_network):
+    network = [dict(spec) for spec in TRIANGLE]
+    replay_network.write(network)
+    loader = Loader(layout='fr')
+    loader.load_nodes(replay_network.inventory)
+    loader.build_edges()
+    query = TopologyQuery(loader)
+
+    assert names(query.shortest_path('switch1', 'switch3')) == [
+        'switch1', 'switch2', 'switch3'
+    ]
+    assert names(query.articulation_points()) == ['switch2']
+    # Cached until the graph changes
+    assert query.shortest_path('switch1', 'switch3') \
+        is query.shortest_path('switch1', 'switch3')
+
+    # switch2 and switch3 no longer see each other
+    network[1]['arp'] = {'Ethernet1': '10.0.0.0'}
+    network[2]['arp'] = {}
+    replay_network.write(network)
+    loader.refresh(['switch2', 'switch3'])
+
+    assert query.shortest_path('switch1', 'switch3') == []
+    assert query.articulation_points() == []
+    assert [sorted(names(component))
+            for component in query.connected_components()] == [
+        ['switch1', 'switch2'], ['switch3']
+    ]
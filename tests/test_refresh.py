@@ -0,0 +1,97 @@
+""" Refresh : only re-polled appliances are diffed, and routed edges are
+    only rebuilt for nodes whose routing table changed.
+"""
+
+import pytest
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+
+
+def route_to(prefix, next_hop, interface):
+    """get_route_to output of a single route"""
+    return {prefix: [{
+        'protocol': 'static', 'current_active': True,
+        'next_hop': next_hop, 'outgoing_interface': interface,
+    }]}
+
+
+def describe(edges):
+    """(source, destination) fqdn pairs of edges"""
+    return sorted(
+        (edge.source.appliance.fqdn, edge.destination.appliance.fqdn)
+        for edge in edges
+    )
+
+
+@pytest.fixture
+def network():
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch1 reaches switch3 through switch2
+    network[0]['route_to'] = route_to('10.0.0.3/32', '10.0.0.1', 'Ethernet1')
+    network[1]['route_to'] = {}
+    network[2]['route_to'] = {}
+    return network
+
+
+def load(replay_network, network):
+    replay_network.write(network)
+    loader = Loader(layout='fr', routes=True)
+    loader.load_nodes(replay_network.inventory)
+    loader.build_ip_index()
+    loader.build_edges()
+    loader.build_routed_edges()
+    return loader
+
+
+def test_refresh_without_change(replay_network, network):
+    loader = load(replay_network, network)
+    version = loader.store.version
+    routed = list(loader.routed_edges)
+    assert describe(routed) == [('switch1', 'switch2')]
+
+    assert loader.refresh() == ([], [], [])
+    assert loader.store.version == version
+    assert loader.routed_edges == routed
+
+
+def test_refresh_arp_change(replay_network, network):
+    loader = load(replay_network, network)
+    version = loader.store.version
+    routed = list(loader.routed_edges)
+
+    # switch3 stops seeing switch2
+    network[2]['arp'] = {}
+    replay_network.write(network)
+    added, removed, failed = loader.refresh(['switch3'])
+    assert (added, failed) == ([], [])
+    assert describe(removed) == [('switch3', 'switch2')]
+    assert loader.store.version != version
+    assert describe(loader.edges) == [
+        ('switch1', 'switch2'), ('switch2', 'switch1'), ('switch2', 'switch3')
+    ]
+    # Routes didn't change : routed edges are kept as is
+    assert loader.routed_edges == routed
+
+    # And sees it again
+    version = loader.store.version
+    network[2]['arp'] = {'Ethernet1': '10.0.0.2'}
+    replay_network.write(network)
+    added, removed, failed = loader.refresh(['switch3'])
+    assert describe(added) == [('switch3', 'switch2')]
+    assert (removed, failed) == ([], [])
+    assert loader.store.version != version
+
+
+def test_refresh_route_change(replay_network, network):
+    loader = load(replay_network, network)
+    routed = list(loader.routed_edges)
+
+    # switch2 gets a route to switch1 : only its routed edges are rebuilt
+    network[1]['route_to'] = route_to('10.0.0.0/32', '10.0.0.0', 'Ethernet1')
+    replay_network.write(network)
+    assert loader.refresh(['switch2']) == ([], [], [])
+    assert describe(loader.routed_edges) == [
+        ('switch1', 'switch2'), ('switch2', 'switch1')
+    ]
+    assert loader.routed_edges[0] is routed[0]
@@ -0,0 +1,134 @@
+""" Retries (bounded in attempts and in time) and circuit breakers kept
+    between runs.
+"""
+
+import pytest
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+from malachite.resilience import CircuitBreaker, retry
+from malachite.utils.exceptions import ErrConnectionFailed, ErrInvalidDriver
+
+
+class Clock:
+    """Fake time : sleeping and failing calls make it move"""
+
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def failing(clock, duration, errors, result='done'):
+    """Function raising 'errors' in turn, each call lasting 'duration'"""
+    errors = list(errors)
+    calls = []
+
+    def func():
+        calls.append(clock.now)
+        clock.now += duration
+        if errors:
+            raise errors.pop(0)
+        return result
+    return func, calls
+
+
+def test_retry_backoff():
+    clock = Clock()
+    func, calls = failing(clock, 0, [ErrConnectionFailed('down')] * 2)
+    assert retry(func, attempts=3, backoff=4, max_backoff=6, max_time=0,
+                 sleep=clock.sleep, clock=clock) == 'done'
+    assert len(calls) == 3
+    # Doubled, capped, and randomized down to half
+    assert 2 <= clock.sleeps[0] <= 4 and 3 <= clock.sleeps[1] <= 6
+
+
+def test_retry_gives_up():
+    clock = Clock()
+    func, calls = failing(clock, 0, [ErrConnectionFailed('down')] * 3)
+    with pytest.raises(ErrConnectionFailed):
+        retry(func, attempts=3, backoff=1, sleep=clock.sleep, clock=clock)
+    assert len(calls) == 3
+
+    # Errors which would happen again are not retried
+    func, calls = failing(clock, 0, [ErrInvalidDriver('nope')])
+    with pytest.raises(ErrInvalidDriver):
+        retry(func, attempts=3, sleep=clock.sleep, clock=clock)
+    assert len(calls) == 1
+
+
+def test_retry_time_budget():
+    clock = Clock()
+    # Each attempt times out after 60s
+    func, calls = failing(clock, 60, [ErrConnectionFailed('timeout')] * 5)
+    with pytest.raises(ErrConnectionFailed):
+        retry(func, attempts=5, backoff=1, max_time=90, sleep=clock.sleep,
+              clock=clock)
+    assert len(calls) == 2
+    assert clock.now < 180
+
+
+def test_breaker_opens_and_persists(tmp_path):
+    filename = str(tmp_path / 'breaker.json')
+    key = ('switch1', 443)
+    breaker = CircuitBreaker(filename, threshold=2, cooldown=10,
+                             max_cooldown=15)
+
+    assert not breaker.failed(key, ErrConnectionFailed('Appliance %s',
+                                                       'switch1'), now=0)
+    assert breaker.allow(key, now=0)
+    assert breaker.failed(key, ErrConnectionFailed('down'), now=0)
+    assert not breaker.allow(key, now=5)
+    assert breaker.allow(key, now=10)
+    breaker.save()
+
+    # Next run : still open, cool-down doubled (and capped) on new failure
+    breaker = CircuitBreaker(filename, threshold=2, cooldown=10,
+                             max_cooldown=15)
+    state = breaker.state(key)
+    assert (state['failures'], state['open_until']) == (2, 10)
+    assert state['error'] == 'down'
+    assert breaker.failed(key, now=10)
+    assert breaker.state(key)['open_until'] == 25
+    breaker.succeeded(key)
+    assert breaker.allow(key, now=11) and breaker.state(key) is None
+
+
+def test_breaker_save_keeps_other_writers(tmp_path):
+    filename = str(tmp_path / 'breaker.json')
+    first = CircuitBreaker(filename, threshold=1)
+    second = CircuitBreaker(filename, threshold=1)
+    first.failed(('switch1', 443))
+    second.failed(('switch2', 443))
+    first.save()
+    second.save()
+
+    merged = CircuitBreaker(filename)
+    assert merged.state(('switch1', 443)) is not None
+    assert merged.state(('switch2', 443)) is not None
+
+
+def test_breaker_skips_dead_appliance(replay_network, tmp_path):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3 can't be connected to
+    del network[2]['ip_local']
+    replay_network.write(network)
+    breaker_file = str(tmp_path / 'breaker.json')
+
+    def run():
+        loader = Loader(attempts=2, breaker=CircuitBreaker(
+            breaker_file, threshold=1, cooldown=600
+        ))
+        loader.read_appliances(replay_network.inventory)
+        loader._napalm_enrich()
+        return [(failure.appliance.fqdn, failure.stage)
+                for failure in loader.failed_appliances]
+
+    assert run() == [('switch3', 'connect')]
+    assert run() == [('switch3', 'breaker')]
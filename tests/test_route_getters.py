@@ -0,0 +1,82 @@
+""" Routing tables collected from EOS, from a 'show ip route detail' eAPI
+    reply (recorded with every VRF : only the default one is kept).
+"""
+
+import json
+import os
+from ipaddress import ip_address
+
+from malachite.batched_getters import ROUTE_GETTERS
+from malachite.napalm_collector import NapalmMiddleware
+from malachite.routing import routes_from_napalm
+
+
+REPLY_FILE = os.path.join(
+    os.path.dirname(__file__), 'data', 'eos_show_ip_route_vrf_all_detail.json'
+)
+
+
+class FakeEOSDevice:
+    """Open EOS device answering eAPI commands from a recorded reply"""
+
+    def __init__(self):
+        with open(REPLY_FILE) as r_file:
+            self.reply = json.load(r_file)
+        self.commands = []
+
+    def _run_commands(self, commands):
+        self.commands.append(commands)
+        return [self.reply for _ in commands]
+
+    def get_route_to(self, destination='', protocol='', longer=False):
+        raise AssertionError('get_route_to must not be called')
+
+
+def test_eos_route_table():
+    device = FakeEOSDevice()
+    route_table = ROUTE_GETTERS['eos'](device)
+
+    assert device.commands == [['show ip route detail']]
+    # MGMT VRF routes are left out
+    assert set(route_table) == {
+        '0.0.0.0/0', '10.0.0.0/31', '10.0.0.2/31', '192.168.255.2/32',
+        '172.16.0.0/16',
+    }
+    assert [(route['next_hop'], route['outgoing_interface'])
+            for route in route_table['0.0.0.0/0']] == [
+        ('10.0.0.0', 'Ethernet1')
+    ]
+    # One route per next hop
+    loopback = route_table['192.168.255.2/32']
+    assert [(route['next_hop'], route['outgoing_interface'])
+            for route in loopback] == [('10.0.0.0', 'Ethernet1'),
+                                       ('10.0.0.2', 'Ethernet2')]
+    assert loopback[0]['protocol'] == 'ospfIntraArea'
+    assert loopback[0]['preference'] == 110
+    assert {route['routing_table'] for routes in route_table.values()
+            for route in routes} == {'default'}
+
+
+def test_eos_route_table_lookup():
+    routes = routes_from_napalm(ROUTE_GETTERS['eos'](FakeEOSDevice()))
+
+    assert routes.lookup('192.168.255.2')[2] == (
+        (ip_address('10.0.0.0'), 'Ethernet1'),
+        (ip_address('10.0.0.2'), 'Ethernet2'),
+    )
+    assert routes.lookup('10.0.0.3')[2] == ((None, 'Ethernet2'),)
+    # Through the default VRF default route, never the MGMT one
+    assert routes.lookup('8.8.8.8')[2] == (
+        (ip_address('10.0.0.0'), 'Ethernet1'),
+    )
+    assert routes.lookup('192.168.121.5')[2] == (
+        (ip_address('10.0.0.0'), 'Ethernet1'),
+    )
+
+
+def test_middleware_uses_route_getter():
+    middleware = NapalmMiddleware('eos')
+    middleware.devices[('spine1', 0)] = FakeEOSDevice()
+
+    route_table = middleware.get_route_table(('spine1', 0), timeout=5)
+    assert '0.0.0.0/0' in route_table
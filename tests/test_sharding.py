@@ -0,0 +1,110 @@
+""" Sharded collection : appliances are split in stable shards, and shard
+    files merged back into a single Loader, IPs of every shard being checked
+    against each other.
+"""
+
+import json
+
+import pytest
+from conftest import TRIANGLE
+
+from malachite.inventory import iter_inventory, shard_of
+from malachite.loader import Loader
+from malachite.sharding import collect_shard
+from malachite.utils.exceptions import ErrLoadingFailed, ErrRedefinedIP
+
+
+def test_shards(tmp_path):
+    path = tmp_path / 'appliances.jsonl'
+    path.write_text(''.join(
+        '{"fqdn": "switch%s", "driver": "eos"}\n' % index
+        for index in range(50)
+    ))
+    records = list(iter_inventory(str(path)))
+    assert all(0 <= shard_of(record, 4) < 4 for record in records)
+    # Stable across processes (not Python salted hash), no port being 0
+    assert shard_of({'fqdn': 'switch1'}, 1000) == 589
+    assert shard_of({'fqdn': 'switch1', 'port': 0}, 1000) == 589
+
+    shards = []
+    for index in range(4):
+        loader = Loader()
+        shards.append([app.fqdn for app in
+                       loader.iter_appliances(str(path), (index, 4))])
+    assert sorted(fqdn for shard in shards for fqdn in shard) == sorted(
+        record['fqdn'] for record in records
+    )
+    assert all(shards)
+
+
+def collect(replay_network, tmp_path, appliances, name):
+    """Shard file of appliances, collected as a single shard"""
+    replay_network.write(appliances)
+    filename = str(tmp_path / 'shards' / name)
+    collect_shard(replay_network.inventory, 0, 1, filename)
+    return filename
+
+
+def merge(shard_files):
+    """Loader merging shard files, edges built"""
+    loader = Loader()
+    results = list(loader.iter_shards(shard_files))
+    loader.build_ip_index()
+    loader.build_edges()
+    return loader, results
+
+
+def test_merge(replay_network, tmp_path):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3 can't be connected to
+    del network[2]['ip_local']
+    shard_files = [
+        collect(replay_network, tmp_path, network[:1], 's1.json'),
+        collect(replay_network, tmp_path, network[1:], 's2.json'),
+    ]
+    loader, results = merge(shard_files)
+
+    assert [result.appliance.fqdn for result in results] == [
+        'switch1', 'switch2', 'switch3'
+    ]
+    # Edges span shards
+    assert sorted((edge.source.appliance.fqdn,
+                   edge.destination.appliance.fqdn)
+                  for edge in loader.edges) == [
+        ('switch1', 'switch2'), ('switch2', 'switch1'),
+    ]
+    # Failures are carried over
+    failure, = loader.failed_appliances
+    assert failure.appliance.fqdn == 'switch3'
+    assert failure.appliance.failure is failure
+    assert failure.stage == results[2].failure.stage == 'connect'
+    assert isinstance(failure.error, ErrLoadingFailed)
+
+
+def test_redefined_ip_across_shards(replay_network, tmp_path):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3, in another shard, also claims switch1 IP
+    network[2] = dict(network[2], ip_local={'10.0.0.3': 'Ethernet1',
+                                            '10.0.0.0': 'Ethernet2'})
+    shard_files = [
+        collect(replay_network, tmp_path, network[:2], 's1.json'),
+        collect(replay_network, tmp_path, network[2:], 's2.json'),
+    ]
+    with pytest.raises(ErrRedefinedIP):
+        merge(shard_files)
+
+
+def test_invalid_shards(replay_network, tmp_path):
+    shard_file = collect(replay_network, tmp_path, TRIANGLE[:1], 's1.json')
+    # The same appliance collected by two shards
+    with pytest.raises(ErrLoadingFailed) as error:
+        merge([shard_file, shard_file])
+    assert 'switch1' in error.value.args[-1]
+
+    with pytest.raises(ErrLoadingFailed):
+        merge([str(tmp_path / 'missing.json')])
+
+    with open(shard_file, 'w') as s_file:
+        json.dump({'shard': 0, 'shards': 1}, s_file)
+    with pytest.raises(ErrLoadingFailed):
+        merge([shard_file])
@@ -0,0 +1,76 @@
+""" Snapshot cache : entries expire after their max age, and cached
+    appliances are not polled again.
+"""
+
+import time
+
+from conftest import TRIANGLE
+
+from malachite.loader import Loader
+from malachite.models.appliance import Appliance
+from malachite.snapshot_cache import SnapshotCache
+
+
+ARP = [{'interface': 'Ethernet1', 'ip': '10.0.0.1', 'age': 1.0,
+        'mac': '00:1c:73:00:00:01'}]
+IPS = {'Ethernet1': {'ipv4': {'10.0.0.0': {'prefix_length': 31}}}}
+
+
+def test_entry_ttl(tmp_path):
+    cache = SnapshotCache(str(tmp_path), max_age=60)
+    appliance = Appliance('switch1', 'eos')
+    assert cache.get(appliance) is None
+
+    cache.put(appliance, ARP, IPS, timestamp=time.time() - 30)
+    assert cache.get(appliance) == (ARP, IPS, None)
+    # Per lookup max age
+    assert cache.get(appliance, max_age=10) is None
+    cache.put(appliance, ARP, IPS, timestamp=time.time() - 90)
+    assert cache.get(appliance) is None
+
+    # 0 : every entry is stale
+    cache.put(appliance, ARP, IPS, {'10.0.0.0/31': []})
+    assert cache.get(appliance) == (ARP, IPS, {'10.0.0.0/31': []})
+    assert SnapshotCache(str(tmp_path), max_age=0).get(appliance) is None
+
+
+def test_entries_are_per_appliance(tmp_path):
+    cache = SnapshotCache(str(tmp_path), max_age=60)
+    cache.put(Appliance('switch1', 'eos'), ARP, IPS)
+
+    other_port = Appliance('switch1', 'eos')
+    other_port.port = 2222
+    assert cache.get(other_port) is None
+    assert cache.get(Appliance('switch1', 'junos')) is None
+    assert cache.get(Appliance('switch2', 'eos')) is None
+    (tmp_path / 'garbage.json').write_text('{')
+    assert cache.get(Appliance('switch1', 'eos')) == (ARP, IPS, None)
+
+
+def test_cached_appliances_are_not_polled(replay_network, tmp_path):
+    cache = SnapshotCache(str(tmp_path / 'cache'), max_age=60)
+    replay_network.write(TRIANGLE)
+
+    def load():
+        loader = Loader(cache=cache)
+        loader.read_appliances(replay_network.inventory)
+        return {result.appliance.fqdn: result.source
+                for result in loader.iter_enrich()}, loader
+
+    sources, _ = load()
+    assert set(sources.values()) == {'napalm'}
+
+    # Fixtures changed : cached data is used anyway while fresh
+    network = [dict(spec) for spec in TRIANGLE]
+    network[2]['arp'] = {}
+    replay_network.write(network)
+    sources, loader = load()
+    assert set(sources.values()) == {'cache'}
+    assert len(loader.appliances[2].ip_arp_table) == 1
+
+    # Unless reads are disabled
+    loader = Loader(cache=cache)
+    loader.read_appliances(replay_network.inventory)
+    results = list(loader.iter_enrich(use_cache=False))
+    assert {result.source for result in results} == {'napalm'}
+    assert loader.appliances[2].ip_arp_table == {}
@@ -0,0 +1,74 @@
+""" Malachite.algorithm : one StageEvent per appliance collected, then
+    one per stage, in pipeline order.
+"""
+
+import webbrowser
+
+from conftest import TRIANGLE
+
+from malachite.ghosts import StubResolver
+from malachite.loader import EnrichResult
+from malachite.malachite import Malachite
+
+
+def run(replay_network, tmp_path, monkeypatch, **options):
+    """Events of a whole run, the graph being written without opening it"""
+    monkeypatch.setattr(webbrowser, 'open', lambda *_, **__: True)
+    malachite = Malachite(
+        app_file=replay_network.inventory,
+        graph_file=str(tmp_path / 'graph.html'), layout='fr', **options
+    )
+    events = malachite.algorithm()
+    # Nothing is done until events are consumed
+    assert malachite.loader is None
+    return list(events), malachite
+
+
+def test_stage_events(replay_network, tmp_path, monkeypatch):
+    network = [dict(spec) for spec in TRIANGLE]
+    # switch3 can't be connected to
+    del network[2]['ip_local']
+    replay_network.write(network)
+    events, _ = run(replay_network, tmp_path, monkeypatch)
+
+    appliance_events = events[:3]
+    assert sorted(event.name for event in appliance_events) == [
+        'switch1', 'switch2', 'switch3'
+    ]
+    for event in appliance_events:
+        assert event.stage == 'enrich' and event.cpu_time is None
+        assert isinstance(event.detail, EnrichResult)
+    failed = [event.detail for event in appliance_events
+              if event.detail.failure]
+    assert [result.appliance.name for result in failed] == ['switch3']
+
+    assert [(event.stage, event.name, event.items) for event in events[3:]] \
+        == [('load', None, 3), ('enrich', None, 3), ('edges', None, 2),
+            ('aggregate', None, 1), ('layout', None, 3), ('plot', None, 4)]
+    enrich = events[4]
+    assert [failure.appliance.name for failure in enrich.detail] == [
+        'switch3'
+    ]
+    assert all(event.wall_time >= 0 for event in events)
+    assert (tmp_path / 'graph.html').exists()
+
+
+def test_optional_stage_events(replay_network, tmp_path, monkeypatch):
+    network = [dict(spec) for spec in TRIANGLE]
+    # An unknown neighbor, and a route from switch1 to switch3
+    network[0]['arp'] = {'Ethernet1': '10.0.0.1', 'Ethernet2': '10.0.1.10'}
+    network[0]['route_to'] = {'10.0.0.3/32': [{
+        'protocol': 'static', 'current_active': True,
+        'next_hop': '10.0.0.1', 'outgoing_interface': 'Ethernet1',
+    }]}
+    network[1]['route_to'] = network[2]['route_to'] = {}
+    replay_network.write(network)
+    events, malachite = run(replay_network, tmp_path, monkeypatch,
+                            ghosts='host', resolver=StubResolver(),
+                            routes=True)
+
+    assert [(event.stage, event.items) for event in events[3:]] == [
+        ('load', 3), ('enrich', 3), ('edges', 4), ('ghosts', 1),
+        ('aggregate', 3), ('routes', 1), ('layout', 4), ('plot', 7),
+    ]
+    assert malachite.loader.route_failures == []
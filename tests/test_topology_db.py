@@ -0,0 +1,108 @@
+""" Topology snapshots : saved and loaded back with tags, failures, ARP
+    MACs, routes and ghosts, looked up by IP, and pruned.
+"""
+
+import sqlite3
+
+from malachite.ghosts import StubResolver
+from malachite.loader import Loader
+from malachite.routing import routes_to_list
+from malachite.topology_db import TopologyDB
+
+
+ROUTES = [
+    ['10.0.0.0/31', [[None, 'Ethernet1']]],
+    ['10.1.0.0/24', [['10.0.0.0', 'Ethernet1']]],
+]
+
+
+# switch1 also sees an unknown neighbor
+NETWORK = [
+    {'fqdn': 'switch1', 'tags': {'site': 'paris'},
+     'ip_local': {'10.0.0.0': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.1', 'Ethernet2': '10.0.1.10'},
+     'macs': {'Ethernet1': '00:1c:73:00:00:02'}},
+    {'fqdn': 'switch2', 'port': 2222, 'ip_local': {'10.0.0.1': 'Ethernet1'},
+     'arp': {'Ethernet1': '10.0.0.0'}, 'routes': ROUTES},
+    {'fqdn': 'switch3', 'failure': ('connect', 'Appliance switch3')},
+]
+
+
+def describe(loader):
+    """Comparable content of a loader"""
+    return {
+        'appliances': [
+            (app.fqdn, app.port, app.tags, app.arp_macs,
+             routes_to_list(app.routes) if app.routes else None,
+             (app.failure.stage, app.failure.error.args[-1])
+             if app.failure else None)
+            for app in loader.appliances
+        ],
+        'ghosts': [(node.appliance.fqdn, node.appliance.neighbors)
+                   for node in loader.ghost_nodes],
+        'edges': sorted(
+            (edge.source.appliance.fqdn, edge.destination.appliance.fqdn,
+             tuple(edge.interfaces))
+            for edge in loader.edges
+        ),
+        'coordinates': loader.store.coordinates.tolist(),
+    }
+
+
+def test_snapshot_round_trip(tmp_path, make_loader):
+    loader = make_loader(NETWORK, ghosts='host', resolver=StubResolver(
+        {'10.0.1.10': 'web1.example.net'}
+    ))
+    loader.store.set_coordinates(
+        [[float(row), 0., 1.] for row in range(len(loader.nodes))]
+    )
+    db = TopologyDB(str(tmp_path / 'topology.sqlite'))
+    snapshot_id = db.save(loader, label='first', timestamp=1000)
+
+    loaded = Loader()
+    assert loaded.load_snapshot(db, snapshot_id) == snapshot_id
+    assert describe(loaded) == describe(loader)
+    assert len(loaded.ghost_nodes) == 1
+    assert loaded.failed_appliances == [loaded.appliances[2].failure]
+    assert db.snapshots() == [(snapshot_id, 1000, 'first', 3)]
+
+    assert db.find_ip('10.0.0.1') == {
+        'local': [(snapshot_id, 'switch2', 'Ethernet1')],
+        'arp': [(snapshot_id, 'switch1', 'Ethernet1')],
+    }
+    second = db.save(loader, timestamp=2000)
+    assert db.prune(1500) == 1
+    assert [row[0] for row in db.snapshots()] == [second]
+    db.close()
+
+
+def test_older_database_is_migrated(tmp_path, make_loader):
+    filename = str(tmp_path / 'topology.sqlite')
+    # Tables as created before tags, failures, MACs and routes
+    connection = sqlite3.connect(filename)
+    connection.executescript('''
+        CREATE TABLE snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                created REAL NOT NULL, label TEXT);
+        CREATE TABLE appliances (snapshot_id INTEGER NOT NULL,
+            uid INTEGER NOT NULL, name TEXT NOT NULL, fqdn TEXT NOT NULL,
+            port INTEGER NOT NULL, driver TEXT NOT NULL,
+            x REAL, y REAL, z REAL, PRIMARY KEY (snapshot_id, uid));
+        CREATE TABLE arp_entries (snapshot_id INTEGER NOT NULL,
+            uid INTEGER NOT NULL, interface TEXT NOT NULL, ip TEXT NOT NULL);
+        INSERT INTO snapshots VALUES (1, 1000, NULL);
+        INSERT INTO appliances VALUES (1, 0, 'switch1', 'switch1', 0, 'eos',
+                                       0, 0, 0);
+        INSERT INTO arp_entries VALUES (1, 0, 'Ethernet1', '10.0.0.1');
+    ''')
+    connection.close()
+
+    db = TopologyDB(filename)
+    loaded = Loader()
+    loaded.load_snapshot(db, 1)
+    switch1 = loaded.appliances[0]
+    assert (switch1.tags, switch1.failure, switch1.routes) == ({}, None, None)
+    assert [str(ip) for ip in switch1.ip_arp_table.values()] == ['10.0.0.1']
+
+    snapshot_id = db.save(make_loader(NETWORK))
+    assert len(db.read(snapshot_id)[1]) == 3
+    db.close()